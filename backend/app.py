@@ -4,12 +4,14 @@ import threading
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from utils.reminders_manager import reminder_scheduler, send_email as send_email_smtp
+from utils.email_outbox import start_email_sender
 from routes.projects import projects_bp
 from routes.duplicates import duplicates_bp
-from routes.delete_account import delete_account_bp
+from routes.delete_account import delete_account_bp, start_account_deletion_resumer
 from routes.garden import garden_bp
 from routes.activities import activities_bp
 from routes.reminders import reminders_bp
+from routes.events import events_bp
 
 
 def create_app():
@@ -23,9 +25,12 @@ def create_app():
     app.register_blueprint(garden_bp, url_prefix="/api/garden")
     app.register_blueprint(activities_bp, url_prefix="/api/activities")
     app.register_blueprint(reminders_bp, url_prefix="/api/reminders")
+    app.register_blueprint(events_bp, url_prefix="/api/events")
 
     if os.environ.get("RUN_MAIN") == "true" or os.environ.get("SPACE_ID"):
         threading.Thread(target=reminder_scheduler, daemon=True).start()
+        start_email_sender()
+        start_account_deletion_resumer()
 
     @app.route("/", methods=["GET"])
     def home():
@@ -1,10 +1,14 @@
 # backend/routes/delete_account.py
-import os
+import os, threading
 from flask import Blueprint, request, jsonify
 from appwrite.exception import AppwriteException
 from appwrite.services.users import Users
-from appwrite.query import Query
-from utils.appwrite_client import get_env_str
+from utils.appwrite_client import get_appwrite_client, get_database_client, get_storage_client
+from utils.cascade_delete import get_deletion_job, run_cascade_deletion, start_deletion_resumer
+from utils.garden_stats import discard_pending_garden_stats
+from utils.blocking import drop_project_blocking
+from utils.fingerprint_index import drop_project_index
+from utils.project_clients import invalidate_project
 from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.services.storage import Storage
@@ -19,22 +23,67 @@ USER_ACTIVITIES_COLLECTION = "activities"
 USER_REMINDERS_COLLECTION = "reminders"
 PROFILE_BUCKET = os.getenv("APPWRITE_BUCKET_ID", "profile_pictures")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+DELETE_ACCOUNT_SYNC_TIMEOUT = float(os.getenv("DELETE_ACCOUNT_SYNC_TIMEOUT", "20"))
 
 # Helpers: Initialize Appwrite clients
 def get_appwrite_client_server() -> Client:
-    client = Client()
-    client.set_endpoint(get_env_str("APPWRITE_ENDPOINT"))
-    client.set_project(get_env_str("APPWRITE_PROJECT"))
-    client.set_key(get_env_str("APPWRITE_API_KEY"))  
-    return client
+    return get_appwrite_client()
 
 
 def get_database_client_server() -> Databases:
-    return Databases(get_appwrite_client_server())
+    return get_database_client()
 
 
 def get_storage_client_server() -> Storage:
-    return Storage(get_appwrite_client_server())
+    return get_storage_client()
+
+
+def delete_account_data(user_id, users_client, db_client):
+    """Cascade-delete everything the user owns, then their sessions and account."""
+    def finish():
+        # Delete user sessions
+        try:
+            users_client.delete_sessions(user_id)
+        except AppwriteException as e:
+            print(f"[WARN] Failed to delete user sessions: {str(e)}")
+
+        # Delete user account
+        users_client.delete(user_id)
+
+    def forget_project(proj):
+        invalidate_project(proj.get("projectId"))
+        drop_project_index(proj.get("projectId"))
+        drop_project_blocking(proj.get("projectId"))
+
+    return run_cascade_deletion(
+        user_id,
+        db_client,
+        DATABASE_ID,
+        [
+            DUPLICATES_COLLECTION,
+            USER_PROJECTS_COLLECTION,
+            GARDEN_STATS_COLLECTION,
+            USER_ACTIVITIES_COLLECTION,
+            USER_REMINDERS_COLLECTION
+        ],
+        finish,
+        on_deleted={USER_PROJECTS_COLLECTION: forget_project}
+    )
+
+
+def resume_account_deletion(user_id):
+    """Resume a failed or orphaned account deletion in the background."""
+    discard_pending_garden_stats(user_id)
+    threading.Thread(
+        target=delete_account_data,
+        args=(user_id, Users(get_appwrite_client_server()), get_database_client_server()),
+        name=f"account-deletion-{user_id}",
+        daemon=True
+    ).start()
+
+
+def start_account_deletion_resumer():
+    start_deletion_resumer(resume_account_deletion)
 
 
 # Delete Account Route: Delete a user account and associated data
@@ -70,88 +119,43 @@ def delete_account():
         except AppwriteException as e:
             print(f"[WARN] Profile picture not found or failed to delete: {str(e)}")
 
-        # Delete duplicates
-        try:
-            duplicates = db_client.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=DUPLICATES_COLLECTION,
-                queries=[Query.equal("userId", user_id)]
-            ).get("documents", [])
-
-            for doc in duplicates:
-                db_client.delete_document(DATABASE_ID, DUPLICATES_COLLECTION, doc["$id"])
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete duplicates: {str(e)}")
-
-        # Delete user projects
-        try:
-            projects = db_client.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=USER_PROJECTS_COLLECTION,
-                queries=[Query.equal("userId", user_id)]
-            ).get("documents", [])
-
-            for proj in projects:
-                db_client.delete_document(DATABASE_ID, USER_PROJECTS_COLLECTION, proj["$id"])
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete user projects: {str(e)}")
-
-        # Delete user garden stats
-        try:
-            garden_stats = db_client.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=GARDEN_STATS_COLLECTION,
-                queries=[Query.equal("userId", user_id)]
-            ).get("documents", [])
-
-            for stat in garden_stats:
-                db_client.delete_document(DATABASE_ID, GARDEN_STATS_COLLECTION, stat["$id"])
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete user garden stats: {str(e)}")
-
-        # Delete user activities
-        try:
-            activities = db_client.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=USER_ACTIVITIES_COLLECTION,
-                queries=[Query.equal("userId", user_id)]
-            ).get("documents", [])
-
-            for act in activities:
-                db_client.delete_document(DATABASE_ID, USER_ACTIVITIES_COLLECTION, act["$id"])
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete user activities: {str(e)}")
-
-        # Delete user reminders
-        try:
-            reminders = db_client.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=USER_REMINDERS_COLLECTION,
-                queries=[Query.equal("userId", user_id)]
-            ).get("documents", [])
-
-            for rem in reminders:
-                db_client.delete_document(DATABASE_ID, USER_REMINDERS_COLLECTION, rem["$id"])
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete user reminders: {str(e)}")
-
-        # Delete user sessions
-        try:
-            users_client.delete_sessions(user_id)
-        except AppwriteException as e:
-            print(f"[WARN] Failed to delete user sessions: {str(e)}")
+        # Unflushed garden stats would otherwise recreate the stats document
+        discard_pending_garden_stats(user_id)
 
-        # Delete user account
-        try:
-            users_client.delete(user_id)
-        except AppwriteException as e:
-            print(f"[ERROR] Failed to delete user account: {str(e)}")
-            return jsonify({"error": "Failed to delete user account"}), 400
+        # Runs in the background so large accounts outlive the request; failures are resumed automatically
+        outcome = {}
+        worker = threading.Thread(
+            target=lambda: outcome.update(job=delete_account_data(user_id, users_client, db_client)),
+            daemon=True
+        )
+        worker.start()
+        worker.join(DELETE_ACCOUNT_SYNC_TIMEOUT)
+
+        job = outcome.get("job") if not worker.is_alive() else None
+        if job is None:
+            return (
+                jsonify({
+                    "status": "in_progress",
+                    "message": "Account deletion is still running, check /delete-account/status",
+                    "job": get_deletion_job(user_id)
+                }),
+                202,
+                {"Access-Control-Allow-Origin": FRONTEND_URL},
+            )
+
+        if job["state"] != "completed":
+            print(f"[ERROR] Failed to delete user account: {job['error']}")
+            return (
+                jsonify({"error": "Failed to delete user account", "job": job}),
+                500,
+                {"Access-Control-Allow-Origin": FRONTEND_URL},
+            )
 
         return (
             jsonify({
                 "success": True,
-                "message": "User, profile picture, duplicates, and projects deleted successfully"
+                "message": "User, profile picture, duplicates, and projects deleted successfully",
+                "job": job
             }),
             200,
             {"Access-Control-Allow-Origin": FRONTEND_URL},
@@ -163,3 +167,16 @@ def delete_account():
             500,
             {"Access-Control-Allow-Origin": FRONTEND_URL},
         )
+
+
+# Delete Account Status Route: Progress of a running or finished account deletion
+@delete_account_bp.route("/delete-account/status", methods=["GET"])
+def delete_account_status():
+    user_id = request.args.get("userId")
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+
+    job = get_deletion_job(user_id)
+    if job is None:
+        return jsonify({"error": "No account deletion found"}), 404
+    return jsonify(job), 200, {"Access-Control-Allow-Origin": FRONTEND_URL}
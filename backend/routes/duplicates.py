@@ -1,56 +1,38 @@
 # routes/duplicates.py
-import os, json, requests, time, uuid
-from flask import Blueprint, request, jsonify
+import os, json, time
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from dotenv import load_dotenv
-from utils.appwrite_client import get_database_client, get_storage_client
-from utils.embedding_utils import detect_textual_duplicates
-from utils.file_utils import detect_file_duplicates
+from utils.appwrite_client import get_database_client, list_all_documents
+from utils.blocking import (
+    BlockingConfigError, block_records, delete_blocking_config, get_blocking_config, save_blocking_config,
+    validate_blocking_config
+)
 from utils.garden_stats import update_garden_stats
-from cryptography.fernet import Fernet
+from utils.http_cache import cached_json_response
+from utils.duplicate_records import delete_duplicate_records
+from utils.fingerprint_index import load_bucket_index, query_bucket_index
+from utils.project_clients import ProjectAccessError, get_owned_project, get_project_clients
+from utils.scan_service import ScanError, run_scan
+from utils.scan_results import invalidate_scan_results
+from utils.scan_scheduler import get_scan_scheduler
+from utils.scan_jobs import submit_scan_job, get_scan_job, get_scan_job_result, get_scan_job_events
 from appwrite.query import Query
-from threading import Lock
 
 load_dotenv()
 duplicates_bp = Blueprint("duplicates", __name__)
 
-# Fernet Encryption: For User Project API Keys
-fernet_key = os.getenv("FERNET_KEY")
-if not fernet_key:
-    raise ValueError("FERNET_KEY environment variable is required")
-f = Fernet(fernet_key.encode())
-
 DUPLICATES_COLLECTION = os.getenv("APPWRITE_DUPLICATES_COLLECTION", "duplicates")
-USER_PROJECTS_COLLECTION = os.getenv("APPWRITE_USER_PROJECTS_COLLECTION", "user_projects")
-
-# Global Lock: For scan operations per project
-scan_locks = {}
-scan_locks_mutex = Lock()
-
-# Helpers
-def get_scan_lock(project_id, service):
-    """Get or create a lock for this project+service combination"""
-    key = f"{project_id}:{service}"
-    with scan_locks_mutex:
-        if key not in scan_locks:
-            scan_locks[key] = {"lock": Lock(), "last_scan": 0}
-        return scan_locks[key]
-
-def generate_unique_id():
-    """Generate a truly unique ID using UUID + timestamp"""
-    unique_str = f"{uuid.uuid4().hex}{int(time.time() * 1000000)}"
-    return unique_str[:20]
-
-def get_project_clients(project_doc):
-    """Return initialized db, storage, auth clients using project credentials."""
-    endpoint = project_doc.get("endpoint")
-    project_api_id = project_doc.get("projectId")
-    encrypted_key = project_doc.get("apiKey")
-    if not encrypted_key:
-        raise ValueError("Missing API key in project document")
-    api_key = f.decrypt(encrypted_key.encode()).decode()
-    db = get_database_client(endpoint=endpoint, project_id=project_api_id, api_key=api_key)
-    storage = get_storage_client(endpoint=endpoint, project_id=project_api_id, api_key=api_key)
-    return db, storage
+SSE_POLL_INTERVAL = float(os.getenv("SCAN_EVENTS_POLL_INTERVAL", "0.5"))
+SSE_HEARTBEAT_INTERVAL = 15
+LIST_FLAT_DEFAULT_LIMIT = 100
+LIST_FLAT_MAX_LIMIT = 500
+QUERY_DEFAULT_K = 5
+QUERY_MAX_K = 50
+
+
+def scan_priority(data):
+    """Callers may lower a scan to the scheduled class (reminders do); everything else is interactive."""
+    return "scheduled" if data.get("priority") == "scheduled" else "interactive"
 
 
 # List Route: List databases and storages for a project
@@ -68,16 +50,7 @@ def list_project_resources():
         return jsonify({"error": "Missing required parameters"}), 400
     try:
         main_db = get_database_client()
-        projects = main_db.list_documents(
-            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-            collection_id=USER_PROJECTS_COLLECTION,
-            queries=[Query.equal("projectId", project_id)]
-        ).get("documents", [])
-        if not projects:
-            return jsonify({"error": "Project not found"}), 404
-        project_doc = projects[0]
-        if project_doc.get("userId") != user_id:
-            return jsonify({"error": "Unauthorized"}), 403
+        project_doc = get_owned_project(user_id, project_id, main_db)
         db, storage = get_project_clients(project_doc)
 
         collections = []
@@ -95,6 +68,8 @@ def list_project_resources():
             "databases": [{"$id": c["$id"], "name": c.get("name", "Unnamed Collection")} for c in collections],
             "storages": [{"$id": b["$id"], "name": b.get("name", "Unnamed Bucket")} for b in buckets]
         }), 200
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -115,22 +90,15 @@ def list_collections_for_database():
         return jsonify({"error": "Missing required parameters"}), 400
     try:
         main_db = get_database_client()
-        projects = main_db.list_documents(
-            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-            collection_id=USER_PROJECTS_COLLECTION,
-            queries=[Query.equal("projectId", project_id)]
-        ).get("documents", [])
-        if not projects:
-            return jsonify({"error": "Project not found"}), 404
-        project_doc = projects[0]
-        if project_doc.get("userId") != user_id:
-            return jsonify({"error": "Unauthorized"}), 403
+        project_doc = get_owned_project(user_id, project_id, main_db)
         db, _ = get_project_clients(project_doc)
         collections = db.list_collections(database_id=database_id).get("collections", [])
         return jsonify({
             "status": "success",
             "collections": [{"$id": c["$id"], "name": c.get("name", "Unnamed Collection")} for c in collections]
         }), 200
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -138,6 +106,7 @@ def list_collections_for_database():
 # Scan Route: Scan for duplicates in a project
 @duplicates_bp.route("/scan", methods=["POST"])
 def scan_duplicates():
+    """Run a scan inside the request. Meant for small projects; large ones should use /scan/jobs."""
     if not request.is_json:
         return jsonify({"error": "Invalid or missing JSON body"}), 400
     data = request.get_json(silent=True)
@@ -146,272 +115,38 @@ def scan_duplicates():
     user_id = data.get("userId")
     project_id = data.get("projectId")
     service = data.get("service")
-    database_id = data.get("databaseId")
-    collection_id = data.get("collectionId")
     if not all([user_id, project_id, service]):
         return jsonify({"error": "Missing required parameters"}), 400
-    
-    # Race Conditions Handling
-    scan_lock_info = get_scan_lock(project_id, service)
-    
-    current_time = time.time()
-    if current_time - scan_lock_info["last_scan"] < 2:
-        print(f"⚠️  Scan already in progress or recently completed for {project_id}:{service}")
-        return jsonify({
-            "status": "success",
-            "message": "Scan already in progress or recently completed",
-            "duplicates_found": 0,
-            "data": []
-        }), 200
-    
-    if not scan_lock_info["lock"].acquire(blocking=False):
-        print(f"⚠️  Another scan is in progress for {project_id}:{service}")
-        return jsonify({
-            "status": "success", 
-            "message": "Another scan is in progress",
-            "duplicates_found": 0,
-            "data": []
-        }), 200
-    
-    try:
-        main_db = get_database_client()
-        projects = main_db.list_documents(
-            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-            collection_id=USER_PROJECTS_COLLECTION,
-            queries=[Query.equal("projectId", project_id)]
-        ).get("documents", [])
-        if not projects:
-            return jsonify({"error": "Project not found"}), 404
-        project_doc = projects[0]
-        if project_doc.get("userId") != user_id:
-            return jsonify({"error": "Unauthorized"}), 403
-        db, storage = get_project_clients(project_doc)
-        
-        print(f"Cleaning up old duplicates for project {project_id}, service {service}")
-        try:
-            queries = [
-                Query.equal("projectId", project_id),
-                Query.equal("service", service)
-            ]
-            
-            if service == "database" and database_id:
-                queries.append(Query.equal("databaseId", database_id))
-                if collection_id:
-                    queries.append(Query.equal("collectionId", collection_id))
-            
-            old_docs = main_db.list_documents(
-                database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-                collection_id=DUPLICATES_COLLECTION,
-                queries=queries
-            ).get("documents", [])
-            
-            print(f"Found {len(old_docs)} old duplicates to delete")
-            
-            for doc in old_docs:
-                try:
-                    main_db.delete_document(
-                        database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-                        collection_id=DUPLICATES_COLLECTION,
-                        document_id=doc["$id"]
-                    )
-                    print(f"Deleted old duplicate: {doc['$id']}")
-                except Exception as e:
-                    print(f"Failed to delete old duplicate {doc['$id']}: {e}")
-        except Exception as e:
-            print(f"Error during cleanup: {e}")
 
-        duplicates = []
-        
-        # Scan database
-        if service == "database":
-            if not database_id:
-                return jsonify({"error": "Missing databaseId for database scan"}), 400
-            collections_to_scan = [collection_id] if collection_id else [
-                c["$id"] for c in db.list_collections(database_id=database_id).get("collections", [])
-            ]
-            for col_id in collections_to_scan:
-                try:
-                    docs = db.list_documents(database_id, col_id).get("documents", [])
-                    if not docs:
-                        continue
-                    records = [{"id": d["$id"], "text": json.dumps(d)} for d in docs]
-                    clusters = detect_textual_duplicates(records)
-                    for cluster_items in clusters:
-                        duplicates.append({
-                            "userId": user_id,
-                            "projectId": project_id,
-                            "service": service,
-                            "type": "text",
-                            "databaseId": database_id,
-                            "collectionId": col_id,
-                            "clusters": json.dumps(cluster_items)
-                        })
-                except Exception as e:
-                    print(f"Error scanning collection {col_id}: {e}")
-                    
-        # Scan storage
-        elif service == "storage":
-            buckets = storage.list_buckets().get("buckets", [])
-            for b in buckets:
-                try:
-                    files = storage.list_files(b["$id"]).get("files", [])
-                    file_records = []
-                    for fi in files:
-                        file_id = fi["$id"]
-                        filename = fi.get("name", "")
-                        try:
-                            endpoint = project_doc.get("endpoint") or os.getenv("APPWRITE_ENDPOINT")
-                            project_api_id = project_doc.get("projectId")
-                            url = f"{endpoint}/storage/buckets/{b['$id']}/files/{file_id}/view?project={project_api_id}"
-                            if not str(url).startswith("https"):
-                                print(f"Skipping invalid URL for file {file_id}")
-                                continue
-                            try:
-                                resp = requests.get(url, timeout=30)
-                                resp.raise_for_status()
-                                file_bytes = resp.content
-                                file_records.append({
-                                    "id": file_id,
-                                    "url": url,
-                                    "filename": filename,
-                                    "file_bytes": file_bytes
-                                })
-                            except Exception as e:
-                                print(f"Failed to fetch file {file_id}: {e}")
-                                continue
-                        except Exception as e:
-                            print(f"Error constructing URL for file {file_id}: {e}")
-                            continue
-                    if file_records:
-                        clusters = detect_file_duplicates(file_records)
-                        for cluster_items in clusters:
-                            clean_cluster = []
-                            for item in cluster_items:
-                                clean_item = {
-                                    "id": item.get("id"),
-                                    "url": item.get("url"),
-                                    "filename": item.get("filename"),
-                                    "similarity_score": item.get("similarity_score", 1.0)
-                                }
-                                clean_cluster.append(clean_item)
-                            duplicates.append({
-                                "userId": user_id,
-                                "projectId": project_id,
-                                "service": service,
-                                "type": "file",
-                                "bucketId": b["$id"],
-                                "clusters": json.dumps(clean_cluster)
-                            })
-                except Exception as e:
-                    print(f"Error scanning bucket {b['$id']}: {e}")
-        
-        stored_duplicates = []
-        duplicate_count = 0
-        
-        for cluster_doc in duplicates:
-            cluster_items = json.loads(cluster_doc.get("clusters", "[]"))
-            if len(cluster_items) < 2:
-                continue
-                
-            original = cluster_items[0]
-            
-            for idx, dup in enumerate(cluster_items[1:]):
-                duplicate_count += 1
-                item_data = {
-                    "userId": cluster_doc["userId"],
-                    "projectId": cluster_doc["projectId"],
-                    "service": cluster_doc["service"],
-                    "type": cluster_doc["type"],
-                    "originalId": original.get("id"),
-                    "duplicateId": dup.get("id"),
-                    "duplicateData": json.dumps({
-                        "name": dup.get("filename", dup.get("id")),
-                        "url": dup.get("url"),
-                        "filename": dup.get("filename"),
-                        "similarity_score": dup.get("similarity_score", 1.0)
-                    }),
-                    "status": "active"
-                }
-                
-                if cluster_doc.get("databaseId"):
-                    item_data["databaseId"] = cluster_doc["databaseId"]
-                if cluster_doc.get("collectionId"):
-                    item_data["collectionId"] = cluster_doc["collectionId"]
-                if cluster_doc.get("bucketId"):
-                    item_data["bucketId"] = cluster_doc["bucketId"]
-                
-                max_retries = 5
-                retry_count = 0
-                saved = False
-                last_error = None
-                
-                while retry_count < max_retries and not saved:
-                    try:
-                        doc_id = generate_unique_id()
-                        
-                        print(f"Storing duplicate {duplicate_count} (attempt {retry_count + 1}): ID={doc_id}, originalId={original.get('id')}, duplicateId={dup.get('id')}")
-                        
-                        saved_doc = main_db.create_document(
-                            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-                            collection_id=DUPLICATES_COLLECTION,
-                            document_id=doc_id,
-                            data=item_data
-                        )
-                        stored_duplicates.append(saved_doc)
-                        print(f"✅ Successfully stored duplicate with ID: {saved_doc['$id']}")
-                        saved = True
-                        
-                    except Exception as e:
-                        error_msg = str(e)
-                        last_error = error_msg
-                        retry_count += 1
-                        
-                        if "document with the requested ID already exists" in error_msg.lower():
-                            if retry_count < max_retries:
-                                print(f"⚠️  Duplicate ID conflict on attempt {retry_count}, retrying...")
-                                time.sleep(0.05 * retry_count)  
-                            else:
-                                print(f"❌ Failed after {max_retries} retries: {error_msg}")
-                        else:
-                            print(f"❌ Failed to save duplicate #{duplicate_count}: {error_msg}")
-                            print(f"   Data: {json.dumps(item_data, indent=2)}")
-                            break
-                
-                if not saved and last_error:
-                    print(f"⚠️  Could not store duplicate #{duplicate_count} after {max_retries} attempts")
-        
-        print(f"\n✅ Successfully stored {len(stored_duplicates)} out of {duplicate_count} duplicates")
+    if data.get("async"):
+        return submit_scan()
 
-        try:
-            update_garden_stats(
-                user_id=user_id,
-                increment_scans=1,
-                increment_duplicates=len(stored_duplicates)
-            )
-        except Exception as e:
-            print(f"⚠️  Failed to update garden stats: {e}")
-        
-        scan_lock_info["last_scan"] = time.time()
-        
-        return jsonify({
-            "status": "success",
-            "duplicates_found": len(stored_duplicates),
-            "total_attempted": duplicate_count,
-            "data": stored_duplicates
-        }), 200
-        
+    try:
+        result = get_scan_scheduler().submit(
+            run_scan,
+            user_id,
+            project_id,
+            service,
+            data.get("databaseId"),
+            data.get("collectionId"),
+            force=bool(data.get("force")),
+            user_id=user_id,
+            priority=scan_priority(data)
+        ).result()
+        return jsonify(result), 200
+    except (ProjectAccessError, ScanError) as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         print(f"❌ Error in scan_duplicates: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-    finally:
-        scan_lock_info["lock"].release()
 
 
-# List Flat Route: List duplicates in flat structure
-@duplicates_bp.route("/list_flat", methods=["POST"])
-def list_flat_duplicates():
+# Scan Jobs Route: Queue a scan on the background worker pool
+@duplicates_bp.route("/scan/jobs", methods=["POST"])
+def submit_scan():
+    """Queue a scan and return its job ID immediately."""
     if not request.is_json:
         return jsonify({"error": "Invalid or missing JSON body"}), 400
     data = request.get_json(silent=True)
@@ -419,24 +154,327 @@ def list_flat_duplicates():
         return jsonify({"error": "Empty request body"}), 400
     user_id = data.get("userId")
     project_id = data.get("projectId")
+    service = data.get("service")
+    database_id = data.get("databaseId")
+    if not all([user_id, project_id, service]):
+        return jsonify({"error": "Missing required parameters"}), 400
+    if service not in ("database", "storage"):
+        return jsonify({"error": "service must be 'database' or 'storage'"}), 400
+    if service == "database" and not database_id:
+        return jsonify({"error": "Missing databaseId for database scan"}), 400
+    try:
+        get_owned_project(user_id, project_id)
+        job = submit_scan_job({
+            "userId": user_id,
+            "projectId": project_id,
+            "service": service,
+            "databaseId": database_id,
+            "collectionId": data.get("collectionId"),
+            "force": bool(data.get("force"))
+        }, priority=scan_priority(data))
+        return jsonify({"status": "queued", "jobId": job["jobId"], "job": job}), 202
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Scan Metrics Route: Queue depth and wait times of the scan scheduler
+@duplicates_bp.route("/scan/metrics", methods=["GET"])
+def scan_metrics():
+    return jsonify({"status": "success", "metrics": get_scan_scheduler().metrics()}), 200
+
+
+# Scan Job Status Route: State and per-stage progress of a scan job
+@duplicates_bp.route("/scan/jobs/<job_id>", methods=["GET"])
+def scan_job_status(job_id):
+    user_id = request.args.get("userId")
+    if not user_id:
+        return jsonify({"error": "Missing userId"}), 400
+    try:
+        job = get_scan_job(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job["userId"] != user_id:
+            return jsonify({"error": "Unauthorized"}), 403
+        return jsonify({"status": "success", "job": job}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Scan Job Result Route: Result body of a finished scan job
+@duplicates_bp.route("/scan/jobs/<job_id>/result", methods=["GET"])
+def scan_job_result(job_id):
+    user_id = request.args.get("userId")
+    if not user_id:
+        return jsonify({"error": "Missing userId"}), 400
+    try:
+        job = get_scan_job(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job["userId"] != user_id:
+            return jsonify({"error": "Unauthorized"}), 403
+        if job["state"] == "failed":
+            return jsonify({"status": "failed", "error": job["error"], "job": job}), 500
+        if job["state"] != "done":
+            return jsonify({"status": job["state"], "job": job}), 202
+        return jsonify(get_scan_job_result(job_id)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Scan Job Events Route: Server-Sent Events stream of live scan progress
+@duplicates_bp.route("/scan/jobs/<job_id>/events", methods=["GET"])
+def scan_job_events(job_id):
+    """Stream a job's progress events until it finishes. Honors Last-Event-ID on reconnect."""
+    user_id = request.args.get("userId")
+    if not user_id:
+        return jsonify({"error": "Missing userId"}), 400
+    job = get_scan_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["userId"] != user_id:
+        return jsonify({"error": "Unauthorized"}), 403
+    try:
+        last_seq = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        last_seq = 0
+
+    def generate():
+        nonlocal last_seq
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while True:
+            events = get_scan_job_events(job_id, last_seq)
+            for event in events:
+                last_seq = event["seq"]
+                payload = json.dumps({**event["data"], "ts": event["ts"]})
+                yield f"id: {event['seq']}\nevent: {event['event']}\ndata: {payload}\n\n"
+                last_sent = time.monotonic()
+            if not events:
+                current = get_scan_job(job_id)
+                if current is None or current["state"] in ("done", "failed"):
+                    return
+                if time.monotonic() - last_sent >= SSE_HEARTBEAT_INTERVAL:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# List Flat Route: List duplicates in flat structure
+@duplicates_bp.route("/list_flat", methods=["GET", "POST"])
+def list_flat_duplicates():
+    """
+    Page through a project's active duplicates.
+
+    Optional filters: service, bucketId, databaseId, collectionId. `fields` limits
+    each document to the listed attributes. `limit` (max LIST_FLAT_MAX_LIMIT) and
+    `cursor` (the previous page's nextCursor) paginate.
+    """
+    if request.method == "GET":
+        data = request.args.to_dict()
+        if "fields" in data:
+            data["fields"] = [field for field in data["fields"].split(",") if field]
+    else:
+        if not request.is_json:
+            return jsonify({"error": "Invalid or missing JSON body"}), 400
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Empty request body"}), 400
+    user_id = data.get("userId")
+    project_id = data.get("projectId")
     if not all([user_id, project_id]):
         return jsonify({"error": "Missing required parameters"}), 400
+    try:
+        limit = min(max(int(data.get("limit", LIST_FLAT_DEFAULT_LIMIT)), 1), LIST_FLAT_MAX_LIMIT)
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    fields = data.get("fields")
+    if fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) for f in fields)):
+        return jsonify({"error": "fields must be a list of attribute names"}), 400
+
     try:
         main_db = get_database_client()
-        docs = main_db.list_documents(
+        get_owned_project(user_id, project_id, main_db)
+
+        queries = [
+            Query.equal("userId", user_id),
+            Query.equal("projectId", project_id),
+            Query.equal("status", "active"),
+            Query.limit(limit)
+        ]
+        for key in ("service", "bucketId", "databaseId", "collectionId"):
+            if data.get(key):
+                queries.append(Query.equal(key, data[key]))
+        if data.get("cursor"):
+            queries.append(Query.cursor_after(data["cursor"]))
+        if fields:
+            queries.append(Query.select(list(dict.fromkeys(["$id", *fields]))))
+
+        page = main_db.list_documents(
             database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
             collection_id=DUPLICATES_COLLECTION,
-            queries=[
-                Query.equal("userId", user_id),
-                Query.equal("projectId", project_id),
-                Query.equal("status", "active")
-            ]
-        ).get("documents", [])
+            queries=queries
+        )
+        docs = page.get("documents", [])
+        if fields:
+            # select() still returns Appwrite metadata, drop whatever was not asked for
+            keep = {"$id", *fields}
+            docs = [{key: value for key, value in doc.items() if key in keep} for doc in docs]
+
+        return cached_json_response({
+            "status": "success",
+            "total_duplicates": page.get("total", len(docs)),
+            "duplicates": docs,
+            "nextCursor": docs[-1]["$id"] if len(docs) == limit else None
+        })
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Blocking Route: Get, save or remove the blocking configuration of a collection
+@duplicates_bp.route("/blocking", methods=["GET", "PUT", "DELETE"])
+def collection_blocking():
+    """
+    Database scans compare a collection's documents only within the blocks of its
+    configuration (see utils/blocking.py); without one every pair is compared.
+
+    GET takes userId, projectId, databaseId, collectionId as query parameters; PUT and
+    DELETE take them as JSON, PUT with the `config` to store.
+    """
+    data = request.args.to_dict() if request.method == "GET" else request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Empty request body"}), 400
+    user_id = data.get("userId")
+    project_id = data.get("projectId")
+    database_id = data.get("databaseId")
+    collection_id = data.get("collectionId")
+    if not all([user_id, project_id, database_id, collection_id]):
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    try:
+        get_owned_project(user_id, project_id)
+        if request.method == "GET":
+            config = get_blocking_config(project_id, database_id, collection_id)
+            if config is None:
+                return jsonify({"error": "No blocking configuration for this collection"}), 404
+            return jsonify({"status": "success", "config": config}), 200
+
+        if request.method == "PUT":
+            config = save_blocking_config(project_id, database_id, collection_id, data.get("config"))
+        elif not delete_blocking_config(project_id, database_id, collection_id):
+            return jsonify({"error": "No blocking configuration for this collection"}), 404
+        else:
+            config = None
+        # Results computed with the old blocks must not be served as unchanged
+        invalidate_scan_results(user_id, project_id)
+        return jsonify({"status": "success", "config": config}), 200
+    except (ProjectAccessError, BlockingConfigError) as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Blocking Report Route: Block-size distribution of a collection, without scanning it
+@duplicates_bp.route("/blocking/report", methods=["POST"])
+def collection_blocking_report():
+    """
+    Block the collection's documents with `config` (or the stored configuration) and
+    report block sizes per key and the pairs a scan would compare, so keys and caps can
+    be tuned before scanning. No embeddings are computed.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Invalid or missing JSON body"}), 400
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Empty request body"}), 400
+    user_id = data.get("userId")
+    project_id = data.get("projectId")
+    database_id = data.get("databaseId")
+    collection_id = data.get("collectionId")
+    if not all([user_id, project_id, database_id, collection_id]):
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    try:
+        project_doc = get_owned_project(user_id, project_id)
+        if data.get("config") is not None:
+            config = validate_blocking_config(data["config"])
+        else:
+            config = get_blocking_config(project_id, database_id, collection_id)
+            if config is None:
+                return jsonify({"error": "No blocking configuration for this collection"}), 404
+        db, _ = get_project_clients(project_doc)
+        # Every document, paged through like a database scan lists them
+        docs = list_all_documents(db, database_id, collection_id)
+        _, report = block_records(docs, config)
+        return jsonify({"status": "success", "config": config, "report": report}), 200
+    except (ProjectAccessError, BlockingConfigError) as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# Query Route: Find duplicates of one file against a bucket's fingerprint index
+@duplicates_bp.route("/query", methods=["POST"])
+def query_file_duplicates():
+    """
+    Check a single file against the fingerprints stored by the last storage scan of a bucket.
+
+    Send the file as multipart `file` (with userId, projectId, bucketId form fields), or JSON
+    with `fileId` of a file already in the project. Returns the top `k` matches, best first.
+    """
+    upload = request.files.get("file")
+    data = request.form.to_dict() if upload else request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Empty request body"}), 400
+    user_id = data.get("userId")
+    project_id = data.get("projectId")
+    bucket_id = data.get("bucketId")
+    file_id = data.get("fileId")
+    if not all([user_id, project_id, bucket_id]) or not (upload or file_id):
+        return jsonify({"error": "Missing required parameters"}), 400
+    try:
+        k = min(max(int(data.get("k", QUERY_DEFAULT_K)), 1), QUERY_MAX_K)
+    except (TypeError, ValueError):
+        return jsonify({"error": "k must be an integer"}), 400
+
+    try:
+        started = time.perf_counter()
+        project_doc = get_owned_project(user_id, project_id)
+        index = load_bucket_index(project_id, bucket_id)
+        if index is None:
+            return jsonify({"error": "Bucket has not been indexed yet, run a storage scan first"}), 404
+
+        if upload:
+            file_bytes = upload.read()
+            filename = upload.filename or data.get("filename", "")
+        else:
+            _, storage = get_project_clients(project_doc)
+            filename = storage.get_file(bucket_id, file_id).get("name", "")
+            file_bytes = storage.get_file_download(bucket_id, file_id)
+        if not file_bytes:
+            return jsonify({"error": "File is empty"}), 400
+
+        matches, fingerprint_ms = query_bucket_index(index, file_bytes, filename, k=k, exclude_id=file_id)
         return jsonify({
             "status": "success",
-            "total_duplicates": len(docs),
-            "duplicates": docs
+            "isDuplicate": any(match["isDuplicate"] for match in matches),
+            "matches": matches,
+            "indexedFiles": index["count"],
+            "indexedAt": index["indexedAt"],
+            "fingerprintMs": round(fingerprint_ms, 1),
+            "tookMs": round((time.perf_counter() - started) * 1000, 1)
         }), 200
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -457,16 +495,7 @@ def delete_single_duplicate():
         return jsonify({"error": "Missing required parameters"}), 400
     try:
         main_db = get_database_client()
-        projects = main_db.list_documents(
-            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-            collection_id=USER_PROJECTS_COLLECTION,
-            queries=[Query.equal("projectId", project_id)]
-        ).get("documents", [])
-        if not projects:
-            return jsonify({"error": "Project not found"}), 404
-        project_doc = projects[0]
-        if project_doc.get("userId") != user_id:
-            return jsonify({"error": "Unauthorized"}), 403
+        project_doc = get_owned_project(user_id, project_id, main_db)
         db, storage = get_project_clients(project_doc)
         dup_doc = main_db.get_document(
             database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
@@ -498,6 +527,7 @@ def delete_single_duplicate():
             document_id=duplicate_id,
             data={"status": "deleted"}
         )
+        invalidate_scan_results(user_id, project_id)
 
         try:
             update_garden_stats(
@@ -508,6 +538,8 @@ def delete_single_duplicate():
             print(f"⚠️  Failed to update garden stats: {e}")
 
         return jsonify({"status": "success", "message": "Duplicate deleted"}), 200
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -536,72 +568,22 @@ def delete_bulk_duplicates():
     
     try:
         main_db = get_database_client()
-        
-        projects = main_db.list_documents(
-            database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-            collection_id=USER_PROJECTS_COLLECTION,
-            queries=[Query.equal("projectId", project_id)]
-        ).get("documents", [])
-        
-        if not projects:
-            return jsonify({"error": "Project not found"}), 404
-        
-        project_doc = projects[0]
-        if project_doc.get("userId") != user_id:
-            return jsonify({"error": "Unauthorized"}), 403
+        project_doc = get_owned_project(user_id, project_id, main_db)
         
         db, storage = get_project_clients(project_doc)
         
-        success_count = 0
-        fail_count = 0
-        errors = []
-        
-        for duplicate_id in duplicate_ids:
-            try:
-                dup_doc = main_db.get_document(
-                    database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-                    collection_id=DUPLICATES_COLLECTION,
-                    document_id=duplicate_id
-                )
-                
-                if not dup_doc:
-                    fail_count += 1
-                    errors.append(f"Duplicate {duplicate_id} not found")
-                    continue
-                
-                if delete_data:
-                    service = dup_doc.get("service")
-                    bucket_id = dup_doc.get("bucketId")
-                    collection_id = dup_doc.get("collectionId")
-                    database_id = dup_doc.get("databaseId")
-                    target_id = dup_doc.get("duplicateId")
-                    
-                    if target_id:
-                        try:
-                            if service == "storage" and bucket_id:
-                                storage.delete_file(bucket_id, target_id)
-                                print(f"✅ Deleted file {target_id} from bucket {bucket_id}")
-                            elif service == "database" and database_id and collection_id:
-                                db.delete_document(database_id, collection_id, target_id)
-                                print(f"✅ Deleted document {target_id} from collection {collection_id}")
-                        except Exception as e:
-                            print(f"⚠️  Failed to delete data source for {duplicate_id}: {e}")
-                
-                main_db.update_document(
-                    database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
-                    collection_id=DUPLICATES_COLLECTION,
-                    document_id=duplicate_id,
-                    data={"status": "deleted"}
-                )
-                
-                success_count += 1
-                print(f"✅ Successfully processed duplicate {duplicate_id}")
-                
-            except Exception as e:
-                fail_count += 1
-                error_msg = f"Failed to delete {duplicate_id}: {str(e)}"
-                errors.append(error_msg)
-                print(f"❌ {error_msg}")
+        results = delete_duplicate_records(
+            main_db, db, storage, duplicate_ids,
+            delete_data=delete_data,
+            scope_queries=[Query.equal("userId", user_id), Query.equal("projectId", project_id)]
+        )
+        success_count = sum(1 for result in results if result["status"] == "deleted")
+        fail_count = len(results) - success_count
+        errors = [result["error"] for result in results if result.get("error")]
+        print(f"✅ Deleted {success_count} duplicate(s), {fail_count} failed")
+
+        if success_count:
+            invalidate_scan_results(user_id, project_id)
 
         try:
             update_garden_stats(
@@ -615,7 +597,8 @@ def delete_bulk_duplicates():
             "status": "success",
             "successCount": success_count,
             "failCount": fail_count,
-            "message": f"Deleted {success_count} duplicate(s)"
+            "message": f"Deleted {success_count} duplicate(s)",
+            "results": results
         }
         
         if errors and len(errors) <= 5:
@@ -623,6 +606,8 @@ def delete_bulk_duplicates():
         
         return jsonify(response_data), 200
         
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
     except Exception as e:
         print(f"❌ Error in delete_bulk_duplicates: {str(e)}")
         import traceback
@@ -0,0 +1,88 @@
+# routes/events.py
+import os, hmac, base64, hashlib
+from flask import Blueprint, request, jsonify
+from dotenv import load_dotenv
+from utils.event_ingest import IngestError, ingest_events, parse_events
+from utils.project_clients import get_project_doc, get_webhook_signature_key
+from utils.scan_scheduler import get_scan_scheduler
+
+load_dotenv()
+
+events_bp = Blueprint("events", __name__)
+
+# Accept deliveries for projects without a webhook signature key (local testing only)
+EVENTS_ALLOW_UNSIGNED = os.getenv("EVENTS_ALLOW_UNSIGNED", "false").lower() == "true"
+# The URL configured in the webhook, if it differs from what this app sees behind a proxy
+EVENTS_WEBHOOK_URL = os.getenv("EVENTS_WEBHOOK_URL")
+
+
+def signature_valid(project_doc):
+    """
+    Check Appwrite's X-Appwrite-Webhook-Signature against the project's own webhook key:
+    base64 HMAC-SHA1 of webhook URL + body. Projects without a key are rejected unless
+    EVENTS_ALLOW_UNSIGNED is set.
+    """
+    signature_key = get_webhook_signature_key(project_doc)
+    if not signature_key:
+        return EVENTS_ALLOW_UNSIGNED
+    signed = (EVENTS_WEBHOOK_URL or request.url).encode() + request.get_data()
+    expected = base64.b64encode(hmac.new(signature_key.encode(), signed, hashlib.sha1).digest()).decode()
+    return hmac.compare_digest(expected, request.headers.get("X-Appwrite-Webhook-Signature", ""))
+
+
+def read_delivery():
+    """
+    Return (projectId, event names, resource) from an Appwrite webhook delivery, or from
+    a JSON body {"projectId", "events", "payload"} when posting events by hand.
+    """
+    body = request.get_json(silent=True) or {}
+    header_events = request.headers.get("X-Appwrite-Webhook-Events")
+    if header_events:
+        return (
+            request.headers.get("X-Appwrite-Webhook-Project-Id"),
+            [event.strip() for event in header_events.split(",") if event.strip()],
+            body
+        )
+    events = body.get("events") or []
+    if isinstance(events, str):
+        events = [events]
+    return body.get("projectId"), events, body.get("payload") or {}
+
+
+# Ingest Route: Apply storage/database change events to the project's index and duplicates
+@events_bp.route("/ingest", methods=["POST"])
+def ingest():
+    """
+    Fingerprint or embed the changed file/document and record its duplicates right away.
+
+    Events are applied on the scan workers and 202 is returned; pass ?wait=true to apply
+    them inside the request and get the per-change results.
+    """
+    project_id, events, payload = read_delivery()
+    if not project_id or not events:
+        return jsonify({"error": "Missing projectId or events"}), 400
+
+    try:
+        project_doc = get_project_doc(project_id)
+        if project_doc is None:
+            return jsonify({"error": "Project not connected"}), 404
+        if not signature_valid(project_doc):
+            return jsonify({"error": "Invalid signature"}), 401
+        if not parse_events(events):
+            return jsonify({"status": "ignored", "changes": []}), 200
+        future = get_scan_scheduler().submit(
+            ingest_events,
+            project_id,
+            events,
+            payload,
+            user_id=project_doc.get("userId"),
+            priority="scheduled"
+        )
+        if request.args.get("wait", "").lower() not in ("1", "true"):
+            return jsonify({"status": "accepted"}), 202
+        return jsonify(future.result()), 200
+    except IngestError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        print(f"❌ Error ingesting events for {project_id}: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -1,15 +1,14 @@
 # routes/garden.py
-import os, requests, random
+import random
 from dotenv import load_dotenv
 from flask import Blueprint, Response, make_response, request, jsonify
-from utils.garden_stats import get_or_create_garden_stats, update_plant_name
+from utils.garden_chat import get_gardener_reply, health_state
+from utils.garden_stats import get_garden_stats, get_or_create_garden_stats, update_plant_name
 
 garden_bp = Blueprint("garden", __name__)
 
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
 
 # Status Route: For getting garnden status of the user
 @garden_bp.route("/status", methods=["GET"])
@@ -21,7 +20,7 @@ def get_garden_status():
         return jsonify({"error": "Missing userId parameter"}), 400
     
     try:
-        stats = get_or_create_garden_stats(user_id)
+        stats = get_garden_stats(user_id)
         
         return jsonify({
             "health": stats.get("health", 50),
@@ -69,14 +68,7 @@ def get_daily_message():
         ]
     }
     
-    if health >= 85:
-        state = "flourishing"
-    elif health >= 60:
-        state = "blooming"
-    elif health >= 30:
-        state = "recovering"
-    else:
-        state = "wilting"
+    state = health_state(health)
     
     message = random.choice(messages[state])
     
@@ -94,41 +86,9 @@ def garden_chat():
     if not user_message or not garden_state:
         return jsonify({"error": "Missing message or gardenState"}), 400
 
-    prompt = f"""
-You are an AI gardener cum user's plant spirit in a digital garden representing data health.
-The garden's state:
-- Health: {garden_state.get('health', 50)}
-- Total scans: {garden_state.get('total_scans', 0)}
-- Duplicates found: {garden_state.get('total_duplicates', 0)}
-- Duplicates cleaned: {garden_state.get('total_cleaned', 0)}
-
-User says: "{user_message}"
-Respond in a friendly way, as if you are user's plant spirit. Keep it poetic, gentle, under 2 sentences.
-If user asks about taking care of his/her plant, suggest scanning for duplicates and cleaning them to improve garden health.
-"""
-
     try:
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
-
-        resp = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}",
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=15
-        )
-
-        if resp.status_code != 200:
-            print("Gemini returned non-200:", resp.status_code, resp.text)
-            return jsonify({"error": f"Gemini API error: {resp.status_code}"}), 503
-
-        resp_json = resp.json()
-        reply = resp_json["candidates"][0]["content"]["parts"][0]["text"].strip()
-
-        return jsonify({"reply": reply}), 200
-
-    except requests.exceptions.RequestException as e:
-        print("Gemini request error:", e)
-        return jsonify({"reply": "The soil seems quiet right now... try again later."}), 503
+        reply, source = get_gardener_reply(user_message, garden_state)
+        return jsonify({"reply": reply, "source": source}), 200
 
     except Exception as e:
         print("Garden chat error:", e)
@@ -2,6 +2,9 @@
 import os
 from flask import Blueprint, request, jsonify
 from utils.appwrite_client import get_database_client
+from utils.blocking import drop_project_blocking
+from utils.fingerprint_index import drop_project_index
+from utils.project_clients import ProjectAccessError, get_owned_project, invalidate_project
 from appwrite.query import Query
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
@@ -34,6 +37,7 @@ def connect_project():
     project_id = data.get("projectId")
     endpoint = data.get("endpoint")
     api_key = data.get("apiKey")
+    webhook_key = data.get("webhookKey")
 
     if not all([user_id, project_id, endpoint, api_key]):
         return jsonify({"error": "Missing project details"}), 400
@@ -42,6 +46,15 @@ def connect_project():
     if api_key is None:
         return jsonify({"error": "API key is required"}), 400
     encrypted_key = f.encrypt(api_key.encode()).decode()
+    project_data = {
+        "userId": user_id,
+        "projectId": project_id,
+        "endpoint": endpoint,
+        "apiKey": encrypted_key
+    }
+    # Signature key of the project's webhook to /api/events/ingest, encrypted like the API key
+    if webhook_key:
+        project_data["webhookKey"] = f.encrypt(webhook_key.encode()).decode()
 
     try:
         db = get_database_client(
@@ -54,19 +67,52 @@ def connect_project():
             database_id=DATABASE_ID,
             collection_id=COLLECTION_ID,
             document_id="unique()",
-            data={
-                "userId": user_id,
-                "projectId": project_id,
-                "endpoint": endpoint,
-                "apiKey": encrypted_key
-            },
+            data=project_data,
         )
     except Exception as e:
         return jsonify({"error": f"Failed to store project: {str(e)}"}), 500
 
+    # Reconnecting may change the key, drop anything cached for the old one
+    invalidate_project(project_id)
+
     return jsonify({"message": "Project connected successfully!"})
 
 
+# Webhook Key Route: To set the signature key of a project's Appwrite webhook
+@projects_bp.post("/webhook-key")
+def set_webhook_key():
+    data = request.json or {}
+    user_id = data.get("userId")
+    project_id = data.get("projectId")
+    webhook_key = data.get("webhookKey")
+
+    if not user_id or not project_id or not webhook_key:
+        return jsonify({"error": "Missing userId, projectId or webhookKey"}), 400
+
+    try:
+        db = get_database_client(
+            endpoint=APPWRITE_ENDPOINT,
+            project_id=APPWRITE_PROJECT,
+            api_key=APPWRITE_API_KEY
+        )
+        project_doc = get_owned_project(user_id, project_id, db)
+
+        db.update_document(
+            database_id=DATABASE_ID,
+            collection_id=COLLECTION_ID,
+            document_id=project_doc["$id"],
+            data={"webhookKey": f.encrypt(webhook_key.encode()).decode()}
+        )
+    except ProjectAccessError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({"error": f"Failed to store webhook key: {str(e)}"}), 500
+
+    invalidate_project(project_id)
+
+    return jsonify({"message": "Webhook key saved successfully!"})
+
+
 # List Route: To list all projects for a user
 @projects_bp.get("/list")
 def list_projects():
@@ -122,6 +168,9 @@ def delete_project():
             collection_id=COLLECTION_ID,
             document_id=project_id
         )
+        invalidate_project(doc.get("projectId"))
+        drop_project_index(doc.get("projectId"))
+        drop_project_blocking(doc.get("projectId"))
 
         return jsonify({"message": "Project deleted successfully!"})
 
@@ -1,27 +1,151 @@
 # utils/appwrite_client.py
-import os
+import os, time, hashlib, threading, requests
+from http.cookiejar import DefaultCookiePolicy
+from collections import OrderedDict
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+import appwrite.client as appwrite_client_module
 from appwrite.client import Client
 from appwrite.services.databases import Databases
 from appwrite.services.storage import Storage
+from appwrite.query import Query
 
 load_dotenv()
 
+APPWRITE_CLIENT_CACHE_SIZE = int(os.getenv("APPWRITE_CLIENT_CACHE_SIZE", "256"))
+APPWRITE_CLIENT_TTL = float(os.getenv("APPWRITE_CLIENT_TTL", "900"))
+APPWRITE_POOL_SIZE = int(os.getenv("APPWRITE_POOL_SIZE", "10"))
+
+
+class _PooledRequests:
+    """
+    Stand-in for the `requests` module inside the Appwrite SDK.
+
+    The SDK calls `requests.request(...)` for every API call, which opens a fresh
+    connection each time. This routes those calls through one keep-alive Session
+    per endpoint host instead. Sessions are shared by every project and API key on
+    that host, so they never store or send cookies: each call is authenticated by
+    its own headers only.
+    """
+
+    def __init__(self, pool_size):
+        self._pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(origin)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(origin)
+                if session is None:
+                    session = requests.Session()
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                    session.mount(f"{parts.scheme}://", adapter)
+                    self._sessions[origin] = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        return self._session(url).request(method=method, url=url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+appwrite_client_module.requests = _PooledRequests(APPWRITE_POOL_SIZE)
+
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
 def get_env_str(name: str) -> str:
     value = os.getenv(name)
     if not value:
         raise ValueError(f"{name} environment variable is required")
     return value
 
+def _registry_entry(endpoint: str | None, project_id: str | None, api_key: str | None) -> dict:
+    """
+    Shared client and services for (endpoint, project, credential fingerprint).
+
+    Entries are evicted least-recently-used beyond APPWRITE_CLIENT_CACHE_SIZE and
+    rebuilt after APPWRITE_CLIENT_TTL seconds.
+    """
+    endpoint = endpoint or get_env_str("APPWRITE_ENDPOINT")
+    project_id = project_id or get_env_str("APPWRITE_PROJECT")
+    api_key = api_key or get_env_str("APPWRITE_API_KEY")
+    key = (endpoint, project_id, hashlib.sha256(api_key.encode()).hexdigest()[:16])
+    now = time.monotonic()
+
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is not None and entry["expires"] > now:
+            _clients.move_to_end(key)
+            return entry
+
+        client = Client()
+        client.set_endpoint(endpoint)
+        client.set_project(project_id)
+        client.set_key(api_key)
+        entry = {
+            "client": client,
+            "databases": Databases(client),
+            "storage": Storage(client),
+            "expires": now + APPWRITE_CLIENT_TTL
+        }
+        _clients[key] = entry
+        _clients.move_to_end(key)
+        while len(_clients) > APPWRITE_CLIENT_CACHE_SIZE:
+            _clients.popitem(last=False)
+        return entry
+
+def evict_clients(project_id: str):
+    """Drop cached clients for a project, e.g. after it was deleted or reconnected with a new key."""
+    with _clients_lock:
+        for key in [key for key in _clients if key[1] == project_id]:
+            del _clients[key]
+
 def get_appwrite_client(endpoint: str | None = None, project_id: str | None = None, api_key: str | None = None) -> Client:
-    client = Client()
-    client.set_endpoint(endpoint or get_env_str("APPWRITE_ENDPOINT"))
-    client.set_project(project_id or get_env_str("APPWRITE_PROJECT"))
-    client.set_key(api_key or get_env_str("APPWRITE_API_KEY"))
-    return client
+    return _registry_entry(endpoint, project_id, api_key)["client"]
 
 def get_database_client(endpoint: str | None = None, project_id: str | None = None, api_key: str | None = None) -> Databases:
-    return Databases(get_appwrite_client(endpoint, project_id, api_key))
+    return _registry_entry(endpoint, project_id, api_key)["databases"]
 
 def get_storage_client(endpoint: str | None = None, project_id: str | None = None, api_key: str | None = None) -> Storage:
-    return Storage(get_appwrite_client(endpoint, project_id, api_key))
\ No newline at end of file
+    return _registry_entry(endpoint, project_id, api_key)["storage"]
+
+def list_all_documents(db: Databases, database_id: str, collection_id: str, queries: list | None = None, page_size: int = 100) -> list:
+    """List every document matching `queries`, following cursors past the default page size."""
+    documents = []
+    cursor = None
+    while True:
+        page_queries = list(queries or []) + [Query.limit(page_size)]
+        if cursor:
+            page_queries.append(Query.cursor_after(cursor))
+        page = db.list_documents(
+            database_id=database_id,
+            collection_id=collection_id,
+            queries=page_queries
+        ).get("documents", [])
+        documents.extend(page)
+        if len(page) < page_size:
+            return documents
+        cursor = page[-1]["$id"]
+
+
+def list_all_files(storage: Storage, bucket_id: str, queries: list | None = None, page_size: int = 100) -> list:
+    """List every file of a bucket matching `queries`, following cursors past the default page size."""
+    files = []
+    cursor = None
+    while True:
+        page_queries = list(queries or []) + [Query.limit(page_size)]
+        if cursor:
+            page_queries.append(Query.cursor_after(cursor))
+        page = storage.list_files(bucket_id=bucket_id, queries=page_queries).get("files", [])
+        files.extend(page)
+        if len(page) < page_size:
+            return files
+        cursor = page[-1]["$id"]
@@ -0,0 +1,320 @@
+# utils/blocking.py
+import os, re, json, time, hashlib, unicodedata
+from collections import defaultdict
+from utils.embedding_utils import detect_textual_duplicates, TEXT_SIMILARITY_THRESHOLD
+from utils.local_store import ensure_schema, get_connection, transaction
+
+# Blocks larger than this are not compared all-pairs, see _block_batches
+BLOCKING_MAX_BLOCK_SIZE = int(os.getenv("BLOCKING_MAX_BLOCK_SIZE", "500"))
+# Members of an oversized block that every other member is compared with
+BLOCKING_SAMPLE_SIZE = int(os.getenv("BLOCKING_SAMPLE_SIZE", "100"))
+BLOCKING_REPORT_LARGEST = 5
+
+MATCH_TYPES = ("exact", "phonetic")
+DEFAULT_NORMALIZERS = ["trim", "lower"]
+
+
+def _ascii(value):
+    return unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode()
+
+
+def _email(value):
+    """Lowercase, without a +tag in the local part."""
+    local, at, domain = value.strip().lower().partition("@")
+    return local.split("+", 1)[0] + at + domain
+
+
+NORMALIZERS = {
+    "trim": str.strip,
+    "lower": str.lower,
+    "ascii": _ascii,
+    "whitespace": lambda value: " ".join(value.split()),
+    "alnum": lambda value: re.sub(r"[\W_]+", "", value),
+    "digits": lambda value: re.sub(r"\D+", "", value),
+    "email": _email
+}
+_PREFIX = re.compile(r"^prefix:(\d+)$")
+
+_SOUNDEX_CODES = {
+    letter: digit
+    for digit, letters in (("1", "bfpv"), ("2", "cgjkqsxz"), ("3", "dt"), ("4", "l"), ("5", "mn"), ("6", "r"))
+    for letter in letters
+}
+
+
+class BlockingConfigError(Exception):
+    """Raised for an invalid blocking configuration, with the HTTP status to report."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def soundex(word):
+    """American Soundex code of a word ("" if it has no ASCII letters)."""
+    word = "".join(c for c in word.lower() if "a" <= c <= "z")
+    if not word:
+        return ""
+    code, last = word[0].upper(), _SOUNDEX_CODES.get(word[0], "")
+    for c in word[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != last:
+            code += digit
+        if c not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def _normalizer(name):
+    match = _PREFIX.match(name)
+    if match:
+        length = int(match.group(1))
+        return lambda value: value[:length]
+    return NORMALIZERS[name]
+
+
+def validate_blocking_config(config):
+    """
+    Check a blocking configuration and fill in its defaults:
+
+        {"keys": [{"attributes": ["email"], "normalizers": ["email"], "match": "exact"}, ...],
+         "maxBlockSize": 500, "sampleSize": 100}
+
+    Records sharing the value of any key are compared. Normalizers are applied in order to
+    each attribute (see NORMALIZERS, plus "prefix:N"); "phonetic" keys compare the Soundex
+    codes of the normalized words.
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("keys"), list) or not config["keys"]:
+        raise BlockingConfigError("keys must be a non-empty list")
+    keys = []
+    for key in config["keys"]:
+        attributes = key.get("attributes") if isinstance(key, dict) else None
+        if not isinstance(attributes, list) or not attributes or not all(isinstance(a, str) and a for a in attributes):
+            raise BlockingConfigError("Each key needs a non-empty list of attribute names")
+        normalizers = key.get("normalizers", DEFAULT_NORMALIZERS)
+        if not isinstance(normalizers, list) or not all(
+            isinstance(name, str) and (name in NORMALIZERS or _PREFIX.match(name)) for name in normalizers
+        ):
+            raise BlockingConfigError(f"normalizers must be a list of {', '.join(NORMALIZERS)} or prefix:N")
+        match = key.get("match", "exact")
+        if match not in MATCH_TYPES:
+            raise BlockingConfigError("match must be 'exact' or 'phonetic'")
+        keys.append({"attributes": attributes, "normalizers": normalizers, "match": match})
+
+    try:
+        max_block_size = int(config.get("maxBlockSize", BLOCKING_MAX_BLOCK_SIZE))
+        sample_size = int(config.get("sampleSize", min(BLOCKING_SAMPLE_SIZE, max_block_size - 1)))
+    except (TypeError, ValueError):
+        raise BlockingConfigError("maxBlockSize and sampleSize must be integers")
+    if max_block_size < 2 or not 0 < sample_size < max_block_size:
+        raise BlockingConfigError("maxBlockSize must be at least 2 and sampleSize between 1 and maxBlockSize - 1")
+    return {"keys": keys, "maxBlockSize": max_block_size, "sampleSize": sample_size}
+
+
+def _ensure_schema():
+    ensure_schema("blocking_configs", [
+        """
+        CREATE TABLE IF NOT EXISTS blocking_configs (
+            project_id TEXT NOT NULL,
+            database_id TEXT NOT NULL,
+            collection_id TEXT NOT NULL,
+            config TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (project_id, database_id, collection_id)
+        )
+        """
+    ])
+
+
+def get_blocking_config(project_id, database_id, collection_id):
+    """The blocking configuration of a collection, or None when its documents are compared all-pairs."""
+    _ensure_schema()
+    row = get_connection().execute(
+        "SELECT config FROM blocking_configs WHERE project_id = ? AND database_id = ? AND collection_id = ?",
+        (project_id, database_id, collection_id)
+    ).fetchone()
+    return json.loads(row["config"]) if row else None
+
+
+def save_blocking_config(project_id, database_id, collection_id, config):
+    """Validate and store a collection's blocking configuration; returns it with defaults filled in."""
+    config = validate_blocking_config(config)
+    _ensure_schema()
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO blocking_configs (project_id, database_id, collection_id, config, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (project_id, database_id, collection_id, json.dumps(config), time.time())
+        )
+    return config
+
+
+def delete_blocking_config(project_id, database_id, collection_id):
+    _ensure_schema()
+    with transaction() as conn:
+        deleted = conn.execute(
+            "DELETE FROM blocking_configs WHERE project_id = ? AND database_id = ? AND collection_id = ?",
+            (project_id, database_id, collection_id)
+        ).rowcount
+    return deleted > 0
+
+
+def drop_project_blocking(project_id):
+    _ensure_schema()
+    with transaction() as conn:
+        conn.execute("DELETE FROM blocking_configs WHERE project_id = ?", (project_id,))
+
+
+def _attribute_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(_attribute_text(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+def block_key(doc, key):
+    """The value of one blocking key for a document, or None if any of its attributes is empty."""
+    parts = []
+    for attribute in key["attributes"]:
+        value = _attribute_text(doc.get(attribute))
+        for name in key["normalizers"]:
+            value = _normalizer(name)(value)
+        if key["match"] == "phonetic":
+            value = " ".join(code for code in map(soundex, value.split()) if code)
+        if not value:
+            return None
+        parts.append(value)
+    return "|".join(parts)
+
+
+def _size_bin(size):
+    """Power-of-two bucket label of a block size: "1", "2", "3-4", "5-8", ..."""
+    if size <= 2:
+        return str(size)
+    upper = 1 << (size - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
+
+
+def _batch_pairs(size, config):
+    """Pairs compared for a block of `size` members (see _block_batches)."""
+    cap, sample_size = config["maxBlockSize"], config["sampleSize"]
+    if size <= cap:
+        return size * (size - 1) // 2
+    rest, window = size - sample_size, cap - sample_size
+    full, last = divmod(rest, window)
+    return full * cap * (cap - 1) // 2 + ((sample_size + last) * (sample_size + last - 1) // 2 if last else 0)
+
+
+def block_records(docs, config):
+    """
+    Group documents into blocks by every key of a blocking configuration.
+
+    Returns (blocks, report): `blocks` lists the document indexes of every block with at
+    least two members, and `report` the block-size distribution per key with the number of
+    pairs the blocks lead to (at most; keys that agree share their comparisons).
+    """
+    blocks = []
+    keys_report = []
+    candidate_pairs = 0
+    in_block = set()
+    for key in config["keys"]:
+        groups = defaultdict(list)
+        for i, doc in enumerate(docs):
+            value = block_key(doc, key)
+            if value is not None:
+                groups[value].append(i)
+        sizes = defaultdict(int)
+        for members in groups.values():
+            sizes[_size_bin(len(members))] += 1
+            if len(members) > 1:
+                blocks.append(members)
+                in_block.update(members)
+                candidate_pairs += _batch_pairs(len(members), config)
+        largest = sorted(groups.items(), key=lambda item: len(item[1]), reverse=True)[:BLOCKING_REPORT_LARGEST]
+        keys_report.append({
+            **key,
+            "blocks": len(groups),
+            "keyed": sum(len(members) for members in groups.values()),
+            "missing": len(docs) - sum(len(members) for members in groups.values()),
+            "sizes": dict(sorted(sizes.items(), key=lambda item: int(item[0].split("-")[0]))),
+            "largest": [{"value": value, "size": len(members)} for value, members in largest],
+            "oversized": sum(1 for members in groups.values() if len(members) > config["maxBlockSize"])
+        })
+    return blocks, {
+        "records": len(docs),
+        "keys": keys_report,
+        "unblocked": len(docs) - len(in_block),
+        "candidatePairs": candidate_pairs,
+        "allPairs": len(docs) * (len(docs) - 1) // 2
+    }
+
+
+def _block_batches(records, members, config):
+    """
+    Split a block into the batches compared all-pairs. A block within maxBlockSize is one
+    batch; an oversized one is a fixed sample of sampleSize members plus windows of the
+    rest sorted by text, so every member meets the sample and its nearest neighbours.
+    """
+    cap, sample_size = config["maxBlockSize"], config["sampleSize"]
+    if len(members) <= cap:
+        return [members]
+    ordered = sorted(members, key=lambda i: hashlib.sha1(records[i]["id"].encode()).digest())
+    sample, rest = ordered[:sample_size], ordered[sample_size:]
+    rest.sort(key=lambda i: records[i].get("canonical") or records[i]["text"])
+    window = cap - sample_size
+    return [sample + rest[start:start + window] for start in range(0, len(rest), window)]
+
+
+def detect_blocked_duplicates(records, docs, config, threshold=TEXT_SIMILARITY_THRESHOLD, embeddings=None, stats=None):
+    """
+    Detect textual duplicates only within the blocks of a blocking configuration.
+
+    `records` are detect_textual_duplicates records for `docs` (same order). Duplicates
+    found in different blocks are merged, so a record matched through its email and
+    through its name ends up in one cluster. Returns (clusters, report); the report is
+    block_records' with the compared pair count and the number of sampled blocks.
+    """
+    embeddings = embeddings if embeddings is not None else {}
+    stats = stats if stats is not None else {}
+    blocks, report = block_records(docs, config)
+    position = {record["id"]: i for i, record in enumerate(records)}
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    compared = embedded = sampled = 0
+    done = set()
+    for members in blocks:
+        batches = _block_batches(records, members, config)
+        sampled += len(batches) > 1
+        for batch in batches:
+            # Keys often agree (same email, same name), so identical batches are compared once
+            batch_key = tuple(sorted(batch))
+            if batch_key in done:
+                continue
+            done.add(batch_key)
+            batch_stats = {}
+            for cluster in detect_textual_duplicates([records[i] for i in batch], threshold, embeddings, batch_stats):
+                root = find(position[cluster[0]["id"]])
+                for record in cluster[1:]:
+                    parent[find(position[record["id"]])] = root
+            compared += batch_stats.get("compared", 0)
+            embedded += batch_stats.get("embedded", 0)
+
+    groups = defaultdict(list)
+    for i in range(len(records)):
+        groups[find(i)].append(i)
+    clusters = [[records[i] for i in sorted(members)] for members in groups.values() if len(members) > 1]
+    clusters.sort(key=lambda cluster: position[cluster[0]["id"]])
+
+    stats["compared"], stats["embedded"] = compared, embedded
+    return clusters, {**report, "compared": compared, "sampledBlocks": sampled}
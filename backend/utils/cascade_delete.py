@@ -0,0 +1,262 @@
+# utils/cascade_delete.py
+import os, json, time, random, threading
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.exception import AppwriteException
+from appwrite.query import Query
+from utils.local_store import ensure_schema, get_connection
+from utils.scan_coordinator import try_acquire_lease
+
+DELETE_ACCOUNT_WORKERS = int(os.getenv("DELETE_ACCOUNT_WORKERS", "8"))
+DELETE_ACCOUNT_PAGE_SIZE = 100
+DELETE_ACCOUNT_MAX_RETRIES = 5
+DELETE_ACCOUNT_BACKOFF_BASE = 0.5
+DELETE_ACCOUNT_LEASE_TTL = 60
+# Failed or orphaned deletions are resumed in the background, backing off from DELETE_ACCOUNT_RESUME_BASE seconds
+DELETE_ACCOUNT_RESUME_INTERVAL = float(os.getenv("DELETE_ACCOUNT_RESUME_INTERVAL", "60"))
+DELETE_ACCOUNT_RESUME_BASE = float(os.getenv("DELETE_ACCOUNT_RESUME_BASE", "60"))
+DELETE_ACCOUNT_MAX_ATTEMPTS = int(os.getenv("DELETE_ACCOUNT_MAX_ATTEMPTS", "8"))
+
+# Status codes worth retrying: rate limited or temporarily unavailable
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+
+class DeletionThrottle:
+    """
+    Shared backoff for one deletion run. A rate-limited response pauses every
+    worker, not just the one that hit it, so the pool as a whole slows down.
+    """
+
+    def __init__(self):
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._pause_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def back_off(self, attempt):
+        delay = DELETE_ACCOUNT_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.75, 1.25)
+        with self._lock:
+            self._pause_until = max(self._pause_until, time.monotonic() + delay)
+
+    def call(self, fn, *args):
+        for attempt in range(DELETE_ACCOUNT_MAX_RETRIES):
+            self.wait()
+            try:
+                return fn(*args)
+            except AppwriteException as e:
+                if e.code == 404:
+                    return None  # Already gone, e.g. deleted by an earlier attempt
+                if e.code not in RETRYABLE_CODES or attempt == DELETE_ACCOUNT_MAX_RETRIES - 1:
+                    raise
+                self.back_off(attempt)
+
+
+def _ensure_schema():
+    ensure_schema("account_deletions", [
+        """
+        CREATE TABLE IF NOT EXISTS account_deletions (
+            user_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            progress TEXT NOT NULL,
+            error TEXT,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            finished_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    ], columns=[("account_deletions", "attempts", "INTEGER NOT NULL DEFAULT 0")])
+
+
+def get_deletion_job(user_id):
+    """Return the account deletion record for a user, or None."""
+    _ensure_schema()
+    row = get_connection().execute(
+        "SELECT * FROM account_deletions WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "userId": row["user_id"],
+        "state": row["state"],
+        "progress": json.loads(row["progress"]),
+        "error": row["error"],
+        "startedAt": row["started_at"],
+        "updatedAt": row["updated_at"],
+        "finishedAt": row["finished_at"],
+        "attempts": row["attempts"]
+    }
+
+
+def resumable_deletions(now=None):
+    """
+    User ids of deletions to resume: failed ones whose backoff has passed (until
+    DELETE_ACCOUNT_MAX_ATTEMPTS runs), and running ones nobody updated for a lease
+    TTL, whose worker died. A run that is still alive keeps its lease, so resuming
+    it is a no-op.
+    """
+    _ensure_schema()
+    now = now if now is not None else time.time()
+    rows = get_connection().execute(
+        """
+        SELECT user_id, state, updated_at, attempts FROM account_deletions
+        WHERE (state = 'failed' AND attempts < ?) OR (state = 'running' AND updated_at < ?)
+        """,
+        (DELETE_ACCOUNT_MAX_ATTEMPTS, now - DELETE_ACCOUNT_LEASE_TTL)
+    ).fetchall()
+    return [
+        row["user_id"] for row in rows
+        if row["state"] == "running"
+        or row["updated_at"] <= now - DELETE_ACCOUNT_RESUME_BASE * 2 ** max(row["attempts"] - 1, 0)
+    ]
+
+
+def _count_attempt(user_id):
+    get_connection().execute(
+        "UPDATE account_deletions SET attempts = attempts + 1 WHERE user_id = ?", (user_id,)
+    )
+
+
+def _save_job(user_id, state, progress, error=None):
+    now = time.time()
+    get_connection().execute(
+        """
+        INSERT INTO account_deletions (user_id, state, progress, error, started_at, updated_at, finished_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            state = excluded.state, progress = excluded.progress, error = excluded.error,
+            updated_at = excluded.updated_at, finished_at = excluded.finished_at
+        """,
+        (user_id, state, json.dumps(progress), error, now, now, now if state in ("completed", "failed") else None)
+    )
+
+
+class CascadeDeletion:
+    """
+    Deletes everything a user owns, collection by collection.
+
+    Each collection is paged through completely and its documents are deleted on
+    a bounded pool. Progress is saved to the job record after every page, and
+    finished collections are skipped when a deletion is resumed.
+    """
+
+    def __init__(self, user_id, db, database_id, collections, on_deleted=None, workers=DELETE_ACCOUNT_WORKERS):
+        self.user_id = user_id
+        self.db = db
+        self.database_id = database_id
+        self.collections = collections
+        self.on_deleted = on_deleted or {}
+        self.workers = workers
+        self.throttle = DeletionThrottle()
+        job = get_deletion_job(user_id)
+        self.progress = job["progress"] if job and job["state"] != "completed" else {}
+        for collection_id in collections:
+            self.progress.setdefault(collection_id, {"deleted": 0, "failed": 0, "done": False})
+
+    def _delete(self, collection_id, doc):
+        self.throttle.call(self.db.delete_document, self.database_id, collection_id, doc["$id"])
+        callback = self.on_deleted.get(collection_id)
+        if callback:
+            callback(doc)
+
+    def _delete_collection(self, collection_id, executor):
+        status = self.progress[collection_id]
+        status["failed"] = 0
+        cursor = None
+        while True:
+            queries = [Query.equal("userId", self.user_id), Query.limit(DELETE_ACCOUNT_PAGE_SIZE)]
+            if cursor:
+                queries.append(Query.cursor_after(cursor))
+            page = self.throttle.call(
+                lambda: self.db.list_documents(
+                    database_id=self.database_id, collection_id=collection_id, queries=queries
+                ).get("documents", [])
+            )
+            if not page:
+                break
+
+            futures = [(doc, executor.submit(self._delete, collection_id, doc)) for doc in page]
+            for doc, future in futures:
+                try:
+                    future.result()
+                    status["deleted"] += 1
+                except Exception as e:
+                    status["failed"] += 1
+                    # Deleted documents cannot be used as cursors, so resume after the last one that is still there
+                    cursor = doc["$id"]
+                    print(f"[WARN] Failed to delete from {collection_id}: {e}")
+            _save_job(self.user_id, "running", self.progress)
+
+            if len(page) < DELETE_ACCOUNT_PAGE_SIZE:
+                break
+
+        # Documents that failed are retried when the deletion is resumed
+        status["done"] = status["failed"] == 0
+        _save_job(self.user_id, "running", self.progress)
+
+    def run(self):
+        """Delete every collection. Returns the per-collection progress."""
+        _save_job(self.user_id, "running", self.progress)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cascade-delete") as executor:
+            for collection_id in self.collections:
+                if self.progress[collection_id]["done"]:
+                    continue
+                self._delete_collection(collection_id, executor)
+                print(f"[INFO] Deleted {self.progress[collection_id]['deleted']} documents from {collection_id}")
+        return self.progress
+
+    @property
+    def complete(self):
+        return all(status["done"] for status in self.progress.values())
+
+
+def run_cascade_deletion(user_id, db, database_id, collections, finish, on_deleted=None):
+    """
+    Run a user's cascade deletion unless another worker already is. `finish()`
+    runs once every collection is empty, e.g. to delete the account itself.
+
+    Returns the job record, or None if another run holds the lease.
+    """
+    lease = try_acquire_lease(f"account-deletion:{user_id}", ttl=DELETE_ACCOUNT_LEASE_TTL)
+    if lease is None:
+        return None
+    with lease:
+        deletion = CascadeDeletion(user_id, db, database_id, collections, on_deleted=on_deleted)
+        try:
+            progress = deletion.run()
+            if not deletion.complete:
+                _save_job(user_id, "failed", progress, error="Some documents could not be deleted")
+            else:
+                finish()
+                _save_job(user_id, "completed", progress)
+        except Exception as e:
+            _save_job(user_id, "failed", deletion.progress, error=str(e))
+        _count_attempt(user_id)
+        return get_deletion_job(user_id)
+
+
+def _resume_loop(resume):
+    while True:
+        time.sleep(DELETE_ACCOUNT_RESUME_INTERVAL)
+        try:
+            for user_id in resumable_deletions():
+                print(f"🔁 Resuming account deletion for {user_id}")
+                resume(user_id)
+        except Exception as e:
+            print(f"⚠️  Account deletion resume failed: {e}")
+
+
+_resumer_started = False
+_resumer_lock = threading.Lock()
+
+
+def start_deletion_resumer(resume):
+    """Call `resume(user_id)` in the background for every failed or orphaned deletion (once per process)."""
+    global _resumer_started
+    with _resumer_lock:
+        if _resumer_started:
+            return
+        threading.Thread(target=_resume_loop, args=(resume,), name="account-deletion-resume", daemon=True).start()
+        _resumer_started = True
@@ -0,0 +1,317 @@
+# utils/duplicate_records.py
+import os, json, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.query import Query
+from utils.appwrite_client import list_all_documents
+
+DUPLICATES_COLLECTION = os.getenv("APPWRITE_DUPLICATES_COLLECTION", "duplicates")
+DELETE_BULK_WORKERS = int(os.getenv("DELETE_BULK_WORKERS", "8"))
+# Appwrite caps the number of values in a single equal() query
+FETCH_CHUNK_SIZE = 100
+
+
+def record_location(record):
+    """Return the bucket or database/collection a duplicate record belongs to."""
+    if record.get("bucketId"):
+        return f"bucket:{record['bucketId']}"
+    return f"collection:{record.get('databaseId', '')}/{record.get('collectionId', '')}"
+
+
+def pair_key(record):
+    """Stable document ID for an (originalId, duplicateId, location) pair within a project/service."""
+    raw = "|".join([
+        str(record.get("projectId", "")),
+        str(record.get("service", "")),
+        record_location(record),
+        str(record.get("originalId", "")),
+        str(record.get("duplicateId", ""))
+    ])
+    return hashlib.sha1(raw.encode()).hexdigest()[:36]
+
+
+def build_pair_records(duplicates):
+    """Flatten cluster documents produced by a scan into one record per (original, duplicate) pair."""
+    records = []
+    for cluster_doc in duplicates:
+        cluster_items = json.loads(cluster_doc.get("clusters", "[]"))
+        if len(cluster_items) < 2:
+            continue
+
+        original = cluster_items[0]
+        for dup in cluster_items[1:]:
+            item_data = {
+                "userId": cluster_doc["userId"],
+                "projectId": cluster_doc["projectId"],
+                "service": cluster_doc["service"],
+                "type": cluster_doc["type"],
+                "originalId": original.get("id"),
+                "duplicateId": dup.get("id"),
+                "duplicateData": json.dumps({
+                    "name": dup.get("filename", dup.get("id")),
+                    "url": dup.get("url"),
+                    "filename": dup.get("filename"),
+                    "similarity_score": dup.get("similarity_score", 1.0)
+                }),
+                "status": "active"
+            }
+            for field in ("databaseId", "collectionId", "bucketId"):
+                if cluster_doc.get(field):
+                    item_data[field] = cluster_doc[field]
+            records.append(item_data)
+    return records
+
+
+def sync_duplicate_records(main_db, scope_queries, records, skip_locations=(), progress=None):
+    """
+    Diff freshly detected pairs against the stored ones in `scope_queries` and
+    write only what changed.
+
+    New pairs are inserted under their stable key, pairs whose payload changed are
+    updated, and active pairs that no longer show up are retired. Records the user
+    already marked `deleted` are left untouched. Stored pairs in `skip_locations`
+    (buckets/collections that failed to scan) are never retired.
+
+    Returns a dict with the active documents and per-operation counts.
+    """
+    database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+
+    existing = {}
+    stale_ids = []
+    for doc in list_all_documents(main_db, database_id, DUPLICATES_COLLECTION, scope_queries):
+        key = pair_key(doc)
+        kept = existing.get(key)
+        if kept is None:
+            existing[key] = doc
+        elif kept.get("status") != "deleted" and doc.get("status") == "deleted":
+            stale_ids.append(kept["$id"])
+            existing[key] = doc
+        else:
+            stale_ids.append(doc["$id"])
+
+    fresh = {pair_key(record): record for record in records}
+    if progress:
+        progress.set_total("persisted", len(fresh))
+
+    active_docs = []
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0, "retired": 0, "preserved": 0, "failed": 0}
+
+    for key, record in fresh.items():
+        doc = existing.get(key)
+        try:
+            if doc is None:
+                try:
+                    saved = main_db.create_document(
+                        database_id=database_id,
+                        collection_id=DUPLICATES_COLLECTION,
+                        document_id=key,
+                        data=record
+                    )
+                    counts["inserted"] += 1
+                except Exception as e:
+                    if "already exists" not in str(e).lower():
+                        raise
+                    # Created since the listing: a pair the user deleted there stays deleted
+                    current = main_db.get_document(
+                        database_id=database_id,
+                        collection_id=DUPLICATES_COLLECTION,
+                        document_id=key
+                    )
+                    if current.get("status") == "deleted":
+                        saved = None
+                        counts["preserved"] += 1
+                    else:
+                        saved = main_db.update_document(
+                            database_id=database_id,
+                            collection_id=DUPLICATES_COLLECTION,
+                            document_id=key,
+                            data={"duplicateData": record["duplicateData"]}
+                        )
+                        counts["updated"] += 1
+                if saved is not None:
+                    active_docs.append(saved)
+            elif doc.get("status") == "deleted":
+                counts["preserved"] += 1
+            elif doc.get("duplicateData") != record["duplicateData"] or doc.get("status") != "active":
+                saved = main_db.update_document(
+                    database_id=database_id,
+                    collection_id=DUPLICATES_COLLECTION,
+                    document_id=doc["$id"],
+                    data={"duplicateData": record["duplicateData"], "status": "active"}
+                )
+                counts["updated"] += 1
+                active_docs.append(saved)
+            else:
+                counts["unchanged"] += 1
+                active_docs.append(doc)
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"❌ Failed to store duplicate {record.get('originalId')} -> {record.get('duplicateId')}: {e}")
+        if progress:
+            progress.advance("persisted")
+
+    skip_locations = set(skip_locations)
+    for key, doc in existing.items():
+        if key in fresh or doc.get("status") == "deleted":
+            continue
+        if record_location(doc) in skip_locations:
+            active_docs.append(doc)
+            continue
+        stale_ids.append(doc["$id"])
+
+    for doc_id in stale_ids:
+        try:
+            main_db.delete_document(
+                database_id=database_id,
+                collection_id=DUPLICATES_COLLECTION,
+                document_id=doc_id
+            )
+            counts["retired"] += 1
+        except Exception as e:
+            print(f"Failed to retire duplicate {doc_id}: {e}")
+
+    print(
+        f"✅ Synced duplicates: {counts['inserted']} inserted, {counts['updated']} updated, "
+        f"{counts['unchanged']} unchanged, {counts['retired']} retired, {counts['preserved']} preserved"
+    )
+    return {"documents": active_docs, **counts}
+
+
+def fetch_duplicate_records(main_db, duplicate_ids, scope_queries=(), executor=None):
+    """Fetch duplicate records by ID in chunks of FETCH_CHUNK_SIZE. Returns {id: document}."""
+    database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+
+    def fetch(chunk):
+        return main_db.list_documents(
+            database_id=database_id,
+            collection_id=DUPLICATES_COLLECTION,
+            queries=[*scope_queries, Query.equal("$id", chunk), Query.limit(len(chunk))]
+        ).get("documents", [])
+
+    chunks = [duplicate_ids[i:i + FETCH_CHUNK_SIZE] for i in range(0, len(duplicate_ids), FETCH_CHUNK_SIZE)]
+    pages = executor.map(fetch, chunks) if executor else map(fetch, chunks)
+    return {doc["$id"]: doc for page in pages for doc in page}
+
+
+def delete_source_data(dup_doc, db, storage):
+    """Delete the file or document a duplicate record points at."""
+    service = dup_doc.get("service")
+    bucket_id = dup_doc.get("bucketId")
+    collection_id = dup_doc.get("collectionId")
+    database_id = dup_doc.get("databaseId")
+    target_id = dup_doc.get("duplicateId")
+    if not target_id:
+        return False
+    if service == "storage" and bucket_id:
+        storage.delete_file(bucket_id, target_id)
+        return True
+    if service == "database" and database_id and collection_id:
+        db.delete_document(database_id, collection_id, target_id)
+        return True
+    return False
+
+
+def delete_duplicate_records(main_db, db, storage, duplicate_ids, delete_data=False, scope_queries=(), workers=DELETE_BULK_WORKERS):
+    """
+    Mark duplicate records deleted, optionally deleting their source data first.
+
+    Records are fetched in bulk, then each one's source delete and status update
+    run concurrently on `workers` threads. Returns one result per requested ID:
+    {"duplicateId", "status": "deleted" | "not_found" | "failed", "sourceDeleted", "error"}.
+    A failed source delete is reported but does not stop the record being marked deleted.
+    """
+    database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+    duplicate_ids = list(dict.fromkeys(duplicate_ids))
+
+    def process(dup_doc):
+        result = {"duplicateId": dup_doc["$id"], "status": "deleted", "sourceDeleted": False}
+        if delete_data:
+            try:
+                result["sourceDeleted"] = delete_source_data(dup_doc, db, storage)
+            except Exception as e:
+                result["sourceError"] = str(e)
+                print(f"⚠️  Failed to delete data source for {dup_doc['$id']}: {e}")
+        try:
+            main_db.update_document(
+                database_id=database_id,
+                collection_id=DUPLICATES_COLLECTION,
+                document_id=dup_doc["$id"],
+                data={"status": "deleted"}
+            )
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = f"Failed to delete {dup_doc['$id']}: {e}"
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="delete-bulk") as executor:
+        try:
+            docs = fetch_duplicate_records(main_db, duplicate_ids, scope_queries, executor)
+        except Exception as e:
+            return [
+                {"duplicateId": duplicate_id, "status": "failed", "sourceDeleted": False, "error": f"Failed to fetch duplicates: {e}"}
+                for duplicate_id in duplicate_ids
+            ]
+        processed = dict(zip(
+            [duplicate_id for duplicate_id in duplicate_ids if duplicate_id in docs],
+            executor.map(process, [docs[duplicate_id] for duplicate_id in duplicate_ids if duplicate_id in docs])
+        ))
+
+    return [
+        processed.get(duplicate_id) or {
+            "duplicateId": duplicate_id,
+            "status": "not_found",
+            "sourceDeleted": False,
+            "error": f"Duplicate {duplicate_id} not found"
+        }
+        for duplicate_id in duplicate_ids
+    ]
+
+
+def upsert_pair_record(main_db, record):
+    """
+    Store one pair record under its stable key, as a scan would.
+
+    Returns "inserted", "updated", or "preserved" when the user already marked the pair deleted.
+    """
+    database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+    key = pair_key(record)
+    try:
+        main_db.create_document(
+            database_id=database_id,
+            collection_id=DUPLICATES_COLLECTION,
+            document_id=key,
+            data=record
+        )
+        return "inserted"
+    except Exception as e:
+        if "already exists" not in str(e).lower():
+            raise
+    existing = main_db.get_document(database_id=database_id, collection_id=DUPLICATES_COLLECTION, document_id=key)
+    if existing.get("status") == "deleted":
+        return "preserved"
+    main_db.update_document(
+        database_id=database_id,
+        collection_id=DUPLICATES_COLLECTION,
+        document_id=key,
+        data={"duplicateData": record["duplicateData"], "status": "active"}
+    )
+    return "updated"
+
+
+def retire_pair_records(main_db, scope_queries, object_id):
+    """
+    Delete the active pair records in `scope_queries` that name `object_id` as original or duplicate.
+
+    Returns the retired records so callers can re-pair the objects they pointed at.
+    """
+    database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+    retired = []
+    for field in ("originalId", "duplicateId"):
+        for doc in list_all_documents(main_db, database_id, DUPLICATES_COLLECTION, [*scope_queries, Query.equal(field, object_id)]):
+            if doc.get("status") == "deleted":
+                continue
+            try:
+                main_db.delete_document(database_id=database_id, collection_id=DUPLICATES_COLLECTION, document_id=doc["$id"])
+                retired.append(doc)
+            except Exception as e:
+                print(f"Failed to retire duplicate {doc['$id']}: {e}")
+    return retired
@@ -0,0 +1,270 @@
+# utils/email_outbox.py
+import os, json, time, random, smtplib, threading, requests
+from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
+from appwrite.services.users import Users
+from sendgrid import SendGridAPIClient
+from sendgrid.helpers.mail import Mail
+from utils.appwrite_client import get_appwrite_client
+from utils.local_store import ensure_schema, get_connection, transaction
+
+# Transport: "sendgrid" (default), "smtp" or "http". The last two make it easy to
+# point the outbox at a local stand-in, e.g. `python -m aiosmtpd -n -l localhost:1025`.
+EMAIL_TRANSPORT = os.getenv("EMAIL_TRANSPORT", "sendgrid")
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+EMAIL_HTTP_URL = os.getenv("EMAIL_HTTP_URL")
+
+EMAIL_SENDER_WORKERS = int(os.getenv("EMAIL_SENDER_WORKERS", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", "30"))
+# Seconds to hold digestible emails so several can be merged per user; 0 sends each one on its own
+EMAIL_DIGEST_WINDOW = float(os.getenv("EMAIL_DIGEST_WINDOW", "0"))
+EMAIL_CACHE_TTL = float(os.getenv("EMAIL_CACHE_TTL", "3600"))
+EMAIL_POLL_INTERVAL = 5
+EMAIL_CLAIM_TIMEOUT = 300
+EMAIL_SENT_RETENTION = 7 * 24 * 60 * 60
+
+# kind -> (render(payload) -> (subject, html), render_digest(payloads) -> (subject, html) or None)
+EMAIL_RENDERERS = {
+    "raw": (lambda payload: (payload["subject"], payload["html"]), None),
+}
+
+_email_cache = {}
+_email_cache_lock = threading.Lock()
+_sender_started = False
+_sender_lock = threading.Lock()
+_wake = threading.Event()
+
+
+class EmailUndeliverable(Exception):
+    """Raised by a transport for a failure retrying cannot fix, e.g. missing credentials."""
+
+
+def register_email_renderer(kind, render, render_digest=None):
+    EMAIL_RENDERERS[kind] = (render, render_digest)
+
+
+# Transports: raise on failure so the outbox can retry, EmailUndeliverable when it should not
+def _send_sendgrid(to_email, subject, html):
+    if not SENDGRID_API_KEY or not SENDER_EMAIL:
+        raise EmailUndeliverable("SendGrid credentials not configured")
+    mail = Mail(from_email=SENDER_EMAIL, to_emails=to_email, subject=subject, html_content=html)
+    SendGridAPIClient(SENDGRID_API_KEY).send(mail)
+
+
+def _send_smtp(to_email, subject, html):
+    message = EmailMessage()
+    message["From"] = SENDER_EMAIL or "aadd@localhost"
+    message["To"] = to_email
+    message["Subject"] = subject
+    message.set_content("This email requires an HTML capable client.")
+    message.add_alternative(html, subtype="html")
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD or "")
+        smtp.send_message(message)
+
+
+def _send_http(to_email, subject, html):
+    if not EMAIL_HTTP_URL:
+        raise EmailUndeliverable("EMAIL_HTTP_URL not configured")
+    resp = requests.post(
+        EMAIL_HTTP_URL,
+        json={"from": SENDER_EMAIL, "to": to_email, "subject": subject, "html": html},
+        timeout=30
+    )
+    resp.raise_for_status()
+
+
+TRANSPORTS = {
+    "sendgrid": _send_sendgrid,
+    "smtp": _send_smtp,
+    "http": _send_http,
+}
+
+
+def deliver_email(to_email, subject, html):
+    """Send one email right away through the configured transport. Raises on failure."""
+    transport = TRANSPORTS.get(EMAIL_TRANSPORT)
+    if transport is None:
+        raise EmailUndeliverable(f"Unknown EMAIL_TRANSPORT: {EMAIL_TRANSPORT}")
+    transport(to_email, subject, html)
+
+
+# Recipient lookup
+def get_cached_user_email(user_id):
+    """Fetch a user's email through a per-process TTL cache in front of the Users API."""
+    now = time.monotonic()
+    with _email_cache_lock:
+        cached = _email_cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+    try:
+        email = Users(get_appwrite_client()).get(user_id).get("email")
+    except Exception as e:
+        print(f"Error fetching email for user {user_id}: {e}")
+        return None
+    if email:
+        with _email_cache_lock:
+            _email_cache[user_id] = (email, now + EMAIL_CACHE_TTL)
+    return email
+
+
+# Outbox
+def _ensure_schema():
+    ensure_schema("email_outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            to_email TEXT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS email_outbox_due ON email_outbox (state, next_attempt_at)"
+    ])
+
+
+def enqueue_email(kind, payload, user_id=None, to_email=None):
+    """
+    Queue an email for background delivery and return its outbox ID.
+
+    The recipient is `to_email`, or else the address of `user_id` resolved at send
+    time (falling back to payload["fallbackEmail"]).
+    """
+    if kind not in EMAIL_RENDERERS:
+        raise ValueError(f"No email renderer registered for kind: {kind}")
+    _ensure_schema()
+    now = time.time()
+    cursor = get_connection().execute(
+        """
+        INSERT INTO email_outbox (user_id, to_email, kind, payload, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (user_id, to_email, kind, json.dumps(payload), now, now)
+    )
+    start_email_sender()
+    _wake.set()
+    return cursor.lastrowid
+
+
+def _claim_batch(now):
+    """Mark due emails as sending and return them grouped into deliveries."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE email_outbox SET state = 'pending' WHERE state = 'sending' AND claimed_at < ?",
+            (now - EMAIL_CLAIM_TIMEOUT,)
+        )
+        rows = conn.execute(
+            "SELECT * FROM email_outbox WHERE state = 'pending' AND next_attempt_at <= ? ORDER BY created_at LIMIT 200",
+            (now,)
+        ).fetchall()
+
+        groups = {}
+        for row in rows:
+            digestible = EMAIL_DIGEST_WINDOW > 0 and EMAIL_RENDERERS.get(row["kind"], (None, None))[1] is not None
+            key = (row["kind"], row["user_id"] or row["to_email"]) if digestible else ("single", row["id"])
+            groups.setdefault(key, []).append(row)
+
+        batches = []
+        for key, group in groups.items():
+            if key[0] != "single" and min(row["created_at"] for row in group) + EMAIL_DIGEST_WINDOW > now:
+                continue
+            batches.append(group)
+
+        claimed = [row["id"] for group in batches for row in group]
+        if claimed:
+            conn.execute(
+                f"UPDATE email_outbox SET state = 'sending', claimed_at = ? WHERE id IN ({','.join('?' * len(claimed))})",
+                [now, *claimed]
+            )
+        return batches
+
+
+def _deliver_batch(rows):
+    ids = [row["id"] for row in rows]
+    placeholders = ",".join("?" * len(ids))
+    conn = get_connection()
+    try:
+        first = rows[0]
+        payloads = [json.loads(row["payload"]) for row in rows]
+        to_email = first["to_email"] or (first["user_id"] and get_cached_user_email(first["user_id"])) \
+            or payloads[0].get("fallbackEmail")
+        if not to_email:
+            raise RuntimeError(f"No email address for user {first['user_id']}")
+
+        render, render_digest = EMAIL_RENDERERS[first["kind"]]
+        subject, html = render_digest(payloads) if len(payloads) > 1 else render(payloads[0])
+        deliver_email(to_email, subject, html)
+
+        conn.execute(
+            f"UPDATE email_outbox SET state = 'sent', sent_at = ?, attempts = attempts + 1 WHERE id IN ({placeholders})",
+            [time.time(), *ids]
+        )
+        print(f"📧 Email sent to {to_email}" + (f" (digest of {len(rows)})" if len(rows) > 1 else ""))
+    except Exception as e:
+        attempts = max(row["attempts"] for row in rows) + 1
+        if isinstance(e, EmailUndeliverable):
+            state, next_attempt = "failed", time.time()
+            print(f"❌ Email {ids} cannot be delivered: {e}")
+        elif attempts >= EMAIL_MAX_ATTEMPTS:
+            state, next_attempt = "failed", time.time()
+            print(f"❌ Giving up on email {ids} after {attempts} attempts: {e}")
+        else:
+            backoff = EMAIL_RETRY_BASE * (2 ** (attempts - 1))
+            state, next_attempt = "pending", time.time() + backoff + random.uniform(0, backoff / 4)
+            print(f"⚠️  Email {ids} failed (attempt {attempts}), retrying in {backoff:.0f}s: {e}")
+        conn.execute(
+            f"""
+            UPDATE email_outbox SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+            WHERE id IN ({placeholders})
+            """,
+            [state, attempts, next_attempt, str(e), *ids]
+        )
+
+
+def _sender_loop():
+    executor = ThreadPoolExecutor(max_workers=EMAIL_SENDER_WORKERS, thread_name_prefix="email-sender")
+    last_purge = 0.0
+    while True:
+        try:
+            now = time.time()
+            if now - last_purge > 3600:
+                get_connection().execute(
+                    "DELETE FROM email_outbox WHERE state = 'sent' AND sent_at < ?", (now - EMAIL_SENT_RETENTION,)
+                )
+                last_purge = now
+            futures = [executor.submit(_deliver_batch, batch) for batch in _claim_batch(now)]
+            for future in futures:
+                future.result()
+        except Exception as e:
+            print(f"⚠️  Email sender error: {e}")
+        _wake.wait(EMAIL_POLL_INTERVAL)
+        _wake.clear()
+
+
+def start_email_sender():
+    """Start the background sender in this process (once)."""
+    global _sender_started
+    with _sender_lock:
+        if _sender_started:
+            return
+        _ensure_schema()
+        threading.Thread(target=_sender_loop, name="email-outbox", daemon=True).start()
+        _sender_started = True
@@ -1,10 +1,13 @@
 # utils/embedding_utils.py
+import os, hashlib
 import numpy as np
 from typing import List, Dict
 from sklearn.metrics.pairwise import cosine_similarity
 from sentence_transformers import SentenceTransformer
+from utils.simhash import candidate_groups, simhash64
 
 MODEL_PATH = "./models/all-MiniLM-L6-v2"
+MODEL_NAME = os.path.basename(MODEL_PATH)
 model = SentenceTransformer(MODEL_PATH)
 
 def get_text_embedding(text: str) -> np.ndarray:
@@ -15,38 +18,118 @@ def get_text_embedding(text: str) -> np.ndarray:
     embedding = model.encode(text, convert_to_numpy=True)
     return np.array(embedding, dtype=np.float32)
 
+TEXT_SIMILARITY_THRESHOLD = 0.9
+# Candidate stage for database scans: "simhash" (LSH over SimHashes) or "all" (every pair)
+TEXT_DEDUP_CANDIDATES = os.getenv("TEXT_DEDUP_CANDIDATES", "simhash")
+# Confirmation of candidates: "embedding" (cosine of model embeddings) or "simhash" (accept LSH candidates as is)
+TEXT_DEDUP_CONFIRM = os.getenv("TEXT_DEDUP_CONFIRM", "embedding")
+# Below this many records every pair is compared anyway
+SIMHASH_MIN_RECORDS = int(os.getenv("SIMHASH_MIN_RECORDS", "500"))
+
+def _embed_missing(records: List[Dict[str, str]], indexes, embeddings: Dict) -> int:
+    """Add embeddings for records[i] not in `embeddings`; returns how many were computed."""
+    missing = [i for i in indexes if records[i]["id"] not in embeddings]
+    for i in missing:
+        embeddings[records[i]["id"]] = get_text_embedding(records[i]["text"])
+    return len(missing)
+
+def _split_text_groups(texts: List[str], groups, pairs):
+    """
+    Split groups of identical SimHashes into groups of identical texts. Different texts
+    can share a SimHash, so those within a hash group become candidate pairs too.
+    """
+    split_groups, split_pairs, parts = [], set(), []
+    for members in groups:
+        by_text = {}
+        for i in members:
+            by_text.setdefault(hashlib.sha1(texts[i].encode()).digest(), []).append(i)
+        ids = list(range(len(split_groups), len(split_groups) + len(by_text)))
+        split_groups.extend(by_text.values())
+        split_pairs.update((a, b) for k, a in enumerate(ids) for b in ids[k + 1:])
+        parts.append(ids)
+    for a, b in pairs:
+        split_pairs.update((min(x, y), max(x, y)) for x in parts[a] for y in parts[b])
+    return split_groups, split_pairs
+
 def detect_textual_duplicates(
-    records: List[Dict[str, str]], threshold: float = 0.9
+    records: List[Dict[str, str]], threshold: float = TEXT_SIMILARITY_THRESHOLD, embeddings: Dict | None = None,
+    stats: Dict | None = None
 ) -> List[List[Dict[str, str]]]:
     """
     Detects textual duplicates using cosine similarity between embeddings.
+
+    Large collections first bucket records by SimHash (LSH banding) and only embed
+    and compare records that share a band; see TEXT_DEDUP_CANDIDATES/TEXT_DEDUP_CONFIRM.
     
     Args:
-        records: list of dicts like [{ "id": "123", "text": "some text" }]
+        records: list of dicts like [{ "id": "123", "text": "some text" }], optionally
+            with "canonical" text to SimHash instead of "text".
         threshold: similarity threshold for considering duplicates.
+        embeddings: optional dict of record id -> embedding; known ones are reused, the rest are computed and added.
+        stats: optional dict filled with "compared" (pairs scored) and "embedded" (embeddings computed).
     
     Returns:
         List of clusters, each a list of duplicate records.
     """
     if not records:
         return []
+    known = embeddings if embeddings is not None else {}
+    stats = stats if stats is not None else {}
 
-    embeddings = np.stack([get_text_embedding(r["text"]) for r in records])
-    sims = cosine_similarity(embeddings)
+    if TEXT_DEDUP_CANDIDATES != "simhash" or len(records) < SIMHASH_MIN_RECORDS:
+        stats["embedded"] = _embed_missing(records, range(len(records)), known)
+        stats["compared"] = len(records) * (len(records) - 1) // 2
+        sims = cosine_similarity(np.stack([known[r["id"]] for r in records]))
 
+        visited = set()
+        clusters = []
+
+        for i, rec in enumerate(records):
+            if i in visited:
+                continue
+            cluster = [rec]
+            visited.add(i)
+            for j in range(i + 1, len(records)):
+                if sims[i, j] >= threshold:
+                    cluster.append(records[j])
+                    visited.add(j)
+            if len(cluster) > 1:
+                clusters.append(cluster)
+
+        return clusters
+
+    texts = [r.get("canonical") or r["text"] for r in records]
+    groups, pairs = _split_text_groups(texts, *candidate_groups([simhash64(text) for text in texts]))
+    stats["embedded"] = 0
+    stats["compared"] = len(pairs)
+    if TEXT_DEDUP_CONFIRM == "embedding" and pairs:
+        # Identical texts are taken as duplicates; every other pair needs the model
+        representatives = sorted({group for pair in pairs for group in pair})
+        stats["embedded"] = _embed_missing(records, [groups[g][0] for g in representatives], known)
+        vectors = {}
+        for g in representatives:
+            vector = known[records[groups[g][0]]["id"]]
+            vectors[g] = vector / (np.linalg.norm(vector) or 1.0)
+        pairs = {(a, b) for a, b in pairs if float(np.dot(vectors[a], vectors[b])) >= threshold}
+
+    neighbours = {}
+    for a, b in pairs:
+        neighbours.setdefault(a, set()).add(b)
+        neighbours.setdefault(b, set()).add(a)
+    group_of = {i: g for g, members in enumerate(groups) for i in members}
+
+    # Same greedy clustering as above: a record takes every later record it matches
     visited = set()
     clusters = []
 
     for i, rec in enumerate(records):
         if i in visited:
             continue
-        cluster = [rec]
         visited.add(i)
-        for j in range(i + 1, len(records)):
-            if sims[i, j] >= threshold:
-                cluster.append(records[j])
-                visited.add(j)
-        if len(cluster) > 1:
-            clusters.append(cluster)
-
-    return clusters
\ No newline at end of file
+        g = group_of[i]
+        related = sorted(j for h in (g, *neighbours.get(g, ())) for j in groups[h] if j > i)
+        visited.update(related)
+        if related:
+            clusters.append([rec] + [records[j] for j in related])
+
+    return clusters
@@ -0,0 +1,271 @@
+# utils/event_ingest.py
+import os, re, json, threading
+from collections import defaultdict
+from appwrite.query import Query
+from utils.appwrite_client import get_database_client, list_all_documents
+from utils.duplicate_records import DUPLICATES_COLLECTION, build_pair_records, retire_pair_records, upsert_pair_record
+from utils.embedding_utils import get_text_embedding, TEXT_SIMILARITY_THRESHOLD
+from utils.file_utils import compute_exact_hash, compute_file_hash
+from utils.fingerprint_index import (
+    entry_fingerprint, load_bucket_index, rank_matches, upsert_file_fingerprint, remove_file_fingerprint,
+    load_collection_embeddings, upsert_document_embedding, remove_document_embedding, text_tag
+)
+from utils.garden_stats import update_garden_stats
+from utils.project_clients import get_project_doc, get_project_clients
+from utils.scan_results import invalidate_scan_results
+
+# Appwrite sends every matching pattern of a change (with * wildcards); only the fully resolved names are used
+FILE_EVENT = re.compile(r"^buckets\.([^.*]+)\.files\.([^.*]+)\.(create|update|delete)$")
+DOCUMENT_EVENT = re.compile(r"^databases\.([^.*]+)\.collections\.([^.*]+)\.documents\.([^.*]+)\.(create|update|delete)$")
+
+# Changes in the same bucket/collection are applied one at a time so two new copies still see each other
+_location_locks = defaultdict(threading.Lock)
+_location_locks_guard = threading.Lock()
+
+
+class IngestError(Exception):
+    """Raised when an event cannot be applied, with the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_events(events):
+    """Turn Appwrite event names into distinct changes: {"service", "action", ids...}."""
+    changes = {}
+    for event in events or []:
+        match = FILE_EVENT.match(event)
+        if match:
+            bucket_id, file_id, action = match.groups()
+            changes[("storage", bucket_id, file_id)] = {
+                "service": "storage", "action": action, "bucketId": bucket_id, "objectId": file_id
+            }
+            continue
+        match = DOCUMENT_EVENT.match(event)
+        if match:
+            database_id, collection_id, document_id, action = match.groups()
+            changes[("database", database_id, collection_id, document_id)] = {
+                "service": "database", "action": action, "databaseId": database_id,
+                "collectionId": collection_id, "objectId": document_id
+            }
+    return list(changes.values())
+
+
+def _location_lock(key):
+    with _location_locks_guard:
+        return _location_locks[key]
+
+
+class EventIngest:
+    """Applies change events of one project to its fingerprint/embedding index and duplicate records."""
+
+    def __init__(self, project_doc, main_db=None):
+        self.project_doc = project_doc
+        self.project_id = project_doc.get("projectId")
+        self.user_id = project_doc.get("userId")
+        self.main_db = main_db or get_database_client()
+        self.db, self.storage = get_project_clients(project_doc)
+
+    def _scope(self, change):
+        queries = [Query.equal("projectId", self.project_id), Query.equal("service", change["service"])]
+        if change["service"] == "storage":
+            queries.append(Query.equal("bucketId", change["bucketId"]))
+        else:
+            queries += [Query.equal("databaseId", change["databaseId"]), Query.equal("collectionId", change["collectionId"])]
+        return queries
+
+    def _file_url(self, bucket_id, file_id):
+        endpoint = self.project_doc.get("endpoint") or os.getenv("APPWRITE_ENDPOINT")
+        return f"{endpoint}/storage/buckets/{bucket_id}/files/{file_id}/view?project={self.project_id}"
+
+    def _store_pair(self, change, original, duplicate, counts):
+        """Record `duplicate` as a copy of `original`; both are cluster items as a scan builds them."""
+        cluster_doc = {
+            "userId": self.user_id,
+            "projectId": self.project_id,
+            "service": change["service"],
+            "type": "file" if change["service"] == "storage" else "text",
+            "clusters": json.dumps([original, duplicate])
+        }
+        for field in ("bucketId", "databaseId", "collectionId"):
+            if change.get(field):
+                cluster_doc[field] = change[field]
+        for record in build_pair_records([cluster_doc]):
+            counts[upsert_pair_record(self.main_db, record)] += 1
+
+    # Storage
+
+    def _file_item(self, bucket_id, file_id, filename, score=None):
+        return {
+            "id": file_id,
+            "url": self._file_url(bucket_id, file_id),
+            "filename": filename,
+            "similarity_score": 1.0 if score is None else round(score / 100, 2)
+        }
+
+    def _pair_file(self, change, file_id, filename, md5, fingerprint, counts, skip=()):
+        """Pair a file with its best duplicate in the bucket index. Returns the matched file ID or None."""
+        index = load_bucket_index(self.project_id, change["bucketId"])
+        if index is None:
+            return None
+        for match in rank_matches(index, md5, fingerprint, filename, k=len(skip) + 1, exclude_id=file_id):
+            if not match["isDuplicate"]:
+                break
+            if match["fileId"] in skip:
+                continue
+            self._store_pair(
+                change,
+                self._file_item(change["bucketId"], match["fileId"], match["filename"]),
+                self._file_item(change["bucketId"], file_id, filename, 100.0 if match["exact"] else match["score"]),
+                counts
+            )
+            return match["fileId"]
+        return None
+
+    def _index_file(self, change, payload, counts):
+        bucket_id, file_id = change["bucketId"], change["objectId"]
+        filename = payload.get("name") or self.storage.get_file(bucket_id, file_id).get("name", "")
+        file_bytes = self.storage.get_file_download(bucket_id, file_id)
+        if not file_bytes:
+            raise IngestError(f"File {file_id} is empty", 422)
+        md5 = compute_exact_hash(file_bytes)
+        fingerprint = compute_file_hash(file_bytes, filename)
+        self._pair_file(change, file_id, filename, md5, fingerprint, counts)
+        upsert_file_fingerprint(self.project_id, bucket_id, {
+            "id": file_id, "filename": filename, "md5": md5, "fingerprint": fingerprint
+        })
+
+    def _repair_file(self, change, file_id, skip, counts):
+        index = load_bucket_index(self.project_id, change["bucketId"])
+        entry = next((
+            entry for group in (index or {}).get("entries", {}).values() for entry in group if entry["file_id"] == file_id
+        ), None)
+        if entry is None:
+            return None
+        return self._pair_file(change, file_id, entry["filename"], entry["md5"], entry_fingerprint(index, entry), counts, skip=skip)
+
+    # Database
+
+    def _pair_document(self, change, document_id, vector, counts, skip=()):
+        """Pair a document with its most similar document in the collection. Returns the matched ID or None."""
+        snapshot = load_collection_embeddings(self.project_id, change["databaseId"], change["collectionId"])
+        matches = snapshot.search(vector, k=1, threshold=TEXT_SIMILARITY_THRESHOLD, exclude={document_id, *skip})
+        if not matches:
+            return None
+        # Same cluster item shape as a database scan, so reconciliation sees the pair unchanged
+        self._store_pair(change, {"id": matches[0][0]}, {"id": document_id}, counts)
+        return matches[0][0]
+
+    def _index_document(self, change, payload, counts):
+        document_id = change["objectId"]
+        if not payload or payload.get("$id") != document_id:
+            payload = self.db.get_document(change["databaseId"], change["collectionId"], document_id)
+        text = json.dumps(payload)
+        vector = get_text_embedding(text)
+        self._pair_document(change, document_id, vector, counts)
+        upsert_document_embedding(
+            self.project_id, change["databaseId"], change["collectionId"], document_id, vector, text_tag(text)
+        )
+
+    def _repair_document(self, change, document_id, skip, counts):
+        vector = load_collection_embeddings(self.project_id, change["databaseId"], change["collectionId"]).get(document_id)
+        if vector is None:
+            return None
+        return self._pair_document(change, document_id, vector, counts, skip=skip)
+
+    # Dispatch
+
+    def _repair(self, change, retired, counts):
+        """
+        Re-pair the objects whose pairs were retired with the changed object.
+
+        An object that is still linked to others through an active pair is left alone; the
+        rest are paired with their best match outside their group, so no pair is recorded
+        twice and no cycles form.
+        """
+        group = {}
+
+        def find(object_id):
+            while group.get(object_id, object_id) != object_id:
+                object_id = group[object_id]
+            return object_id
+
+        database_id = os.getenv("APPWRITE_DATABASE_ID", "default")
+        for doc in list_all_documents(self.main_db, database_id, DUPLICATES_COLLECTION, [*self._scope(change), Query.equal("status", "active")]):
+            group[find(doc["duplicateId"])] = find(doc["originalId"])
+
+        survivors = []
+        for doc in retired:
+            for object_id in (doc.get("originalId"), doc.get("duplicateId")):
+                if object_id and object_id != change["objectId"] and object_id not in survivors:
+                    survivors.append(object_id)
+
+        repair = self._repair_file if change["service"] == "storage" else self._repair_document
+        for object_id in survivors:
+            root = find(object_id)
+            if root != object_id or any(find(other) == root for other in group if other != object_id):
+                continue
+            members = {other for other in set(group) | set(group.values()) if find(other) == root}
+            matched = repair(change, object_id, {change["objectId"], object_id} | members, counts)
+            if matched:
+                group[find(object_id)] = find(matched)
+
+    def apply(self, change, payload):
+        """Apply one change. Returns the change with per-operation counts."""
+        counts = defaultdict(int)
+        storage = change["service"] == "storage"
+        location = (self.project_id, change.get("bucketId") or f"{change['databaseId']}/{change['collectionId']}")
+        with _location_lock(location):
+            retired = []
+            if change["action"] != "create":
+                # The object's content or existence changed, so every pair it was part of is stale
+                retired = retire_pair_records(self.main_db, self._scope(change), change["objectId"])
+                counts["retired"] += len(retired)
+
+            if change["action"] == "delete":
+                if storage:
+                    remove_file_fingerprint(self.project_id, change["bucketId"], change["objectId"])
+                else:
+                    remove_document_embedding(self.project_id, change["databaseId"], change["collectionId"], change["objectId"])
+            elif storage:
+                self._index_file(change, payload, counts)
+            else:
+                self._index_document(change, payload, counts)
+
+            if retired:
+                self._repair(change, retired, counts)
+        return {**change, **counts}
+
+
+def ingest_events(project_id, events, payload):
+    """
+    Apply one Appwrite event delivery (its event names and the changed resource) to a project.
+
+    Returns {"status", "changes"}; changes the delivery did not contain are not touched.
+    """
+    changes = parse_events(events)
+    if not changes:
+        return {"status": "ignored", "changes": []}
+    project_doc = get_project_doc(project_id)
+    if project_doc is None:
+        raise IngestError("Project not connected", 404)
+
+    ingest = EventIngest(project_doc)
+    results = []
+    for change in changes:
+        try:
+            results.append({**ingest.apply(change, payload or {}), "status": "applied"})
+        except Exception as e:
+            print(f"❌ Failed to apply {change['service']} {change['action']} for {change['objectId']}: {e}")
+            results.append({**change, "status": "failed", "error": str(e)})
+
+    inserted = sum(result.get("inserted", 0) for result in results)
+    if any(result.get(op) for result in results for op in ("inserted", "updated", "retired")):
+        invalidate_scan_results(ingest.user_id, project_id)
+    if inserted:
+        try:
+            update_garden_stats(user_id=ingest.user_id, increment_duplicates=inserted)
+        except Exception as e:
+            print(f"⚠️  Failed to update garden stats: {e}")
+    return {"status": "success", "changes": results}
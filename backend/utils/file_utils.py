@@ -9,7 +9,13 @@ import pandas as pd
 from io import BytesIO
 from PIL import Image
 from collections import defaultdict
+from functools import lru_cache
 from numpy.linalg import norm
+from utils.minhash import (
+    MinHashLSH, decode_signature, empty_signature, encode_signature, finish_signature, jaccard_estimate, minhash_signature,
+    jaccard_score, needs_tiebreak, one_permutation_jaccard, one_permutation_update,
+    MINHASH_EMBEDDING_THRESHOLD, MINHASH_MATCH
+)
 
 # Handling imports for dependencies
 try:
@@ -31,16 +37,24 @@ except ImportError:
     AUDIO_SUPPORT = False
     print("Warning: librosa not installed. Audio duplicate detection disabled.")
 
+TEXT_MODEL_PATH = "/app/models/all-MiniLM-L6-v2"
+
 try:
     from PyPDF2 import PdfReader
     from sentence_transformers import SentenceTransformer
     DOC_SUPPORT = True
-    text_model = SentenceTransformer("/app/models/all-MiniLM-L6-v2")
+    text_model = SentenceTransformer(TEXT_MODEL_PATH)
 except ImportError:
     DOC_SUPPORT = False
     text_model = None
     print("Warning: PyPDF2/sentence-transformers not installed. Document duplicate detection limited.")
 
+try:
+    from openpyxl import load_workbook
+    EXCEL_SUPPORT = True
+except ImportError:
+    EXCEL_SUPPORT = False
+
 try:
     from pptx import Presentation
     from pptx.enum.shapes import MSO_SHAPE_TYPE
@@ -68,6 +82,26 @@ EXTENSIONS = {
 
 SIMILARITY_THRESHOLD = 20 
 
+# File types fingerprinted as plain vectors, and what produces them. Stored vectors
+# are only reused while the producer is unchanged. Documents, PDFs and columnar-mode
+# tables are sketched instead; their entries load vectors stored by older scans.
+VECTOR_FINGERPRINT_MODELS = {
+    "documents": os.path.basename(TEXT_MODEL_PATH),
+    "pdfs": os.path.basename(TEXT_MODEL_PATH),
+    "tables": os.path.basename(TEXT_MODEL_PATH),
+    "audios": "mfcc13-mean",
+    "videos": "orb-mean"
+}
+
+# File types fingerprinted with MinHash sketches of their words; embeddings only break ties
+MINHASH_TYPES = {"documents", "pdfs"}
+
+# "columnar" (schema signature plus a MinHash sketch per column) or "embedding" (one embedding of the cells)
+TABLE_FINGERPRINT_MODE = os.getenv("TABLE_FINGERPRINT_MODE", "columnar")
+# Rows read per chunk, which bounds the memory of columnar table fingerprints
+TABLE_CHUNK_ROWS = int(os.getenv("TABLE_CHUNK_ROWS", "50000"))
+TABLE_MAX_COLUMNS = int(os.getenv("TABLE_MAX_COLUMNS", "256"))
+
 
 def get_file_type(filename):
     """Determine file type from extension."""
@@ -261,8 +295,40 @@ def hash_audio(file_bytes):
         return None
 
 
+def extract_pdf_text(file_bytes):
+    """Extract the text of the first 10 pages of a PDF."""
+    reader = PdfReader(BytesIO(file_bytes))
+    text = ""
+    
+    for page in reader.pages[:10]:
+        try:
+            extracted = page.extract_text()
+            if extracted:
+                text += extracted + " "
+        except Exception as e:
+            print(f"Error extracting page text: {e}")
+            continue
+    
+    return text
+
+
+def extract_document_text(file_bytes, filename):
+    """Text of a PDF or text document, as it is sketched and embedded."""
+    if get_file_type(filename) == "pdfs":
+        return extract_pdf_text(file_bytes)
+    return file_bytes.decode('utf-8', errors='ignore')
+
+
+def sketch_text(text):
+    """MinHash fingerprint of a text: {"minhash": base64 sketch}, later possibly with its "embedding"."""
+    signature = minhash_signature(text)
+    if signature is None:
+        return None
+    return json.dumps({"minhash": encode_signature(signature)})
+
+
 def hash_text_file(file_bytes):
-    """Hash text file using sentence embeddings."""
+    """Hash text file using a MinHash sketch of its words."""
     if not DOC_SUPPORT or text_model is None:
         return None
     
@@ -273,37 +339,25 @@ def hash_text_file(file_bytes):
             print("Error: Text file is empty")
             return None
         
-        embedding = text_model.encode(content, convert_to_numpy=True)
-        return serialize_hash(embedding)
+        return sketch_text(content)
     except Exception as e:
         print(f"Error hashing text: {e}")
         return None
 
 
 def hash_pdf_file(file_bytes):
-    """Hash PDF using sentence embeddings of extracted text."""
+    """Hash PDF using a MinHash sketch of the words of its extracted text."""
     if not DOC_SUPPORT or text_model is None:
         return None
     
     try:
-        reader = PdfReader(BytesIO(file_bytes))
-        text = ""
-        
-        for page in reader.pages[:10]:
-            try:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + " "
-            except Exception as e:
-                print(f"Error extracting page text: {e}")
-                continue
+        text = extract_pdf_text(file_bytes)
         
         if not text.strip():
             print("Error: No text extracted from PDF")
             return None
         
-        embedding = text_model.encode(text, convert_to_numpy=True)
-        return serialize_hash(embedding)
+        return sketch_text(text)
     except Exception as e:
         print(f"Error hashing PDF: {e}")
         return None
@@ -340,6 +394,81 @@ def hash_table_file(file_bytes, filename):
         return None
 
 
+def _table_chunks(file_bytes, filename):
+    """Yield a table as DataFrames of at most TABLE_CHUNK_ROWS rows of strings (first sheet of Excel files)."""
+    ext = os.path.splitext(filename.lower())[1]
+    
+    if ext == ".csv":
+        yield from pd.read_csv(
+            BytesIO(file_bytes), dtype=str, encoding='utf-8', encoding_errors='ignore',
+            keep_default_na=False, skipinitialspace=True, chunksize=TABLE_CHUNK_ROWS
+        )
+        return
+    
+    if not EXCEL_SUPPORT:
+        raise ImportError("openpyxl is required to read Excel tables")
+    workbook = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"column_{i}" if name is None else str(name) for i, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            values = ["" if value is None else str(value) for value in row[:len(columns)]]
+            batch.append(values + [""] * (len(columns) - len(values)))
+            if len(batch) >= TABLE_CHUNK_ROWS:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def hash_table_columns(file_bytes, filename):
+    """
+    Hash table files column by column: a signature of the (order-independent) column names
+    plus a one-permutation MinHash sketch of each column's values, read in chunks.
+    """
+    try:
+        names, signatures, counts, rows = None, [], [], 0
+        
+        for chunk in _table_chunks(file_bytes, filename):
+            if names is None:
+                names = []
+                for i, column in enumerate(chunk.columns[:TABLE_MAX_COLUMNS]):
+                    name = str(column).strip().lower()
+                    names.append(name if name not in names else f"{name}.{i}")
+                signatures = [empty_signature() for _ in names]
+                counts = [0] * len(names)
+            rows += len(chunk)
+            
+            for i in range(len(names)):
+                values = chunk.iloc[:, i]
+                values = values[values != ""]
+                if len(values):
+                    one_permutation_update(signatures[i], pd.util.hash_pandas_object(values, index=False).to_numpy())
+                    counts[i] += len(values)
+        
+        if not names or not any(counts):
+            print("Error: Table file is empty")
+            return None
+        
+        return json.dumps({"table": {
+            "schema": hashlib.sha1("\x1f".join(sorted(names)).encode()).hexdigest(),
+            "rows": rows,
+            "columns": {
+                name: encode_signature(finish_signature(signature))
+                for name, signature, count in zip(names, signatures, counts) if count
+            }
+        }})
+    except Exception as e:
+        print(f"Error hashing table: {e}")
+        return None
+
+
 def extract_text_from_pptx(file_bytes):
     """Extract text from PPTX file."""
     if not PPTX_SUPPORT:
@@ -448,18 +577,17 @@ def compute_file_hash(file_bytes, filename):
     
     elif file_type == "documents":
         hash_result = hash_text_file(file_bytes)
-        if hash_result:
-            hash_result = json.dumps(hash_result)
     
     elif file_type == "pdfs":
         hash_result = hash_pdf_file(file_bytes)
-        if hash_result:
-            hash_result = json.dumps(hash_result)
     
     elif file_type == "tables":
-        hash_result = hash_table_file(file_bytes, filename)
-        if hash_result:
-            hash_result = json.dumps(hash_result)
+        if TABLE_FINGERPRINT_MODE == "columnar":
+            hash_result = hash_table_columns(file_bytes, filename)
+        else:
+            hash_result = hash_table_file(file_bytes, filename)
+            if hash_result:
+                hash_result = json.dumps(hash_result)
     
     elif file_type == "pptx":
         hash_result = hash_pptx_file(file_bytes)
@@ -472,12 +600,151 @@ def compute_file_hash(file_bytes, filename):
     return hash_result
 
 
+@lru_cache(maxsize=4096)
+def parse_vector_hash(serialized):
+    """
+    Parse a vector fingerprint into a unit float32 array (None if empty or all zeros).
+    Cached, so comparing one file against many parses its fingerprint once.
+    """
+    vector = np.array([v for v in json.loads(serialized) if isinstance(v, (int, float))], dtype=np.float32)
+    length = norm(vector)
+    if vector.size == 0 or length == 0:
+        return None
+    return vector / length
+
+
+def is_minhash_hash(value):
+    return isinstance(value, str) and value.startswith('{"minhash"')
+
+
+def is_table_hash(value):
+    return isinstance(value, str) and value.startswith('{"table"')
+
+
+def is_current_fingerprint(fingerprint, filename):
+    """
+    False for fingerprints in a format this version no longer produces: embedded PDFs/text
+    documents, and tables fingerprinted in the other TABLE_FINGERPRINT_MODE.
+    """
+    file_type = get_file_type(filename)
+    fingerprint = str(fingerprint)
+    if file_type in MINHASH_TYPES:
+        return not fingerprint.startswith("[")
+    if file_type == "tables":
+        return not fingerprint.startswith("[") if TABLE_FINGERPRINT_MODE == "columnar" else not is_table_hash(fingerprint)
+    return True
+
+
+@lru_cache(maxsize=4096)
+def parse_minhash_hash(serialized):
+    """Parse a MinHash fingerprint into (sketch, unit embedding or None)."""
+    data = json.loads(serialized)
+    embedding = None
+    if data.get("embedding"):
+        vector = np.asarray(data["embedding"], dtype=np.float32)
+        length = norm(vector)
+        if length:
+            embedding = vector / length
+    return decode_signature(data["minhash"]), embedding
+
+
+def minhash_tiebreak_needed(hash1, hash2):
+    """Whether two MinHash fingerprints are too close to call and one still lacks its embedding."""
+    (sketch1, vector1), (sketch2, vector2) = parse_minhash_hash(hash1), parse_minhash_hash(hash2)
+    return needs_tiebreak(jaccard_estimate(sketch1, sketch2)) and (vector1 is None or vector2 is None)
+
+
+def add_text_embedding(fingerprint, file_bytes, filename):
+    """Return a MinHash fingerprint with the transformer embedding of the file's text added."""
+    data = json.loads(fingerprint)
+    if data.get("embedding") or text_model is None:
+        return fingerprint
+    text = extract_document_text(file_bytes, filename)
+    if not text.strip():
+        return fingerprint
+    data["embedding"] = serialize_hash(text_model.encode(text, convert_to_numpy=True))
+    return json.dumps(data)
+
+
+def minhash_match(hash1, hash2):
+    """
+    Decide whether two MinHash fingerprints are duplicates. Returns (duplicate, score 0-100):
+    from MINHASH_MATCH estimated Jaccard similarity they are, below MINHASH_REJECT they are
+    not, and in between the embedding cosine decides against MINHASH_EMBEDDING_THRESHOLD
+    (no duplicate while an embedding is missing). Jaccard estimates are scored with
+    jaccard_score so they read like the cosines.
+    """
+    (sketch1, vector1), (sketch2, vector2) = parse_minhash_hash(hash1), parse_minhash_hash(hash2)
+    similarity = jaccard_estimate(sketch1, sketch2)
+    if needs_tiebreak(similarity) and vector1 is not None and vector2 is not None and vector1.shape == vector2.shape:
+        cosine = float(np.clip(np.dot(vector1, vector2), 0, 1))
+        return cosine >= MINHASH_EMBEDDING_THRESHOLD, cosine * 100
+    return similarity >= MINHASH_MATCH, jaccard_score(similarity) * 100
+
+
+def minhash_similarity(hash1, hash2):
+    """Similarity (0-100) of two MinHash fingerprints, see minhash_match."""
+    return minhash_match(hash1, hash2)[1]
+
+
+@lru_cache(maxsize=4096)
+def parse_table_hash(serialized):
+    """Parse a columnar table fingerprint into (schema, column names, one sketch per row of a matrix)."""
+    table = json.loads(serialized)["table"]
+    names = list(table["columns"])
+    if not names:
+        return table["schema"], names, np.zeros((0, 0), dtype=np.uint32)
+    return table["schema"], names, np.stack([decode_signature(table["columns"][name]) for name in names])
+
+
+def table_similarity(hash1, hash2):
+    """
+    Similarity (0-100) of two columnar table fingerprints. Columns are paired one to one,
+    by name when both tables have the same columns and otherwise best-matching values
+    first, so reordered or renamed columns still match; the estimated Jaccard similarities
+    of the pairs are averaged over the wider table.
+    """
+    schema1, names1, sketches1 = parse_table_hash(hash1)
+    schema2, names2, sketches2 = parse_table_hash(hash2)
+    if not names1 or not names2 or sketches1.shape[1] != sketches2.shape[1]:
+        return 0.0
+    width = max(len(names1), len(names2))
+    
+    if schema1 == schema2 and sorted(names1) == sorted(names2):
+        rows2 = {name: i for i, name in enumerate(names2)}
+        matches = one_permutation_jaccard(sketches1, sketches2[[rows2[name] for name in names1]])
+        return float(matches.sum() / width * 100)
+    
+    similarity = one_permutation_jaccard(sketches1[:, None, :], sketches2[None, :, :])
+    used1, used2, total = set(), set(), 0.0
+    for flat in np.argsort(-similarity, axis=None, kind="stable"):
+        i, j = divmod(int(flat), len(names2))
+        if i in used1 or j in used2:
+            continue
+        used1.add(i)
+        used2.add(j)
+        total += similarity[i, j]
+        if len(used1) == min(len(names1), len(names2)):
+            break
+    return float(total / width * 100)
+
+
 def compute_similarity(hash1, hash2):
     """Compute similarity between two hashes (0-100%)."""
     try:
         if hash1 == hash2:
             return 100.0
         
+        if is_minhash_hash(hash1) or is_minhash_hash(hash2):
+            if not (is_minhash_hash(hash1) and is_minhash_hash(hash2)):
+                return 0
+            return minhash_similarity(hash1, hash2)
+        
+        if is_table_hash(hash1) or is_table_hash(hash2):
+            if not (is_table_hash(hash1) and is_table_hash(hash2)):
+                return 0
+            return table_similarity(hash1, hash2)
+        
         is_image_hash1 = False
         is_image_hash2 = False
         
@@ -549,24 +816,13 @@ def compute_similarity(hash1, hash2):
         
         if isinstance(hash1, str) and hash1.startswith('[') and \
            isinstance(hash2, str) and hash2.startswith('['):
-            vec1 = json.loads(hash1)
-            vec2 = json.loads(hash2)
+            vec1 = parse_vector_hash(hash1)
+            vec2 = parse_vector_hash(hash2)
             
-            vec1_filtered = np.array([v for v in vec1 if isinstance(v, (int, float))])
-            vec2_filtered = np.array([v for v in vec2 if isinstance(v, (int, float))])
-            
-            if vec1_filtered.shape != vec2_filtered.shape or vec1_filtered.size == 0:
-                return 0
-            
-            norm1 = norm(vec1_filtered)
-            norm2 = norm(vec2_filtered)
-            
-            if norm1 == 0 or norm2 == 0:
+            if vec1 is None or vec2 is None or vec1.shape != vec2.shape:
                 return 0
             
-            cosine_sim = np.dot(vec1_filtered, vec2_filtered) / (norm1 * norm2)
-            
-            cosine_sim = np.clip(cosine_sim, 0, 1)
+            cosine_sim = np.clip(np.dot(vec1, vec2), 0, 1)
             return float(cosine_sim * 100)
         
         if (isinstance(hash1, str) and hash1.startswith('[')) or \
@@ -598,7 +854,7 @@ def compute_similarity(hash1, hash2):
         return 0.0
 
 
-def detect_file_duplicates(file_records):
+def detect_file_duplicates(file_records, progress=None, fingerprints=None):
     """
     Detect duplicates using efficient pairwise comparison.
     
@@ -607,6 +863,8 @@ def detect_file_duplicates(file_records):
         - url: file URL (optional)
         - file_bytes: binary content
         - filename: original filename
+    progress: optional ScanProgress receiving fingerprinted/compared/clusters counts
+    fingerprints: optional dict of file id -> hash; known hashes are reused, the rest are computed and added
     
     Returns: list of duplicate clusters
     """
@@ -615,6 +873,9 @@ def detect_file_duplicates(file_records):
     
     clusters = []
     seen_files = []
+    # LSH over the sketches of seen documents, so each one is only compared with likely matches
+    sketch_indexes = defaultdict(MinHashLSH)
+    tiebreaks = 0
     
     files_by_type = defaultdict(list)
     for record in file_records:
@@ -638,8 +899,10 @@ def detect_file_duplicates(file_records):
         
         print(f"[{idx+1}/{len(file_records)}] Processing: {filename}")
         
+        # Fingerprints passed in were computed by an earlier scan of the same content
+        file_hash = fingerprints.get(record['id']) if fingerprints is not None else None
         try:
-            file_hash = compute_file_hash(file_bytes, filename)
+            file_hash = file_hash or compute_file_hash(file_bytes, filename)
         except Exception as e:
             print(f"  ⚠ Error computing hash: {e}")
             continue
@@ -648,14 +911,40 @@ def detect_file_duplicates(file_records):
             print(f"  ⚠ Failed to compute hash")
             continue
         
+        if progress:
+            progress.advance("fingerprinted")
+        if fingerprints is not None:
+            fingerprints[record['id']] = file_hash
+        
         is_duplicate = False
         duplicate_cluster = None
         best_match = None
         best_similarity = 0
         
-        for seen_idx, seen in enumerate(seen_files):
+        file_type = get_file_type(filename)
+        sketch = parse_minhash_hash(file_hash)[0] if is_minhash_hash(file_hash) else None
+        if sketch is not None:
+            # Documents sharing no band are well below MINHASH_REJECT and decided without comparing
+            comparisons = [seen_files[i] for i in sorted(sketch_indexes[file_type].candidates(sketch))]
+        else:
+            comparisons = seen_files
+        
+        for seen_idx, seen in enumerate(comparisons):
             try:
-                similarity = compute_similarity(file_hash, seen["hash"])
+                if sketch is not None and is_minhash_hash(seen["hash"]) and minhash_tiebreak_needed(file_hash, seen["hash"]):
+                    file_hash = add_text_embedding(file_hash, file_bytes, filename)
+                    seen["hash"] = add_text_embedding(seen["hash"], seen["record"]["file_bytes"], seen["record"].get("filename", ""))
+                    tiebreaks += 1
+                    if fingerprints is not None:
+                        fingerprints[record['id']] = file_hash
+                        fingerprints[seen['record']['id']] = seen["hash"]
+                
+                if sketch is not None and is_minhash_hash(seen["hash"]):
+                    # Sketched documents are decided by MinHash bands and embeddings, not the generic threshold
+                    matched, similarity = minhash_match(file_hash, seen["hash"])
+                else:
+                    similarity = compute_similarity(file_hash, seen["hash"])
+                    matched = similarity >= SIMILARITY_THRESHOLD
                 
                 if similarity > best_similarity:
                     best_similarity = similarity
@@ -664,7 +953,7 @@ def detect_file_duplicates(file_records):
                 if similarity > 5:
                     print(f"    → vs '{seen['record'].get('filename')}': {similarity:.1f}%")
                 
-                if similarity >= SIMILARITY_THRESHOLD:  
+                if matched:
                     print(f"  ✓ DUPLICATE DETECTED! Similarity: {similarity:.1f}% with '{seen['record'].get('filename')}'")
                     
                     for cluster in clusters:
@@ -694,7 +983,12 @@ def detect_file_duplicates(file_records):
                 print(f"  ⚠ Error comparing with file {seen_idx}: {e}")
                 continue
         
+        if progress:
+            progress.advance("compared", seen_idx + 1 if comparisons else 0)
+        
         if not is_duplicate:
+            if sketch is not None:
+                sketch_indexes[file_type].add(len(seen_files), sketch)
             seen_files.append({
                 'hash': file_hash,
                 'record': record
@@ -708,6 +1002,9 @@ def detect_file_duplicates(file_records):
     
     elapsed = time.time() - start_time
     
+    if progress:
+        progress.advance("clusters", len(clusters))
+    
     print(f"\n{'='*60}")
     print(f"RESULTS:")
     print(f"  Similarity threshold: {SIMILARITY_THRESHOLD}%")
@@ -715,6 +1012,7 @@ def detect_file_duplicates(file_records):
     print(f"  Unique files: {len(seen_files)}")
     print(f"  Duplicate clusters found: {len(clusters)}")
     print(f"  Total duplicates: {sum(len(c) - 1 for c in clusters)}")
+    print(f"  Embedding tiebreaks: {tiebreaks}")
     print(f"  Time taken: {elapsed:.2f}s")
     print(f"{'='*60}\n")
     
@@ -0,0 +1,340 @@
+# utils/fingerprint_index.py
+import json, time, hashlib, threading
+import numpy as np
+from utils.file_utils import (
+    compute_exact_hash, compute_file_hash, compute_similarity, get_file_type, is_minhash_hash, minhash_match, parse_minhash_hash,
+    SIMILARITY_THRESHOLD, VECTOR_FINGERPRINT_MODELS
+)
+from utils.minhash import MinHashLSH
+from utils.embedding_utils import MODEL_NAME as DOCUMENT_EMBEDDING_MODEL
+from utils.local_store import ensure_schema, get_connection, transaction
+from utils.vector_store import VectorStore, drop_project_vectors
+
+# Stored in place of fingerprints that live in the bucket's vector store
+VECTOR_FINGERPRINT = "@vector"
+BINARY_CODE_TYPES = {"documents", "pdfs", "tables"}
+
+# Parsed bucket indexes kept in memory per process, keyed by (projectId, bucketId)
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _ensure_schema():
+    ensure_schema("file_fingerprints", [
+        """
+        CREATE TABLE IF NOT EXISTS file_fingerprints (
+            project_id TEXT NOT NULL,
+            bucket_id TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            filename TEXT,
+            file_type TEXT NOT NULL,
+            md5 TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            PRIMARY KEY (project_id, bucket_id, file_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS file_fingerprints_md5 ON file_fingerprints (project_id, bucket_id, md5)",
+        """
+        CREATE TABLE IF NOT EXISTS fingerprint_buckets (
+            project_id TEXT NOT NULL,
+            bucket_id TEXT NOT NULL,
+            indexed_at REAL NOT NULL,
+            file_count INTEGER NOT NULL,
+            PRIMARY KEY (project_id, bucket_id)
+        )
+        """
+    ])
+
+
+def _bucket_store(project_id, bucket_id, file_type):
+    # Sentence embeddings are roughly zero-centred, so their sign bits track angles;
+    # MFCC and ORB means are not, and are always scored exactly
+    return VectorStore(
+        project_id, f"bucket:{bucket_id}:{file_type}", VECTOR_FINGERPRINT_MODELS[file_type],
+        binary=file_type in BINARY_CODE_TYPES
+    )
+
+
+def _collection_store(project_id, database_id, collection_id):
+    return VectorStore(project_id, f"collection:{database_id}/{collection_id}", DOCUMENT_EMBEDDING_MODEL)
+
+
+def _split_vector(entry):
+    """Return (file type, vector or None): vector fingerprints go to the vector store, the rest stay in SQLite."""
+    file_type = get_file_type(entry.get("filename", ""))
+    fingerprint = entry["fingerprint"]
+    if file_type in VECTOR_FINGERPRINT_MODELS and isinstance(fingerprint, str) and fingerprint.startswith("["):
+        return file_type, np.asarray(json.loads(fingerprint), dtype=np.float32)
+    return file_type, None
+
+
+def _touch_bucket(conn, project_id, bucket_id):
+    """Mark a bucket's index as changed so processes reload their parsed copy."""
+    count = conn.execute(
+        "SELECT COUNT(*) AS n FROM file_fingerprints WHERE project_id = ? AND bucket_id = ?", (project_id, bucket_id)
+    ).fetchone()["n"]
+    conn.execute(
+        "INSERT OR REPLACE INTO fingerprint_buckets (project_id, bucket_id, indexed_at, file_count) VALUES (?, ?, ?, ?)",
+        (project_id, bucket_id, time.time(), count)
+    )
+
+
+def replace_bucket_index(project_id, bucket_id, entries):
+    """
+    Replace the stored fingerprints of a bucket with `entries`, each a dict with
+    id, filename, md5 and fingerprint (as produced by compute_file_hash).
+    """
+    _ensure_schema()
+    rows, vectors = [], {file_type: [] for file_type in VECTOR_FINGERPRINT_MODELS}
+    for entry in entries:
+        file_type, vector = _split_vector(entry)
+        if vector is not None:
+            vectors[file_type].append((entry["id"], vector, entry["md5"]))
+        rows.append((project_id, bucket_id, entry["id"], entry.get("filename"), file_type,
+                     entry["md5"], VECTOR_FINGERPRINT if vector is not None else entry["fingerprint"]))
+    for file_type, items in vectors.items():
+        _bucket_store(project_id, bucket_id, file_type).replace(items)
+
+    with transaction() as conn:
+        conn.execute(
+            "DELETE FROM file_fingerprints WHERE project_id = ? AND bucket_id = ?", (project_id, bucket_id)
+        )
+        conn.executemany(
+            """
+            INSERT INTO file_fingerprints (project_id, bucket_id, file_id, filename, file_type, md5, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO fingerprint_buckets (project_id, bucket_id, indexed_at, file_count) VALUES (?, ?, ?, ?)",
+            (project_id, bucket_id, time.time(), len(entries))
+        )
+
+
+def _drop_file_vector(project_id, bucket_id, file_id):
+    row = get_connection().execute(
+        "SELECT file_type, fingerprint FROM file_fingerprints WHERE project_id = ? AND bucket_id = ? AND file_id = ?",
+        (project_id, bucket_id, file_id)
+    ).fetchone()
+    if row and row["fingerprint"] == VECTOR_FINGERPRINT:
+        _bucket_store(project_id, bucket_id, row["file_type"]).delete(file_id)
+
+
+def upsert_file_fingerprint(project_id, bucket_id, entry):
+    """Add or replace one file in a bucket's index (same entry shape as replace_bucket_index)."""
+    _ensure_schema()
+    file_type, vector = _split_vector(entry)
+    _drop_file_vector(project_id, bucket_id, entry["id"])
+    if vector is not None:
+        _bucket_store(project_id, bucket_id, file_type).put(entry["id"], vector, entry["md5"])
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO file_fingerprints (project_id, bucket_id, file_id, filename, file_type, md5, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (project_id, bucket_id, entry["id"], entry.get("filename"), file_type, entry["md5"],
+             VECTOR_FINGERPRINT if vector is not None else entry["fingerprint"])
+        )
+        _touch_bucket(conn, project_id, bucket_id)
+
+
+def remove_file_fingerprint(project_id, bucket_id, file_id):
+    _ensure_schema()
+    _drop_file_vector(project_id, bucket_id, file_id)
+    with transaction() as conn:
+        conn.execute(
+            "DELETE FROM file_fingerprints WHERE project_id = ? AND bucket_id = ? AND file_id = ?",
+            (project_id, bucket_id, file_id)
+        )
+        _touch_bucket(conn, project_id, bucket_id)
+
+
+def stored_fingerprints(project_id, bucket_id):
+    """Return {file id: {"md5", "fingerprint"}} from the last index of a bucket, so unchanged files need no fingerprinting."""
+    index = load_bucket_index(project_id, bucket_id)
+    if index is None:
+        return {}
+    return {
+        entry["file_id"]: {"md5": entry["md5"], "fingerprint": entry_fingerprint(index, entry)}
+        for group in index["entries"].values() for entry in group
+    }
+
+
+def text_tag(text):
+    """Identifies the text an embedding was computed from."""
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def replace_collection_embeddings(project_id, database_id, collection_id, embeddings, tags=None):
+    """Replace the stored embeddings of a collection with `embeddings` ({document id: vector}), tagged with `tags`."""
+    tags = tags or {}
+    _collection_store(project_id, database_id, collection_id).replace(
+        (document_id, vector, tags.get(document_id)) for document_id, vector in embeddings.items()
+    )
+
+
+def upsert_document_embedding(project_id, database_id, collection_id, document_id, vector, tag=None):
+    _collection_store(project_id, database_id, collection_id).put(document_id, vector, tag)
+
+
+def remove_document_embedding(project_id, database_id, collection_id, document_id):
+    _collection_store(project_id, database_id, collection_id).delete(document_id)
+
+
+def load_collection_embeddings(project_id, database_id, collection_id):
+    """Return a VectorSnapshot of a collection's document embeddings (empty when none are stored)."""
+    return _collection_store(project_id, database_id, collection_id).snapshot()
+
+
+def stored_document_embeddings(project_id, database_id, collection_id, tags):
+    """Return {document id: embedding} for the documents whose stored tag still matches `tags`."""
+    snapshot = load_collection_embeddings(project_id, database_id, collection_id)
+    return {
+        document_id: snapshot.get(document_id)
+        for document_id, tag in tags.items() if tag and snapshot.tags.get(document_id) == tag
+    }
+
+
+def drop_project_index(project_id):
+    """Remove every stored fingerprint and embedding of a project."""
+    _ensure_schema()
+    with transaction() as conn:
+        conn.execute("DELETE FROM file_fingerprints WHERE project_id = ?", (project_id,))
+        conn.execute("DELETE FROM fingerprint_buckets WHERE project_id = ?", (project_id,))
+    drop_project_vectors(project_id)
+    with _loaded_lock:
+        for key in [key for key in _loaded if key[0] == project_id]:
+            del _loaded[key]
+
+
+def load_bucket_index(project_id, bucket_id):
+    """
+    Return {"indexedAt", "entries", "vectors", "sketches"} for a bucket, or None if it was never indexed.
+    Entries are grouped by file type, vector fingerprints are snapshots of the bucket's
+    vector stores and MinHash fingerprints are in an LSH index per file type; the parsed
+    index is reused until the bucket is re-indexed.
+    """
+    _ensure_schema()
+    conn = get_connection()
+    meta = conn.execute(
+        "SELECT indexed_at FROM fingerprint_buckets WHERE project_id = ? AND bucket_id = ?", (project_id, bucket_id)
+    ).fetchone()
+    if meta is None:
+        return None
+
+    key = (project_id, bucket_id)
+    with _loaded_lock:
+        loaded = _loaded.get(key)
+    if loaded and loaded["indexedAt"] == meta["indexed_at"]:
+        return loaded
+
+    entries = {}
+    for row in conn.execute(
+        "SELECT file_id, filename, file_type, md5, fingerprint FROM file_fingerprints WHERE project_id = ? AND bucket_id = ?",
+        (project_id, bucket_id)
+    ):
+        entries.setdefault(row["file_type"], []).append(dict(row))
+    vectors = {
+        file_type: _bucket_store(project_id, bucket_id, file_type).snapshot()
+        for file_type, group in entries.items()
+        if any(entry["fingerprint"] == VECTOR_FINGERPRINT for entry in group)
+    }
+    files, by_md5, sketches = {}, {}, {}
+    for file_type, group in entries.items():
+        for entry in group:
+            files[entry["file_id"]] = entry
+            by_md5.setdefault(entry["md5"], []).append(entry)
+            if is_minhash_hash(entry["fingerprint"]):
+                sketches.setdefault(file_type, MinHashLSH()).add(entry["file_id"], parse_minhash_hash(entry["fingerprint"])[0])
+    loaded = {
+        "indexedAt": meta["indexed_at"],
+        "entries": entries,
+        "files": files,
+        "byMd5": by_md5,
+        "vectors": vectors,
+        "sketches": sketches,
+        "count": len(files)
+    }
+    with _loaded_lock:
+        _loaded[key] = loaded
+    return loaded
+
+
+def entry_fingerprint(index, entry):
+    """The fingerprint of an index entry as compute_file_hash returns it."""
+    if entry["fingerprint"] != VECTOR_FINGERPRINT:
+        return entry["fingerprint"]
+    vector = index["vectors"][entry["file_type"]].get(entry["file_id"])
+    return None if vector is None else json.dumps(vector.astype(np.float64).tolist())
+
+
+def _match(entry, score, exact, duplicate=None):
+    return {
+        "fileId": entry["file_id"],
+        "filename": entry["filename"],
+        "score": round(score, 2),
+        "exact": exact,
+        "isDuplicate": score >= SIMILARITY_THRESHOLD if duplicate is None else duplicate
+    }
+
+
+def rank_matches(index, md5, fingerprint, filename, k=5, exclude_id=None):
+    """
+    Rank the indexed files of the same type as `filename` against one fingerprint.
+
+    Vector fingerprints are searched in the bucket's vector store (Hamming candidates,
+    exact cosine re-rank) and MinHash fingerprints only meet the files sharing an LSH band
+    with them, instead of being compared with every file.
+    Returns the top `k` as {"fileId", "filename", "score", "exact", "isDuplicate"}, best first.
+    """
+    file_type = get_file_type(filename)
+    snapshot = index.get("vectors", {}).get(file_type)
+    if snapshot is not None and isinstance(fingerprint, str) and fingerprint.startswith("["):
+        files = index["files"]
+        matches = {
+            entry["file_id"]: _match(entry, 100.0, True)
+            for entry in index["byMd5"].get(md5, []) if entry["file_id"] != exclude_id
+        }
+        for file_id, similarity in snapshot.search(json.loads(fingerprint), k=k, exclude={exclude_id}):
+            if file_id not in matches and file_id in files and similarity > 0:
+                matches[file_id] = _match(files[file_id], similarity * 100, False)
+        return sorted(matches.values(), key=lambda match: match["score"], reverse=True)[:k]
+
+    entries = index["entries"].get(file_type, [])
+    sketches = index.get("sketches", {}).get(file_type)
+    if sketches is not None and is_minhash_hash(fingerprint):
+        candidates = sketches.candidates(parse_minhash_hash(fingerprint)[0])
+        candidates.update(entry["file_id"] for entry in index["byMd5"].get(md5, []))
+        entries = [entry for entry in entries if entry["file_id"] in candidates]
+
+    matches = []
+    for entry in entries:
+        if entry["file_id"] == exclude_id:
+            continue
+        exact = entry["md5"] == md5
+        duplicate = None
+        if exact:
+            score = 100.0
+        elif is_minhash_hash(fingerprint) and is_minhash_hash(entry["fingerprint"]):
+            duplicate, score = minhash_match(fingerprint, entry["fingerprint"])
+        else:
+            score = compute_similarity(fingerprint, entry["fingerprint"])
+        if score > 0:
+            matches.append(_match(entry, score, exact, duplicate))
+    matches.sort(key=lambda match: match["score"], reverse=True)
+    return matches[:k]
+
+
+def query_bucket_index(index, file_bytes, filename, k=5, exclude_id=None):
+    """
+    Fingerprint one file and rank the indexed files of the same type by similarity.
+
+    Returns (matches, fingerprint_ms); see rank_matches for the match format.
+    """
+    started = time.perf_counter()
+    md5 = compute_exact_hash(file_bytes)
+    fingerprint = compute_file_hash(file_bytes, filename)
+    fingerprint_ms = (time.perf_counter() - started) * 1000
+    return rank_matches(index, md5, fingerprint, filename, k, exclude_id), fingerprint_ms
@@ -0,0 +1,242 @@
+# utils/garden_chat.py
+import os, re, time, random, threading, requests
+from collections import OrderedDict
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Override to point the gardener at a local mock LLM endpoint
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent"
+)
+GARDEN_CHAT_TIMEOUT = float(os.getenv("GARDEN_CHAT_TIMEOUT", "15"))
+GARDEN_CHAT_CACHE_SIZE = int(os.getenv("GARDEN_CHAT_CACHE_SIZE", "1000"))
+GARDEN_CHAT_CACHE_TTL = float(os.getenv("GARDEN_CHAT_CACHE_TTL", str(6 * 60 * 60)))
+# Replies slower than this count as failures towards opening the breaker
+GARDEN_CHAT_SLOW_SECONDS = float(os.getenv("GARDEN_CHAT_SLOW_SECONDS", "8"))
+GARDEN_CHAT_BREAKER_FAILURES = int(os.getenv("GARDEN_CHAT_BREAKER_FAILURES", "3"))
+GARDEN_CHAT_BREAKER_RESET = float(os.getenv("GARDEN_CHAT_BREAKER_RESET", "30"))
+
+FALLBACK_REPLIES = {
+    "flourishing": [
+        "🌟 I'm soaking up the sunshine of your tidy data, thank you for caring for me so well!",
+        "✨ My leaves have never felt lighter; keep those duplicates away and we'll keep blooming."
+    ],
+    "blooming": [
+        "🌸 I'm growing nicely, a few more cleanups and I'll be in full bloom.",
+        "🌺 Your care is showing in every petal; one more scan would make me glow."
+    ],
+    "recovering": [
+        "🌱 I'm slowly finding my roots again, a scan and a cleanup would help me grow.",
+        "🌿 Every duplicate you clear is a drop of water for me, let's keep going."
+    ],
+    "wilting": [
+        "💧 I'm a little thirsty, could you scan for duplicates and clean a few for me?",
+        "🥀 My leaves are drooping, clearing some duplicates would bring me back to life."
+    ]
+}
+
+
+def health_state(health):
+    """Name of the garden state for a health value."""
+    if health >= 85:
+        return "flourishing"
+    if health >= 60:
+        return "blooming"
+    if health >= 30:
+        return "recovering"
+    return "wilting"
+
+
+def normalize_message(message):
+    return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+
+
+def _bucket(value, bounds):
+    for bound in bounds:
+        if value <= bound:
+            return bound
+    return f">{bounds[-1]}"
+
+
+def chat_cache_key(message, garden_state):
+    """Replies are shared between messages with the same words and gardens in the same bands."""
+    duplicates = garden_state.get("total_duplicates", 0) or 0
+    cleaned = garden_state.get("total_cleaned", 0) or 0
+    cleanup = round(4 * cleaned / duplicates) / 4 if duplicates else None
+    return (
+        normalize_message(message),
+        health_state(float(garden_state.get("health", 50) or 0)),
+        _bucket(garden_state.get("total_scans", 0) or 0, (0, 5, 20)),
+        cleanup
+    )
+
+
+def build_prompt(message, garden_state):
+    return f"""
+You are an AI gardener cum user's plant spirit in a digital garden representing data health.
+The garden's state:
+- Health: {garden_state.get('health', 50)}
+- Total scans: {garden_state.get('total_scans', 0)}
+- Duplicates found: {garden_state.get('total_duplicates', 0)}
+- Duplicates cleaned: {garden_state.get('total_cleaned', 0)}
+
+User says: "{message}"
+Respond in a friendly way, as if you are user's plant spirit. Keep it poetic, gentle, under 2 sentences.
+If user asks about taking care of his/her plant, suggest scanning for duplicates and cleaning them to improve garden health.
+"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed or slow calls and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, failures=GARDEN_CHAT_BREAKER_FAILURES, reset_timeout=GARDEN_CHAT_BREAKER_RESET):
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+
+class GardenerError(Exception):
+    """The upstream model failed, timed out or returned an unusable reply."""
+
+
+_session = requests.Session()
+_breaker = CircuitBreaker()
+_cache = OrderedDict()  # key -> (reply, expires)
+_cache_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _cache_get(key, allow_stale=False):
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is None:
+            return None
+        if cached[1] <= time.monotonic() and not allow_stale:
+            return None
+        _cache.move_to_end(key)
+        return cached[0]
+
+
+def _cache_put(key, reply):
+    with _cache_lock:
+        _cache[key] = (reply, time.monotonic() + GARDEN_CHAT_CACHE_TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > GARDEN_CHAT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _call_gemini(prompt):
+    started = time.monotonic()
+    try:
+        resp = _session.post(
+            GEMINI_API_URL,
+            params={"key": GEMINI_API_KEY},
+            headers={"Content-Type": "application/json"},
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+            timeout=GARDEN_CHAT_TIMEOUT
+        )
+        if resp.status_code != 200:
+            print("Gemini returned non-200:", resp.status_code, resp.text)
+            raise GardenerError(f"Gemini API error: {resp.status_code}")
+        reply = resp.json()["candidates"][0]["content"]["parts"][0]["text"].strip()
+    except GardenerError:
+        _breaker.record_failure()
+        raise
+    except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+        print("Gemini request error:", e)
+        _breaker.record_failure()
+        raise GardenerError(str(e)) from e
+
+    if time.monotonic() - started > GARDEN_CHAT_SLOW_SECONDS:
+        _breaker.record_failure()
+    else:
+        _breaker.record_success()
+    return reply
+
+
+def _fallback(key):
+    stale = _cache_get(key, allow_stale=True)
+    if stale is not None:
+        return stale, "stale-cache"
+    return random.choice(FALLBACK_REPLIES[key[1]]), "fallback"
+
+
+def get_gardener_reply(message, garden_state):
+    """
+    Return (reply, source) for a chat message. Source is "cache", "model",
+    "stale-cache" or "fallback".
+
+    Identical requests in flight at the same time share one upstream call. While
+    the breaker is open, replies come from the cache (even expired entries) or
+    from templates for the garden's health state.
+    """
+    key = chat_cache_key(message, garden_state)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached, "cache"
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+
+    if not leader:
+        try:
+            return future.result(timeout=GARDEN_CHAT_TIMEOUT + 1), "model"
+        except Exception:
+            return _fallback(key)
+
+    try:
+        if not _breaker.allow():
+            raise GardenerError("Gardener circuit open")
+        reply = _call_gemini(build_prompt(message, garden_state))
+        _cache_put(key, reply)
+        future.set_result(reply)
+        return reply, "model"
+    except Exception as e:
+        future.set_exception(e)
+        return _fallback(key)
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
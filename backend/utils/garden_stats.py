@@ -1,9 +1,22 @@
 # utils/garden_stats.py
-import os
+import os, time, uuid, threading
 from utils.appwrite_client import get_database_client
+from utils.local_store import ensure_schema, get_connection, transaction
+from utils.scan_coordinator import try_acquire_lease
 from appwrite.query import Query
 
 GARDEN_STATS_COLLECTION = os.getenv("APPWRITE_GARDEN_STATS_COLLECTION", "garden_stats")
+# Pending increments are written to Appwrite every GARDEN_FLUSH_INTERVAL seconds,
+# or as soon as a user has GARDEN_FLUSH_THRESHOLD of them pending
+GARDEN_FLUSH_INTERVAL = float(os.getenv("GARDEN_FLUSH_INTERVAL", "10"))
+GARDEN_FLUSH_THRESHOLD = int(os.getenv("GARDEN_FLUSH_THRESHOLD", "50"))
+GARDEN_FLUSH_LEASE_TTL = 30
+
+COUNTERS = ("total_scans", "total_duplicates", "total_cleaned")
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+_flush_wake = threading.Event()
 
 def get_or_create_garden_stats(user_id):
     """Get or create garden stats for a user"""
@@ -58,37 +71,201 @@ def calculate_health(stats):
     
     return min(round(health), 100)
 
+def _ensure_schema():
+    ensure_schema("garden_stats_deltas", [
+        """
+        CREATE TABLE IF NOT EXISTS garden_stats_deltas (
+            user_id TEXT PRIMARY KEY,
+            total_scans INTEGER NOT NULL DEFAULT 0,
+            total_duplicates INTEGER NOT NULL DEFAULT 0,
+            total_cleaned INTEGER NOT NULL DEFAULT 0,
+            updates INTEGER NOT NULL DEFAULT 0,
+            first_at REAL NOT NULL
+        )
+        """,
+        # Increments taken out of the journal by a flush; the garden stats document records
+        # the flush_id it applied, so a retried flush never applies them twice
+        """
+        CREATE TABLE IF NOT EXISTS garden_stats_flushes (
+            user_id TEXT PRIMARY KEY,
+            flush_id TEXT NOT NULL,
+            total_scans INTEGER NOT NULL DEFAULT 0,
+            total_duplicates INTEGER NOT NULL DEFAULT 0,
+            total_cleaned INTEGER NOT NULL DEFAULT 0,
+            updates INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    ])
+
+def _add_delta(user_id, delta, updates=1):
+    """Merge increments into the user's journal row and return how many updates it now holds."""
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO garden_stats_deltas (user_id, total_scans, total_duplicates, total_cleaned, updates, first_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                total_scans = total_scans + excluded.total_scans,
+                total_duplicates = total_duplicates + excluded.total_duplicates,
+                total_cleaned = total_cleaned + excluded.total_cleaned,
+                updates = updates + excluded.updates
+            """,
+            (user_id, *(delta[name] for name in COUNTERS), updates, time.time())
+        )
+        return conn.execute(
+            "SELECT updates FROM garden_stats_deltas WHERE user_id = ?", (user_id,)
+        ).fetchone()["updates"]
+
+def pending_garden_delta(user_id, applied_flush=None):
+    """
+    Increments recorded for a user that have not been written to Appwrite yet, including
+    those of an unfinished flush unless it is `applied_flush` (the document's lastFlushId).
+    """
+    _ensure_schema()
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM garden_stats_deltas WHERE user_id = ?", (user_id,)).fetchone()
+    flush = conn.execute("SELECT * FROM garden_stats_flushes WHERE user_id = ?", (user_id,)).fetchone()
+    if flush and flush["flush_id"] == applied_flush:
+        flush = None
+    return {name: (row[name] if row else 0) + (flush[name] if flush else 0) for name in COUNTERS}
+
 def update_garden_stats(user_id, increment_scans=0, increment_duplicates=0, increment_cleaned=0):
-    """Update garden stats for a user"""
+    """
+    Record garden stat increments for a user.
+
+    Increments go to a journal in the local state DB and are merged per user. A
+    background flusher applies them to Appwrite in one update per user.
+    """
     try:
-        main_db = get_database_client()
-        stats = get_or_create_garden_stats(user_id)
-        
-        new_scans = stats.get("total_scans", 0) + increment_scans
-        new_duplicates = stats.get("total_duplicates", 0) + increment_duplicates
-        new_cleaned = stats.get("total_cleaned", 0) + increment_cleaned
-        
-        new_stats = {
-            "total_scans": new_scans,
-            "total_duplicates": new_duplicates,
-            "total_cleaned": new_cleaned
+        _ensure_schema()
+        start_garden_flusher()
+        delta = {
+            "total_scans": increment_scans,
+            "total_duplicates": increment_duplicates,
+            "total_cleaned": increment_cleaned
         }
-        new_health = calculate_health(new_stats)
-        new_stats["health"] = new_health
-        
-        updated = main_db.update_document(
+        updates = _add_delta(user_id, delta)
+        if updates >= GARDEN_FLUSH_THRESHOLD:
+            _flush_wake.set()
+        return True
+
+    except Exception as e:
+        print(f"Error updating garden stats: {e}")
+        return None
+
+def discard_pending_garden_stats(user_id):
+    """Drop a user's unflushed increments, e.g. when the account is being deleted."""
+    _ensure_schema()
+    with transaction() as conn:
+        conn.execute("DELETE FROM garden_stats_deltas WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM garden_stats_flushes WHERE user_id = ?", (user_id,))
+
+def get_garden_stats(user_id):
+    """Garden stats for a user including increments that are still waiting to be flushed."""
+    start_garden_flusher()
+    stats = dict(get_or_create_garden_stats(user_id))
+    pending = pending_garden_delta(user_id, stats.get("lastFlushId"))
+    if any(pending.values()):
+        for name in COUNTERS:
+            stats[name] = stats.get(name, 0) + pending[name]
+        stats["health"] = calculate_health(stats)
+    return stats
+
+def _take_flush(user_id):
+    """The user's unfinished flush, or a new one holding their journaled increments (None if there are none)."""
+    with transaction() as conn:
+        flush = conn.execute("SELECT * FROM garden_stats_flushes WHERE user_id = ?", (user_id,)).fetchone()
+        if flush is not None:
+            return flush
+        row = conn.execute("SELECT * FROM garden_stats_deltas WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            """
+            INSERT INTO garden_stats_flushes (user_id, flush_id, total_scans, total_duplicates, total_cleaned, updates)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, uuid.uuid4().hex, *(row[name] for name in COUNTERS), row["updates"])
+        )
+        conn.execute("DELETE FROM garden_stats_deltas WHERE user_id = ?", (user_id,))
+        return conn.execute("SELECT * FROM garden_stats_flushes WHERE user_id = ?", (user_id,)).fetchone()
+
+def _apply_flush(user_id, flush):
+    """Write one flush to the garden stats document, unless the document already records it."""
+    main_db = get_database_client()
+    stats = get_or_create_garden_stats(user_id)
+    if stats.get("lastFlushId") != flush["flush_id"]:
+        new_stats = {name: stats.get(name, 0) + flush[name] for name in COUNTERS}
+        new_stats["health"] = calculate_health(new_stats)
+        main_db.update_document(
             database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
             collection_id=GARDEN_STATS_COLLECTION,
             document_id=stats["$id"],
-            data=new_stats
+            data={**new_stats, "lastFlushId": flush["flush_id"]}
         )
-        
-        print(f"✅ Updated garden stats for user {user_id}: scans={new_scans}, duplicates={new_duplicates}, cleaned={new_cleaned}, health={new_health}")
-        return updated
-        
-    except Exception as e:
-        print(f"Error updating garden stats: {e}")
-        return None
+        print(f"✅ Updated garden stats for user {user_id}: scans={new_stats['total_scans']}, duplicates={new_stats['total_duplicates']}, cleaned={new_stats['total_cleaned']}, health={new_stats['health']} ({flush['updates']} updates merged)")
+    get_connection().execute(
+        "DELETE FROM garden_stats_flushes WHERE user_id = ? AND flush_id = ?", (user_id, flush["flush_id"])
+    )
+
+def flush_garden_stats(user_id):
+    """
+    Apply a user's pending increments to their garden stats document, exactly once.
+
+    The increments move from the journal into a flush with its own id, which is written to
+    the document together with them. A flush interrupted by a crash is retried first, and
+    skipped if the document already records its id.
+    """
+    lease = try_acquire_lease(f"garden-stats:{user_id}", ttl=GARDEN_FLUSH_LEASE_TTL)
+    if lease is None:
+        return False  # Another worker is flushing this user
+
+    with lease:
+        _ensure_schema()
+        # An interrupted flush is finished before the increments recorded since are taken
+        for _ in range(2):
+            flush = _take_flush(user_id)
+            if flush is None:
+                break
+            _apply_flush(user_id, flush)
+        return True
+
+def flush_all_garden_stats(max_age=0.0):
+    """Flush every user whose oldest pending increment is at least max_age seconds old."""
+    _ensure_schema()
+    now = time.time()
+    rows = get_connection().execute(
+        """
+        SELECT user_id FROM garden_stats_deltas WHERE first_at <= ? OR updates >= ?
+        UNION SELECT user_id FROM garden_stats_flushes
+        """,
+        (now - max_age, GARDEN_FLUSH_THRESHOLD)
+    ).fetchall()
+    for row in rows:
+        try:
+            flush_garden_stats(row["user_id"])
+        except Exception as e:
+            print(f"⚠️  Failed to flush garden stats for {row['user_id']}: {e}")
+
+def _flusher_loop():
+    while True:
+        _flush_wake.wait(GARDEN_FLUSH_INTERVAL)
+        _flush_wake.clear()
+        try:
+            flush_all_garden_stats(max_age=GARDEN_FLUSH_INTERVAL)
+        except Exception as e:
+            print(f"⚠️  Garden stats flusher error: {e}")
+
+def start_garden_flusher():
+    """Start the background flusher in this process (once)."""
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        threading.Thread(target=_flusher_loop, name="garden-stats-flusher", daemon=True).start()
+        _flusher_started = True
     
 def update_plant_name(user_id: str, plant_name: str) -> bool:
     """Update plant name for a user"""
@@ -0,0 +1,67 @@
+# utils/http_cache.py
+import gzip, json, hashlib
+from flask import Response, request
+
+try:
+    import brotli
+    BROTLI_SUPPORT = True
+except ImportError:
+    BROTLI_SUPPORT = False
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+def _accepted_encodings():
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(etag):
+    header = request.headers.get("If-None-Match", "")
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def cached_json_response(payload, status=200):
+    """
+    JSON response with a content ETag per encoding, compressed with br or gzip when the client accepts it.
+
+    Returns 304 Not Modified when the client's If-None-Match already names this content,
+    so unchanged results are not sent again.
+    """
+    body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+    encoding = None
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = _accepted_encodings()
+        if BROTLI_SUPPORT and "br" in accepted:
+            encoding = "br"
+        elif "gzip" in accepted:
+            encoding = "gzip"
+
+    # Each encoding of the content is a different representation and gets its own strong ETag
+    digest = hashlib.sha1(body).hexdigest()
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding"
+    }
+
+    if _etag_matches(etag):
+        return Response(status=304, headers=headers)
+
+    if encoding == "br":
+        body = brotli.compress(body, quality=5)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    return Response(body, status=status, mimetype="application/json", headers=headers)
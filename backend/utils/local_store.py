@@ -0,0 +1,61 @@
+# utils/local_store.py
+import os, sqlite3, threading
+from contextlib import contextmanager
+
+# Host-local state shared by every worker process (jobs, leases, caches)
+STATE_DIR = os.getenv("AADD_STATE_DIR", "/tmp/aadd")
+STATE_DB = os.path.join(STATE_DIR, "state.db")
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schemas = set()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this thread's connection to the shared state database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        conn = sqlite3.connect(STATE_DB, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+
+def ensure_schema(name: str, statements: list[str], columns: list[tuple] | None = None):
+    """Create the tables for `name` once per process, adding any (table, column, declaration) missing from older files."""
+    if name in _schemas:
+        return
+    with _schema_lock:
+        if name in _schemas:
+            return
+        conn = get_connection()
+        for statement in statements:
+            conn.execute(statement)
+        for table, column, declaration in columns or []:
+            add_column_if_missing(table, column, declaration)
+        _schemas.add(name)
+
+
+def add_column_if_missing(table: str, column: str, declaration: str):
+    """Add a column to a table created by an older version of the schema."""
+    conn = get_connection()
+    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+@contextmanager
+def transaction():
+    """Run a block inside an immediate (write-locked) transaction."""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
@@ -0,0 +1,152 @@
+# utils/minhash.py
+import os, re, zlib, base64
+from collections import defaultdict
+import numpy as np
+
+MINHASH_PERMUTATIONS = int(os.getenv("MINHASH_PERMUTATIONS", "128"))
+MINHASH_SHINGLE_WORDS = int(os.getenv("MINHASH_SHINGLE_WORDS", "3"))
+# Sketches split into bands of MINHASH_PERMUTATIONS / MINHASH_BANDS values; sketches sharing a band are candidates
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", "64"))
+# Estimated Jaccard similarity from which documents are duplicates without the transformer...
+MINHASH_MATCH = float(os.getenv("MINHASH_MATCH", "0.5"))
+# ...and below which they are not; in between, embeddings break the tie
+MINHASH_REJECT = float(os.getenv("MINHASH_REJECT", "0.2"))
+# Embedding cosine from which documents in the tie-break zone are duplicates
+MINHASH_EMBEDDING_THRESHOLD = float(os.getenv("MINHASH_EMBEDDING_THRESHOLD", "0.9"))
+
+# Elements are hashed in chunks so long documents and tables do not build one huge permutation matrix
+_CHUNK = 4096
+_WORD = re.compile(r"\w+")
+# Finished value of a one-permutation bin no element reached
+EMPTY_BIN = np.uint32(0xFFFFFFFF)
+
+
+def _mix64(values):
+    """splitmix64 finalizer: a bijective scramble of uint64 values."""
+    with np.errstate(over="ignore"):
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def _seeds(count):
+    with np.errstate(over="ignore"):
+        return _mix64(np.arange(1, count + 1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15))
+
+
+_SEEDS = _seeds(MINHASH_PERMUTATIONS)
+
+
+def _shingle_hashes(text, size=MINHASH_SHINGLE_WORDS):
+    """Distinct 64-bit hashes of every run of `size` consecutive lowercase words."""
+    words = np.array([zlib.crc32(word.encode()) for word in _WORD.findall(text.lower())], dtype=np.uint64)
+    if not len(words):
+        return words
+    size = min(size, len(words))
+    count = len(words) - size + 1
+    with np.errstate(over="ignore"):
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * np.uint64(1099511628211) + words[offset:offset + count]
+    return _mix64(np.unique(hashes))
+
+
+def empty_signature():
+    return np.full(len(_SEEDS), np.iinfo(np.uint64).max, dtype=np.uint64)
+
+
+def update_signature(signature, hashes):
+    """Fold 64-bit element hashes into a running MinHash signature (from empty_signature), in place."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    for start in range(0, len(hashes), _CHUNK):
+        chunk = hashes[start:start + _CHUNK]
+        np.minimum(signature, _mix64(chunk[:, None] ^ _SEEDS[None, :]).min(axis=0), out=signature)
+    return signature
+
+
+def finish_signature(signature):
+    """The stored form of a running signature: its low 32 bits."""
+    return (signature & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def one_permutation_update(signature, hashes):
+    """
+    Fold 64-bit element hashes into a one-permutation MinHash signature (from empty_signature),
+    in place: each element lands in one bin and every bin keeps its minimum, so elements are
+    hashed once rather than once per permutation. Bins no element reached stay empty.
+    """
+    bins = np.uint64(len(signature))
+    mixed = _mix64(np.asarray(hashes, dtype=np.uint64) ^ _SEEDS[0])
+    np.minimum.at(signature, (mixed % bins).astype(np.intp), mixed // bins)
+    return signature
+
+
+def one_permutation_jaccard(a, b):
+    """Jaccard estimate of finished one-permutation signatures (broadcasts over leading axes)."""
+    both_empty = (a == EMPTY_BIN) & (b == EMPTY_BIN)
+    matches = ((a == b) & ~both_empty).sum(axis=-1)
+    used = a.shape[-1] - both_empty.sum(axis=-1)
+    return np.where(used > 0, matches / np.maximum(used, 1), 0.0)
+
+
+def minhash_signature(text):
+    """MinHash sketch (uint32 array of MINHASH_PERMUTATIONS values) of the word shingles of `text`, or None without words."""
+    shingles = _shingle_hashes(text)
+    if not len(shingles):
+        return None
+    return finish_signature(update_signature(empty_signature(), shingles))
+
+
+def encode_signature(signature):
+    return base64.b64encode(signature.astype("<u4").tobytes()).decode()
+
+
+def decode_signature(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype="<u4")
+
+
+def jaccard_estimate(a, b):
+    """Share of equal sketch values, an estimate of the Jaccard similarity of the shingle sets."""
+    if a.shape != b.shape or not len(a):
+        return 0.0
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def needs_tiebreak(similarity):
+    """Whether an estimated Jaccard similarity is too close to call without embeddings."""
+    return MINHASH_REJECT <= similarity < MINHASH_MATCH
+
+
+def jaccard_score(similarity):
+    """
+    Report an estimated Jaccard similarity on the scale of embedding cosines: MINHASH_MATCH
+    maps to MINHASH_EMBEDDING_THRESHOLD and 1 to 1, so a duplicate scores the same whichever
+    of the two decided it.
+    """
+    scale = (1 - MINHASH_EMBEDDING_THRESHOLD) / (1 - MINHASH_MATCH) if MINHASH_MATCH < 1 else 0.0
+    return float(np.clip(MINHASH_EMBEDDING_THRESHOLD + (similarity - MINHASH_MATCH) * scale, 0, 1))
+
+
+class MinHashLSH:
+    """Banded LSH over MinHash sketches: keys whose sketches agree on a whole band are candidates."""
+
+    def __init__(self, bands=MINHASH_BANDS):
+        self.bands = bands
+        self.buckets = defaultdict(list)
+
+    def _keys(self, signature):
+        bands = max(1, min(self.bands, len(signature)))
+        rows = len(signature) // bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+    def add(self, key, signature):
+        for band_key in self._keys(signature):
+            self.buckets[band_key].append(key)
+
+    def candidates(self, signature):
+        found = set()
+        for band_key in self._keys(signature):
+            found.update(self.buckets.get(band_key, ()))
+        return found
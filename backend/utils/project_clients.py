@@ -0,0 +1,141 @@
+# utils/project_clients.py
+import os, time, threading
+from dotenv import load_dotenv
+from cryptography.fernet import Fernet
+from appwrite.query import Query
+from utils.appwrite_client import get_database_client, get_storage_client, evict_clients
+from utils.local_store import ensure_schema, get_connection
+
+load_dotenv()
+
+# Fernet Encryption: For User Project API Keys
+fernet_key = os.getenv("FERNET_KEY")
+if not fernet_key:
+    raise ValueError("FERNET_KEY environment variable is required")
+f = Fernet(fernet_key.encode())
+
+USER_PROJECTS_COLLECTION = os.getenv("APPWRITE_USER_PROJECTS_COLLECTION", "user_projects")
+PROJECT_KEY_CACHE_TTL = float(os.getenv("PROJECT_KEY_CACHE_TTL", "900"))
+PROJECT_CACHE_TTL = float(os.getenv("PROJECT_CACHE_TTL", "60"))
+PROJECT_NEGATIVE_CACHE_TTL = float(os.getenv("PROJECT_NEGATIVE_CACHE_TTL", "10"))
+
+# projectId -> (project document or None, fetched at, expires)
+_project_docs = {}
+_project_docs_lock = threading.Lock()
+
+# projectId -> (encrypted key, decrypted key, expires)
+_decrypted_keys = {}
+_decrypted_keys_lock = threading.Lock()
+
+
+class ProjectAccessError(Exception):
+    """Raised when a project is missing or not owned by the requesting user."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _ensure_schema():
+    ensure_schema("project_invalidations", [
+        """
+        CREATE TABLE IF NOT EXISTS project_invalidations (
+            project_id TEXT PRIMARY KEY,
+            invalidated_at REAL NOT NULL
+        )
+        """
+    ])
+
+
+def _invalidated_since(project_id, fetched_at):
+    """Whether any worker invalidated the project after this process fetched it."""
+    _ensure_schema()
+    row = get_connection().execute(
+        "SELECT invalidated_at FROM project_invalidations WHERE project_id = ?", (project_id,)
+    ).fetchone()
+    return row is not None and row["invalidated_at"] >= fetched_at
+
+
+def get_project_doc(project_id, main_db=None):
+    """
+    Return the connected project document for project_id, or None if there is none.
+
+    Lookups are cached per process for PROJECT_CACHE_TTL seconds (misses for
+    PROJECT_NEGATIVE_CACHE_TTL). invalidate_project() in any worker expires them early.
+    """
+    now = time.monotonic()
+    with _project_docs_lock:
+        cached = _project_docs.get(project_id)
+    if cached and cached[2] > now and not _invalidated_since(project_id, cached[1]):
+        return cached[0]
+
+    fetched_at = time.time()
+    main_db = main_db or get_database_client()
+    projects = main_db.list_documents(
+        database_id=os.getenv("APPWRITE_DATABASE_ID", "default"),
+        collection_id=USER_PROJECTS_COLLECTION,
+        queries=[Query.equal("projectId", project_id)]
+    ).get("documents", [])
+    project_doc = projects[0] if projects else None
+    ttl = PROJECT_CACHE_TTL if project_doc else PROJECT_NEGATIVE_CACHE_TTL
+    with _project_docs_lock:
+        _project_docs[project_id] = (project_doc, fetched_at, now + ttl)
+    return project_doc
+
+
+def get_owned_project(user_id, project_id, main_db=None):
+    """Return the connected project document, checking it belongs to user_id."""
+    project_doc = get_project_doc(project_id, main_db)
+    if project_doc is None:
+        raise ProjectAccessError("Project not found", 404)
+    if project_doc.get("userId") != user_id:
+        raise ProjectAccessError("Unauthorized", 403)
+    return project_doc
+
+
+def decrypt_project_key(project_api_id, encrypted_key):
+    """Decrypt a project's API key, reusing the plaintext while the stored ciphertext is unchanged."""
+    now = time.monotonic()
+    with _decrypted_keys_lock:
+        cached = _decrypted_keys.get(project_api_id)
+        if cached and cached[0] == encrypted_key and cached[2] > now:
+            return cached[1]
+    api_key = f.decrypt(encrypted_key.encode()).decode()
+    with _decrypted_keys_lock:
+        _decrypted_keys[project_api_id] = (encrypted_key, api_key, now + PROJECT_KEY_CACHE_TTL)
+    return api_key
+
+
+def get_webhook_signature_key(project_doc):
+    """The decrypted signature key of the project's Appwrite webhook, or None if none was stored."""
+    encrypted_key = project_doc.get("webhookKey")
+    if not encrypted_key:
+        return None
+    return f.decrypt(encrypted_key.encode()).decode()
+
+
+def invalidate_project(project_api_id):
+    """Forget the cached document, decrypted key and pooled clients of a project that was deleted or reconnected."""
+    with _project_docs_lock:
+        _project_docs.pop(project_api_id, None)
+    with _decrypted_keys_lock:
+        _decrypted_keys.pop(project_api_id, None)
+    evict_clients(project_api_id)
+    _ensure_schema()
+    get_connection().execute(
+        "INSERT OR REPLACE INTO project_invalidations (project_id, invalidated_at) VALUES (?, ?)",
+        (project_api_id, time.time())
+    )
+
+
+def get_project_clients(project_doc):
+    """Return initialized db, storage, auth clients using project credentials."""
+    endpoint = project_doc.get("endpoint")
+    project_api_id = project_doc.get("projectId")
+    encrypted_key = project_doc.get("apiKey")
+    if not encrypted_key:
+        raise ValueError("Missing API key in project document")
+    api_key = decrypt_project_key(project_api_id, encrypted_key)
+    db = get_database_client(endpoint=endpoint, project_id=project_api_id, api_key=api_key)
+    storage = get_storage_client(endpoint=endpoint, project_id=project_api_id, api_key=api_key)
+    return db, storage
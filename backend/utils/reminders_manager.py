@@ -1,20 +1,27 @@
 # utils/reminders_manager.py
-import os, time, requests, threading
+import os, time, heapq, random, threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from utils.appwrite_client import get_database_client, get_appwrite_client
+from utils.appwrite_client import get_database_client, list_all_documents
+from utils.email_outbox import deliver_email, enqueue_email, register_email_renderer
+from utils.scan_coordinator import try_acquire_lease
+from utils.scan_scheduler import get_scan_scheduler
+from utils.scan_service import run_scan
 from appwrite.query import Query
-from appwrite.services.users import Users
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 
 APPWRITE_DATABASE_ID = os.getenv("APPWRITE_DATABASE_ID", "default")
 USER_PROJECTS_COLLECTION = os.getenv("APPWRITE_USER_PROJECTS_COLLECTION", "user_projects")
 REMINDER_COLLECTION = os.getenv("APPWRITE_REMINDER_COLLECTION", "reminders")
-BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:5000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")  
 
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "2"))
+REMINDER_JITTER_MAX = float(os.getenv("REMINDER_JITTER_MAX", "60"))
+REMINDER_REFRESH_INTERVAL = 60
+REMINDER_FULL_REFRESH_INTERVAL = 15 * 60
+REMINDER_CURSOR_OVERLAP = 120
+REMINDER_LEADER_KEY = "reminder-scheduler"
+REMINDER_LEADER_TTL = 30
+REMINDER_LEADER_RETRY = 15
 
 SCHEDULE_MAP = {
     "30min": 30 * 60,       
@@ -24,101 +31,134 @@ SCHEDULE_MAP = {
     "monthly": 30 * 24 * 60 * 60   
 }
 
-def get_user_email(user_id: str) -> str | None:
-    """Fetch the user’s email from Appwrite using userId"""
-    try:
-        client = get_appwrite_client()
-        users_service = Users(client)
-        user = users_service.get(user_id)
-        return user.get("email")
-    except Exception as e:
-        print(f"Error fetching email for user {user_id}: {e}")
-        return None
-
 def send_email(to_email: str, subject: str, message: str):
     try:
-        if not SENDGRID_API_KEY or not SENDER_EMAIL:
-            print("❌ SendGrid credentials not configured")
-            return
-
-        mail = Mail(
-            from_email=SENDER_EMAIL,
-            to_emails=to_email,
-            subject=subject,
-            html_content=message
-        )
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        sg.send(mail)
+        deliver_email(to_email, subject, message)
         print(f"📧 Email sent to {to_email}")
 
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
 
-def run_scan_reminder(reminder):
-    """Perform duplicate scan for a project when reminder triggers."""
-    try:
-        project_id = reminder["projectId"]
-        user_id = reminder["userId"]
-        service = reminder.get("service", "database")
-        frequency = reminder.get("frequency", "weekly")
-        freq = frequency[0].upper() + frequency[1:]
+def format_timings(timings: dict) -> str:
+    """Render per-stage scan timings as HTML list items for the summary email."""
+    return "".join(
+        f"<li>{stage.capitalize()}: {seconds:.1f}s</li>"
+        for stage, seconds in timings.items()
+    )
 
-        print(f"🔄 Running scheduled scan for {project_id} ({service})")
+def duplicates_page_url(result: dict) -> str:
+    duplicates_url = f"{FRONTEND_URL}/duplicates/{result['projectId']}/{result['service']}"
+    if result["service"] == "database" and result.get("databaseId"):
+        duplicates_url += f"?databaseId={result['databaseId']}"
+    return duplicates_url
 
-        payload = {
-            "userId": user_id,
-            "projectId": project_id,
-            "service": service
-        }
-        
-        if service == "database":
-            database_id = reminder.get("databaseId")
-            if not database_id:
-                print(f"❌ Missing databaseId for database scan reminder {reminder['$id']}")
-                return
-            payload["databaseId"] = database_id
-            
-            collection_id = reminder.get("collectionId")
-            if collection_id:
-                payload["collectionId"] = collection_id
-
-        response = requests.post(
-            f"{BACKEND_URL}/api/duplicates/scan",
-            json=payload,
-            timeout=300
-        )
-        res_data = response.json()
-
-        email = get_user_email(user_id)
-        if email:
-            duplicates_url = f"{FRONTEND_URL}/duplicates/{project_id}/{service}"
-            if service == "database" and database_id:
-                duplicates_url += f"?databaseId={database_id}"
-
-            send_email(
-                to_email=email,
-                subject=f"Appwrite AI Duplicates Detector (Reminder) 🔔 | Duplicate Scan Completed for Project - {project_id}",
-                message = f"""
-                        <html>
-                            <body>
-                                <h2>Your {freq} Duplicate Scan Completed ✅</h2>
-                                <p><strong>Project ID:</strong> {project_id}<br>
-                                <strong>Service:</strong> {service.capitalize()}</p>
+def render_scan_results(result: dict) -> str:
+    """HTML block with the results and timings of one reminder scan."""
+    return f"""
                                 <h3>📄 Scan Results:</h3>
                                 <ul>
-                                <li>Total duplicates found: {res_data.get('duplicates_found', 0)}</li>
+                                <li>Total duplicates found: {result['duplicatesFound']}</li>
+                                <li>New since last scan: {result['inserted']}</li>
+                                <li>Resolved since last scan: {result['retired']}</li>
                                 </ul>
+                                <h3>⏱️ Scan Timings:</h3>
+                                <ul>
+                                {format_timings(result['timings']) if not result['cached'] else '<li>No changes since the last scan, previous results reused</li>'}
+                                </ul>
+                                <p>For re-running the scan manually and managing duplicates associated with this project (ID: {result['projectId']}), visit:
+                                <a href="{duplicates_page_url(result)}">Duplicates Page</a></p>
+            """
+
+def render_reminder_email(result: dict):
+    """Subject and HTML body for a single reminder scan result."""
+    subject = f"Appwrite AI Duplicates Detector (Reminder) 🔔 | Duplicate Scan Completed for Project - {result['projectId']}"
+    message = f"""
+                        <html>
+                            <body>
+                                <h2>Your {result['frequency']} Duplicate Scan Completed ✅</h2>
+                                <p><strong>Project ID:</strong> {result['projectId']}<br>
+                                <strong>Service:</strong> {result['service'].capitalize()}</p>
+                                {render_scan_results(result)}
+                                <p>You can view full details and manage your projects here: 
+                                <a href="{FRONTEND_URL}/dashboard">Dashboard</a></p>
+                                <br>
+                                <p>Thank you,<br><a href="{FRONTEND_URL}">Appwrite AI Duplicates Detector (AADD)</a></p>
+                            </body>
+                        </html>
+                        """
+    return subject, message
+
+def render_reminder_digest(results: list[dict]):
+    """Subject and HTML body merging several reminder scan results for one user."""
+    subject = f"Appwrite AI Duplicates Detector (Reminder) 🔔 | {len(results)} Duplicate Scans Completed"
+    sections = "".join(
+        f"""
+                                <hr>
+                                <h2>{result['frequency']} scan of Project - {result['projectId']} ({result['service'].capitalize()})</h2>
+                                {render_scan_results(result)}
+        """
+        for result in results
+    )
+    message = f"""
+                        <html>
+                            <body>
+                                <h2>Your Scheduled Duplicate Scans Completed ✅</h2>
+                                <p>Total new duplicates: {sum(result['inserted'] for result in results)}<br>
+                                Total resolved: {sum(result['retired'] for result in results)}</p>
+                                {sections}
                                 <p>You can view full details and manage your projects here: 
                                 <a href="{FRONTEND_URL}/dashboard">Dashboard</a></p>
-                                <p>For re-running the scan manually and managing duplicates associated with this project (ID: {project_id}), visit:
-                                <a href="{duplicates_url}">Duplicates Page</a></p>
                                 <br>
                                 <p>Thank you,<br><a href="{FRONTEND_URL}">Appwrite AI Duplicates Detector (AADD)</a></p>
                             </body>
                         </html>
                         """
-            )
-            print(f"📧 Reminder email sent to {email}")
+    return subject, message
+
+register_email_renderer("reminder", render_reminder_email, render_reminder_digest)
+
+def run_scan_reminder(reminder):
+    """Perform duplicate scan for a project when reminder triggers."""
+    try:
+        project_id = reminder["projectId"]
+        user_id = reminder["userId"]
+        service = reminder.get("service", "database")
+        frequency = reminder.get("frequency", "weekly")
+        freq = frequency[0].upper() + frequency[1:]
+        database_id = reminder.get("databaseId")
+        collection_id = reminder.get("collectionId")
+
+        print(f"🔄 Running scheduled scan for {project_id} ({service})")
+
+        if service == "database" and not database_id:
+            print(f"❌ Missing databaseId for database scan reminder {reminder['$id']}")
+            return
+
+        res_data = get_scan_scheduler().submit(
+            run_scan,
+            user_id,
+            project_id,
+            service,
+            database_id if service == "database" else None,
+            collection_id if service == "database" else None,
+            user_id=user_id,
+            priority="scheduled"
+        ).result()
+        timings = res_data.get("timings", {})
+
+        # Delivered by the outbox sender, possibly merged into a digest with other reminders
+        enqueue_email("reminder", {
+            "projectId": project_id,
+            "service": service,
+            "databaseId": database_id if service == "database" else None,
+            "frequency": freq,
+            "duplicatesFound": res_data.get("duplicates_found", 0),
+            "inserted": res_data.get("inserted", 0),
+            "retired": res_data.get("retired", 0),
+            "cached": bool(res_data.get("cached")),
+            "timings": timings,
+            "fallbackEmail": reminder.get("userEmail")
+        }, user_id=user_id)
 
         db = get_database_client()
         db.update_document(
@@ -127,63 +167,167 @@ def run_scan_reminder(reminder):
             document_id=reminder["$id"],
             data={"lastRun": datetime.now(timezone.utc).isoformat()}
         )
-        print(f"✅ Reminder executed for {project_id}")
+        print(f"✅ Reminder executed for {project_id} in {timings.get('total', 0):.1f}s")
 
     except Exception as e:
         print(f"❌ Error running reminder: {e}")
 
+def compute_next_run(reminder, now: datetime) -> datetime | None:
+    """Next due time from the reminder's lastRun and frequency, or None for unknown frequencies."""
+    interval_sec = SCHEDULE_MAP.get(reminder.get("frequency"), 0)
+    if not interval_sec:
+        return None
+
+    last_run_str = reminder.get("lastRun")
+    last_run = (
+        datetime.fromisoformat(last_run_str)
+        if last_run_str else now
+    )
+    if last_run.tzinfo is None:
+        last_run = last_run.replace(tzinfo=timezone.utc)
+
+    return last_run + timedelta(seconds=interval_sec)
+
+
+class ReminderScheduler:
+    """
+    Min-heap of reminder due times, refreshed incrementally from Appwrite.
+
+    Due reminders run on a fixed-size executor. Each next run gets a little random
+    jitter so reminders created together do not all fire in the same second.
+    Heap entries are invalidated lazily: an entry only fires if it still matches
+    the reminder's current `$updatedAt`.
+    """
+
+    def __init__(self, db=None, workers=REMINDER_WORKERS):
+        self.db = db or get_database_client()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="reminder")
+        self.reminders = {}
+        self.heap = []
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+        self.last_full_refresh = 0.0
+        self.last_refresh = 0.0
+        self.updated_cursor = None
+
+    def _schedule(self, reminder):
+        next_run = compute_next_run(reminder, datetime.now(timezone.utc))
+        if next_run is None:
+            self.reminders.pop(reminder["$id"], None)
+            return
+        interval_sec = SCHEDULE_MAP[reminder["frequency"]]
+        jitter = random.uniform(0, min(REMINDER_JITTER_MAX, interval_sec * 0.05))
+        heapq.heappush(self.heap, (next_run.timestamp() + jitter, reminder["$id"], reminder.get("$updatedAt")))
+
+    def _upsert(self, reminder):
+        if not reminder.get("enabled"):
+            self.reminders.pop(reminder["$id"], None)
+            return
+        current = self.reminders.get(reminder["$id"])
+        self.reminders[reminder["$id"]] = reminder
+        if current is None or current.get("$updatedAt") != reminder.get("$updatedAt"):
+            self._schedule(reminder)
+
+    def _cursor_now(self):
+        # Overlap with the previous window to absorb clock skew; re-reading a reminder is harmless
+        return (datetime.now(timezone.utc) - timedelta(seconds=REMINDER_CURSOR_OVERLAP)).isoformat()
+
+    def full_refresh(self):
+        """Reload all enabled reminders, dropping ones that were deleted or disabled."""
+        cursor = self._cursor_now()
+        reminders = list_all_documents(
+            self.db, APPWRITE_DATABASE_ID, REMINDER_COLLECTION, [Query.equal("enabled", True)]
+        )
+        self.reminders = {}
+        self.heap = []
+        for reminder in reminders:
+            self._upsert(reminder)
+        self.updated_cursor = cursor
+        self.last_full_refresh = self.last_refresh = time.time()
+        print(f"🔁 Loaded {len(self.reminders)} reminders")
+
+    def incremental_refresh(self):
+        """Pick up reminders created, edited or toggled since the last refresh."""
+        cursor = self._cursor_now()
+        changed = list_all_documents(
+            self.db, APPWRITE_DATABASE_ID, REMINDER_COLLECTION,
+            [Query.greater_than("$updatedAt", self.updated_cursor)]
+        )
+        for reminder in changed:
+            self._upsert(reminder)
+        self.updated_cursor = cursor
+        self.last_refresh = time.time()
+
+    def _finish(self, reminder_id):
+        with self.in_flight_lock:
+            self.in_flight.discard(reminder_id)
+
+    def run_due(self, now: float):
+        while self.heap and self.heap[0][0] <= now:
+            _, reminder_id, marker = heapq.heappop(self.heap)
+            reminder = self.reminders.get(reminder_id)
+            if reminder is None or reminder.get("$updatedAt") != marker:
+                continue
+
+            try:
+                # Record the run before starting it so a new leader does not repeat it
+                reminder = self.db.update_document(
+                    database_id=APPWRITE_DATABASE_ID,
+                    collection_id=REMINDER_COLLECTION,
+                    document_id=reminder_id,
+                    data={"lastRun": datetime.now(timezone.utc).isoformat()}
+                )
+            except Exception as e:
+                print(f"⚠️  Dropping reminder {reminder_id}: {e}")
+                self.reminders.pop(reminder_id, None)
+                continue
+            self._upsert(reminder)
+            if not reminder.get("enabled"):
+                continue
+
+            with self.in_flight_lock:
+                if reminder_id in self.in_flight:
+                    print(f"⏭️  Previous run of reminder {reminder_id} still in progress, skipping")
+                    continue
+                self.in_flight.add(reminder_id)
+            future = self.executor.submit(run_scan_reminder, reminder)
+            future.add_done_callback(lambda _, rid=reminder_id: self._finish(rid))
+
+    def seconds_until_next(self, now: float) -> float:
+        next_refresh = self.last_refresh + REMINDER_REFRESH_INTERVAL
+        next_due = self.heap[0][0] if self.heap else next_refresh
+        return max(min(next_due, next_refresh) - now, 1)
+
+    def run(self, lease):
+        """Schedule reminders for as long as this process holds the leader lease."""
+        self.full_refresh()
+        while not lease.lost:
+            now = time.time()
+            if now - self.last_full_refresh >= REMINDER_FULL_REFRESH_INTERVAL:
+                self.full_refresh()
+            elif now - self.last_refresh >= REMINDER_REFRESH_INTERVAL:
+                self.incremental_refresh()
+            self.run_due(time.time())
+            time.sleep(self.seconds_until_next(time.time()))
+
+
 def reminder_scheduler():
-    """Background scheduler thread that periodically checks reminders and runs them on time."""
+    """Background scheduler thread. Only the process holding the leader lease schedules reminders."""
     print("🚀 Reminder scheduler started...")
-    db = get_database_client()
+    scheduler = None
 
     while True:
-        try:
-            reminders = db.list_documents(
-                database_id=APPWRITE_DATABASE_ID,
-                collection_id=REMINDER_COLLECTION,
-                queries=[Query.equal("enabled", True)]
-            ).get("documents", [])
-
-            now = datetime.now(timezone.utc)  
-            next_run_times = []
-
-            for reminder in reminders:
-                freq = reminder.get("frequency")
-                interval_sec = SCHEDULE_MAP.get(freq, 0)
-                if not interval_sec:
-                    continue
+        lease = try_acquire_lease(REMINDER_LEADER_KEY, ttl=REMINDER_LEADER_TTL)
+        if lease is None:
+            time.sleep(REMINDER_LEADER_RETRY)
+            continue
 
-                last_run_str = reminder.get("lastRun")
-                last_run = (
-                    datetime.fromisoformat(last_run_str)
-                    if last_run_str else now
-                )
-                if last_run.tzinfo is None:
-                    last_run = last_run.replace(tzinfo=timezone.utc)
-
-                next_run = last_run + timedelta(seconds=interval_sec)
-
-                if now >= next_run:
-                    threading.Thread(target=run_scan_reminder, args=(reminder,), daemon=True).start()
-                    db.update_document(
-                        database_id=APPWRITE_DATABASE_ID,
-                        collection_id=REMINDER_COLLECTION,
-                        document_id=reminder["$id"],
-                        data={"lastRun": datetime.now(timezone.utc).isoformat()}
-                    )
-                    next_run = now + timedelta(seconds=interval_sec)
-
-                next_run_times.append(next_run)
-
-            if next_run_times:
-                nearest = min(next_run_times)
-                sleep_seconds = max((nearest - datetime.now(timezone.utc)).total_seconds(), 1)
-            else:
-                sleep_seconds = 60 
-
-            time.sleep(sleep_seconds)
-
-        except Exception as e:
-            print(f"⚠️ Reminder loop error: {e}")
-            time.sleep(60)
\ No newline at end of file
+        print(f"👑 Process {os.getpid()} is now the reminder scheduler leader")
+        with lease:
+            try:
+                scheduler = scheduler or ReminderScheduler()
+                scheduler.run(lease)
+                print("⚠️  Lost reminder scheduler leadership")
+            except Exception as e:
+                print(f"⚠️ Reminder loop error: {e}")
+                time.sleep(60)
@@ -0,0 +1,152 @@
+# utils/scan_coordinator.py
+import os, time, uuid, socket, threading
+from abc import ABC, abstractmethod
+from utils.local_store import ensure_schema, get_connection, transaction
+
+SCAN_LEASE_TTL = float(os.getenv("SCAN_LEASE_TTL", "60"))
+SCAN_LEASE_BACKEND = os.getenv("SCAN_LEASE_BACKEND", "sqlite")
+
+
+class LeaseLostError(Exception):
+    """Raised when a lease expired or was taken over while its holder was still working."""
+
+
+class LeaseBackend(ABC):
+    """Storage for scan leases. Implementations must make acquire/renew/release atomic per key."""
+
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    def renew(self, key: str, owner: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        ...
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """Leases in the host-local state DB, visible to every worker process on the host."""
+
+    def __init__(self):
+        ensure_schema("scan_leases", [
+            """
+            CREATE TABLE IF NOT EXISTS scan_leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL NOT NULL DEFAULT 0,
+                acquired_at REAL
+            )
+            """
+        ])
+
+    def acquire(self, key, owner, ttl):
+        now = time.time()
+        with transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM scan_leases WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO scan_leases (key, owner, expires_at, acquired_at) VALUES (?, ?, ?, ?)",
+                    (key, owner, now + ttl, now)
+                )
+                return True
+            if row["owner"] and row["owner"] != owner and row["expires_at"] > now:
+                return False
+            if row["owner"] and row["owner"] != owner:
+                print(f"⚠️  Taking over expired scan lease {key} from {row['owner']}")
+            conn.execute(
+                "UPDATE scan_leases SET owner = ?, expires_at = ?, acquired_at = ? WHERE key = ?",
+                (owner, now + ttl, now, key)
+            )
+            return True
+
+    def renew(self, key, owner, ttl):
+        cursor = get_connection().execute(
+            "UPDATE scan_leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (time.time() + ttl, key, owner)
+        )
+        return cursor.rowcount == 1
+
+    def release(self, key, owner):
+        get_connection().execute(
+            "UPDATE scan_leases SET owner = NULL, expires_at = 0 WHERE key = ? AND owner = ?",
+            (key, owner)
+        )
+
+
+# Backends selectable through SCAN_LEASE_BACKEND. Register a factory here for a
+# store shared across nodes (e.g. Redis) to coordinate more than one host.
+LEASE_BACKENDS = {
+    "sqlite": SQLiteLeaseBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_lease_backend() -> LeaseBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            factory = LEASE_BACKENDS.get(SCAN_LEASE_BACKEND)
+            if factory is None:
+                raise ValueError(f"Unknown SCAN_LEASE_BACKEND: {SCAN_LEASE_BACKEND}")
+            _backend = factory()
+        return _backend
+
+
+class ScanLease:
+    """A held lease on one key, kept alive by a heartbeat thread until released."""
+
+    def __init__(self, backend, key, owner, ttl):
+        self.backend = backend
+        self.key = key
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, name=f"lease-{key}", daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not self.backend.renew(self.key, self.owner, self.ttl):
+                    self.lost = True
+                    print(f"⚠️  Lost scan lease {self.key}")
+                    return
+            except Exception as e:
+                print(f"⚠️  Failed to renew scan lease {self.key}: {e}")
+
+    def ensure_held(self):
+        if self.lost:
+            raise LeaseLostError(f"Scan lease for {self.key} expired before the scan finished")
+
+    def release(self):
+        self._stop.set()
+        if not self.lost:
+            try:
+                self.backend.release(self.key, self.owner)
+            except Exception as e:
+                print(f"⚠️  Failed to release scan lease {self.key}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _new_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def try_acquire_lease(key, ttl=SCAN_LEASE_TTL):
+    """Return a ScanLease if `key` is free (or its holder's lease expired), else None."""
+    backend = get_lease_backend()
+    owner = _new_owner()
+    if backend.acquire(key, owner, ttl):
+        return ScanLease(backend, key, owner, ttl)
+    return None
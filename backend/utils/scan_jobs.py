@@ -0,0 +1,190 @@
+# utils/scan_jobs.py
+import os, json, time, uuid, socket
+from utils.local_store import ensure_schema, get_connection
+from utils.scan_progress import ScanProgress
+from utils.scan_scheduler import get_scan_scheduler
+from utils.scan_service import run_scan, ScanError
+from utils.project_clients import ProjectAccessError
+
+SCAN_JOB_RETENTION = int(os.getenv("SCAN_JOB_RETENTION", str(24 * 60 * 60)))
+
+
+def _ensure_schema():
+    ensure_schema("scan_jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            job_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            params TEXT NOT NULL,
+            state TEXT NOT NULL,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            host TEXT,
+            pid INTEGER,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS scan_jobs_created ON scan_jobs (created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS scan_job_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS scan_job_events_job ON scan_job_events (job_id, seq)"
+    ])
+
+
+def _update_job(job_id, **fields):
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    get_connection().execute(f"UPDATE scan_jobs SET {columns} WHERE job_id = ?", [*fields.values(), job_id])
+
+
+def _record_event(job_id, event, data):
+    get_connection().execute(
+        "INSERT INTO scan_job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+        (job_id, event, json.dumps(data), time.time())
+    )
+
+
+def _owner_alive(row):
+    """Whether the process that owns a queued/running job is still around (same-host check only)."""
+    if row["host"] != socket.gethostname() or not row["pid"]:
+        return True
+    try:
+        os.kill(row["pid"], 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _row_to_job(row):
+    return {
+        "jobId": row["job_id"],
+        "userId": row["user_id"],
+        "params": json.loads(row["params"]),
+        "state": row["state"],
+        "progress": json.loads(row["progress"]) if row["progress"] else None,
+        "error": row["error"],
+        "createdAt": row["created_at"],
+        "startedAt": row["started_at"],
+        "finishedAt": row["finished_at"],
+    }
+
+
+def _purge_expired():
+    cutoff = time.time() - SCAN_JOB_RETENTION
+    conn = get_connection()
+    conn.execute(
+        """
+        DELETE FROM scan_job_events WHERE job_id IN (
+            SELECT job_id FROM scan_jobs WHERE state IN ('done', 'failed') AND finished_at < ?
+        )
+        """,
+        (cutoff,)
+    )
+    conn.execute(
+        "DELETE FROM scan_jobs WHERE state IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+    )
+
+
+def _run_job(job_id, params):
+    _update_job(job_id, state="running", started_at=time.time())
+    _record_event(job_id, "state", {"state": "running"})
+    progress = ScanProgress(
+        on_update=lambda snapshot: _update_job(job_id, progress=json.dumps(snapshot)),
+        on_event=lambda event, data: _record_event(job_id, event, data)
+    )
+    try:
+        result = run_scan(
+            params["userId"],
+            params["projectId"],
+            params["service"],
+            params.get("databaseId"),
+            params.get("collectionId"),
+            progress=progress,
+            force=params.get("force", False)
+        )
+        progress.flush()
+        _update_job(
+            job_id,
+            state="done",
+            progress=json.dumps(progress.snapshot()),
+            result=json.dumps(result),
+            finished_at=time.time()
+        )
+        _record_event(job_id, "state", {"state": "done", "duplicates_found": result.get("duplicates_found", 0)})
+        print(f"✅ Scan job {job_id} finished: {result.get('duplicates_found', 0)} duplicates")
+    except (ProjectAccessError, ScanError) as e:
+        _update_job(job_id, state="failed", error=str(e), finished_at=time.time())
+        _record_event(job_id, "state", {"state": "failed", "error": str(e)})
+    except Exception as e:
+        print(f"❌ Scan job {job_id} failed: {e}")
+        _update_job(
+            job_id,
+            state="failed",
+            progress=json.dumps(progress.snapshot()),
+            error=str(e),
+            finished_at=time.time()
+        )
+        _record_event(job_id, "state", {"state": "failed", "error": str(e)})
+
+
+def submit_scan_job(params, priority="interactive"):
+    """Persist a queued scan job and hand it to the scan scheduler. Returns the job record."""
+    _ensure_schema()
+    _purge_expired()
+    job_id = uuid.uuid4().hex
+    get_connection().execute(
+        """
+        INSERT INTO scan_jobs (job_id, user_id, params, state, host, pid, created_at)
+        VALUES (?, ?, ?, 'queued', ?, ?, ?)
+        """,
+        (job_id, params["userId"], json.dumps(params), socket.gethostname(), os.getpid(), time.time())
+    )
+    _record_event(job_id, "state", {"state": "queued"})
+    get_scan_scheduler().submit(_run_job, job_id, params, user_id=params["userId"], priority=priority)
+    return get_scan_job(job_id)
+
+
+def get_scan_job(job_id):
+    """Return a job's state and progress, or None if it does not exist."""
+    _ensure_schema()
+    row = get_connection().execute("SELECT * FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    if row["state"] in ("queued", "running") and not _owner_alive(row):
+        _update_job(job_id, state="failed", error="Scan worker exited before the job finished", finished_at=time.time())
+        _record_event(job_id, "state", {"state": "failed", "error": "Scan worker exited before the job finished"})
+        row = get_connection().execute("SELECT * FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return _row_to_job(row)
+
+
+def get_scan_job_result(job_id):
+    """Return the stored result body of a finished job, or None."""
+    _ensure_schema()
+    row = get_connection().execute("SELECT result FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None or row["result"] is None:
+        return None
+    return json.loads(row["result"])
+
+
+def get_scan_job_events(job_id, after_seq=0, limit=500):
+    """Return events recorded for a job after `after_seq`, oldest first."""
+    _ensure_schema()
+    rows = get_connection().execute(
+        "SELECT seq, event, data, created_at FROM scan_job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+        (job_id, after_seq, limit)
+    ).fetchall()
+    return [
+        {"seq": row["seq"], "event": row["event"], "data": json.loads(row["data"]), "ts": row["created_at"]}
+        for row in rows
+    ]
@@ -0,0 +1,88 @@
+# utils/scan_progress.py
+import time
+from threading import Lock
+
+STAGES = ("listed", "downloaded", "fingerprinted", "reused", "compared", "clusters", "persisted")
+
+
+class ScanProgress:
+    """
+    Per-stage counters for a running scan.
+
+    Counter updates are cheap (a lock and a clock read). Listeners are called at most
+    once per `min_interval`: `on_update` gets the full snapshot and `on_event` gets one
+    structured event per counter that moved since the last report. Stage changes and
+    `flush()` always report immediately.
+    """
+
+    def __init__(self, on_update=None, on_event=None, min_interval: float = 0.5):
+        self.stage = "queued"
+        self.counters = {name: 0 for name in STAGES}
+        self.totals = {}
+        self._on_update = on_update
+        self._on_event = on_event
+        self._min_interval = min_interval
+        self._last_update = 0.0
+        self._reported = dict(self.counters)
+        self._stage_times = {}
+        self._started = time.monotonic()
+        self._stage_started = self._started
+        self._lock = Lock()
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            now = time.monotonic()
+            self._stage_times[self.stage] = self._stage_times.get(self.stage, 0.0) + now - self._stage_started
+            self._stage_started = now
+            self.stage = stage
+        self._notify(force=True, stage_changed=True)
+
+    def set_total(self, name: str, total: int):
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + total
+        self._notify()
+
+    def advance(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        self._notify()
+
+    def flush(self):
+        self._notify(force=True)
+
+    def timings(self) -> dict:
+        """Seconds spent per stage so far (stages may be entered more than once), plus the total."""
+        with self._lock:
+            now = time.monotonic()
+            timings = dict(self._stage_times)
+            timings[self.stage] = timings.get(self.stage, 0.0) + now - self._stage_started
+            timings.pop("queued", None)
+            timings.pop("done", None)
+            timings = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+            timings["total"] = round(now - self._started, 3)
+            return timings
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"stage": self.stage, "counters": dict(self.counters), "totals": dict(self.totals)}
+
+    def _notify(self, force: bool = False, stage_changed: bool = False):
+        if self._on_update is None and self._on_event is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_update < self._min_interval:
+            return
+        self._last_update = now
+        snapshot = self.snapshot()
+        try:
+            if self._on_event is not None:
+                for name, count in snapshot["counters"].items():
+                    if count != self._reported.get(name):
+                        self._on_event(name, {"count": count, "total": snapshot["totals"].get(name)})
+                if stage_changed:
+                    self._on_event("stage", {"stage": snapshot["stage"]})
+            self._reported = snapshot["counters"]
+            if self._on_update is not None:
+                self._on_update(snapshot)
+        except Exception as e:
+            print(f"⚠️  Progress callback failed: {e}")
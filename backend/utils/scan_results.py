@@ -0,0 +1,57 @@
+# utils/scan_results.py
+import json, time
+from utils.local_store import ensure_schema, get_connection
+
+
+def _ensure_schema():
+    ensure_schema("scan_results", [
+        """
+        CREATE TABLE IF NOT EXISTS scan_results (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            digest TEXT,
+            completed_at REAL NOT NULL
+        )
+        """
+    ], columns=[("scan_results", "digest", "TEXT")])
+
+
+def scan_request_key(user_id, project_id, service, database_id=None, collection_id=None):
+    """Identity of a scan request; identical requests share in-flight scans and cached results."""
+    return ":".join([user_id, project_id, service, database_id or "", collection_id or ""])
+
+
+def store_scan_result(key, result, digest=None):
+    """Store the latest result for `key` with the listing digest it was computed from."""
+    _ensure_schema()
+    get_connection().execute(
+        "INSERT OR REPLACE INTO scan_results (key, result, digest, completed_at) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(result), digest, time.time())
+    )
+
+
+def invalidate_scan_results(user_id, project_id):
+    """Drop stored results for a project, e.g. after its duplicates were edited."""
+    _ensure_schema()
+    get_connection().execute(
+        "DELETE FROM scan_results WHERE key LIKE ?", (f"{user_id}:{project_id}:%",)
+    )
+
+
+def load_scan_result(key, max_age=None, since=None):
+    """
+    Return {"result", "digest", "age"} for the last completed scan of `key`, or None
+    when there is none, it is older than `max_age`, or it finished before `since`.
+    """
+    _ensure_schema()
+    row = get_connection().execute(
+        "SELECT result, digest, completed_at FROM scan_results WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    age = time.time() - row["completed_at"]
+    if max_age is not None and age > max_age:
+        return None
+    if since is not None and row["completed_at"] < since:
+        return None
+    return {"result": json.loads(row["result"]), "digest": row["digest"], "age": age}
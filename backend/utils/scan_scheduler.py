@@ -0,0 +1,175 @@
+# utils/scan_scheduler.py
+import os, json, time, threading
+from collections import defaultdict, deque
+from concurrent.futures import Future
+
+# Lower value runs first
+PRIORITIES = {"interactive": 0, "scheduled": 1}
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))
+SCAN_INTERACTIVE_RESERVED = int(os.getenv("SCAN_INTERACTIVE_RESERVED", "1"))
+SCAN_PER_USER_LIMIT = int(os.getenv("SCAN_PER_USER_LIMIT", "2"))
+# Optional JSON map of userId -> weight for fair queuing, e.g. {"premium-user": 3}
+SCAN_TENANT_WEIGHTS = json.loads(os.getenv("SCAN_TENANT_WEIGHTS", "{}"))
+
+WAIT_SAMPLES = 500
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+class ScanScheduler:
+    """
+    Fixed pool of scan workers with priority classes, per-user concurrency caps and
+    weighted fair queuing across users.
+
+    Interactive work always goes before scheduled work, and `interactive_reserved`
+    workers never pick up scheduled work, so background reminders cannot occupy the
+    whole pool. Within a class the user with the least weighted service time so far
+    goes next; a user is charged for the time their scans actually ran, divided by
+    their weight.
+    """
+
+    def __init__(self, workers=SCAN_WORKERS, interactive_reserved=SCAN_INTERACTIVE_RESERVED,
+                 per_user_limit=SCAN_PER_USER_LIMIT, weights=None):
+        self.workers = max(1, workers)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.workers - 1)
+        self.per_user_limit = max(1, per_user_limit)
+        self.weights = weights if weights is not None else SCAN_TENANT_WEIGHTS
+        self._cond = threading.Condition()
+        self._queues = {priority: defaultdict(deque) for priority in PRIORITIES}
+        self._running_by_user = defaultdict(int)
+        self._running_by_class = defaultdict(int)
+        self._vtime = {}
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+        self._completed = defaultdict(int)
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scan-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, user_id, priority="interactive", **kwargs) -> Future:
+        """Queue `fn(*args, **kwargs)` for `user_id` in a priority class and return its Future."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown scan priority: {priority}")
+        future = Future()
+        task = {
+            "fn": fn,
+            "args": args,
+            "kwargs": kwargs,
+            "user_id": user_id,
+            "priority": priority,
+            "future": future,
+            "queued_at": time.monotonic()
+        }
+        with self._cond:
+            if not self._is_active(user_id):
+                self._vtime[user_id] = max(self._vtime.get(user_id, 0.0), self._min_active_vtime())
+            self._queues[priority][user_id].append(task)
+            self._cond.notify()
+        return future
+
+    def _active_users(self):
+        queued = {user_id for queues in self._queues.values() for user_id in queues}
+        return queued | set(self._running_by_user)
+
+    def _is_active(self, user_id):
+        return user_id in self._running_by_user or any(user_id in queues for queues in self._queues.values())
+
+    def _min_active_vtime(self):
+        """(Re)joining users start level with the least-served active user instead of banking idle credit."""
+        return min((self._vtime.get(user_id, 0.0) for user_id in self._active_users()), default=0.0)
+
+    def _next_task(self):
+        for priority in sorted(PRIORITIES, key=PRIORITIES.get):
+            if priority != "interactive" and \
+                    self._running_by_class[priority] >= self.workers - self.interactive_reserved:
+                continue
+            queues = self._queues[priority]
+            eligible = [
+                user_id for user_id, tasks in queues.items()
+                if tasks and self._running_by_user.get(user_id, 0) < self.per_user_limit
+            ]
+            if not eligible:
+                continue
+            user_id = min(eligible, key=lambda uid: self._vtime.get(uid, 0.0))
+            task = queues[user_id].popleft()
+            if not queues[user_id]:
+                del queues[user_id]
+            return task
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next_task()
+                user_id, priority = task["user_id"], task["priority"]
+                self._running_by_user[user_id] += 1
+                self._running_by_class[priority] += 1
+                self._waits[priority].append(time.monotonic() - task["queued_at"])
+
+            started = time.monotonic()
+            future = task["future"]
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(task["fn"](*task["args"], **task["kwargs"]))
+                except BaseException as e:
+                    future.set_exception(e)
+            elapsed = time.monotonic() - started
+
+            with self._cond:
+                self._running_by_user[user_id] -= 1
+                if not self._running_by_user[user_id]:
+                    del self._running_by_user[user_id]
+                self._running_by_class[priority] -= 1
+                self._vtime[user_id] = self._vtime.get(user_id, 0.0) + elapsed / float(self.weights.get(user_id, 1))
+                self._completed[priority] += 1
+                self._cond.notify_all()
+
+    def metrics(self) -> dict:
+        """Queue depth, running counts and recent queue-wait percentiles per priority class."""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "interactiveReserved": self.interactive_reserved,
+                "perUserLimit": self.per_user_limit,
+                "classes": {
+                    priority: {
+                        "queueDepth": sum(len(tasks) for tasks in self._queues[priority].values()),
+                        "queuedUsers": len(self._queues[priority]),
+                        "running": self._running_by_class[priority],
+                        "completed": self._completed[priority],
+                        "waitSeconds": {
+                            "p50": _percentile(self._waits[priority], 50),
+                            "p95": _percentile(self._waits[priority], 95),
+                            "max": round(max(self._waits[priority]), 3) if self._waits[priority] else None,
+                            "samples": len(self._waits[priority])
+                        }
+                    }
+                    for priority in PRIORITIES
+                },
+                "activeUsers": len(self._running_by_user)
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scan_scheduler() -> ScanScheduler:
+    """Process-wide scheduler, started on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ScanScheduler()
+        return _scheduler
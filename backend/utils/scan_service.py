@@ -0,0 +1,365 @@
+# utils/scan_service.py
+import os, json, hashlib, requests, time
+from concurrent.futures import Future
+from threading import Lock
+from appwrite.query import Query
+from utils.appwrite_client import get_database_client, list_all_documents, list_all_files
+from utils.blocking import detect_blocked_duplicates, get_blocking_config
+from utils.embedding_utils import detect_textual_duplicates
+from utils.file_utils import compute_exact_hash, detect_file_duplicates, is_current_fingerprint
+from utils.fingerprint_index import (
+    replace_bucket_index, replace_collection_embeddings, stored_document_embeddings, stored_fingerprints, text_tag
+)
+from utils.garden_stats import update_garden_stats
+from utils.duplicate_records import build_pair_records, sync_duplicate_records
+from utils.project_clients import get_owned_project, get_project_clients
+from utils.scan_coordinator import try_acquire_lease
+from utils.simhash import canonical_record_text
+from utils.scan_progress import ScanProgress
+from utils.scan_results import scan_request_key, store_scan_result, load_scan_result
+
+SCAN_RESULT_TTL = float(os.getenv("SCAN_RESULT_TTL", "10"))
+SCAN_WAIT_POLL_INTERVAL = 1.0
+# Bump when detection changes so stored digests stop matching results computed the old way
+SCAN_DIGEST_VERSION = 1
+
+# In-flight scans in this process, keyed by scan_request_key
+_inflight = {}
+_inflight_lock = Lock()
+
+
+class ScanError(Exception):
+    """Raised for scan requests that cannot be served, carrying the HTTP status to report."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def scan_lock_key(project_id, service):
+    return f"scan:{project_id}:{service}"
+
+
+def run_scan(user_id, project_id, service, database_id=None, collection_id=None, progress=None, force=False):
+    """
+    Scan a project's database or storage for duplicates, coalescing identical requests.
+
+    Requests with the same user, project, service, databaseId and collectionId share
+    one scan: callers arriving while it runs attach to it and receive its result, and
+    callers arriving within SCAN_RESULT_TTL seconds after it finished get the stored
+    result. A scan whose listing is unchanged since the last one returns that result
+    as well. `force` skips both shortcuts.
+    """
+    request_key = scan_request_key(user_id, project_id, service, database_id, collection_id)
+
+    if not force:
+        cached = load_scan_result(request_key, max_age=SCAN_RESULT_TTL)
+        if cached:
+            print(f"♻️  Serving scan result for {project_id}:{service} completed {cached['age']:.1f}s ago")
+            return {**cached["result"], "cached": True, "cachedAgeSeconds": round(cached["age"], 1)}
+
+    with _inflight_lock:
+        future = _inflight.get(request_key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[request_key] = future
+
+    if not leader:
+        print(f"🔗 Attaching to in-flight scan for {project_id}:{service}")
+        return {**future.result(), "coalesced": True}
+
+    try:
+        result = _lead_scan(request_key, user_id, project_id, service, database_id, collection_id, progress, force)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(request_key, None)
+
+
+def _lead_scan(request_key, user_id, project_id, service, database_id, collection_id, progress, force):
+    """Run the scan under the project+service lease, reusing another worker's result when it covers this request."""
+    arrived = time.time()
+    lease_key = scan_lock_key(project_id, service)
+
+    lease = try_acquire_lease(lease_key)
+    if lease is None:
+        print(f"⏳ Another worker is scanning {project_id}:{service}, waiting for it")
+    while lease is None:
+        time.sleep(SCAN_WAIT_POLL_INTERVAL)
+        shared = load_scan_result(request_key, since=arrived)
+        if shared:
+            return {**shared["result"], "coalesced": True}
+        lease = try_acquire_lease(lease_key)
+
+    with lease:
+        shared = load_scan_result(request_key, since=arrived)
+        if shared:
+            return {**shared["result"], "coalesced": True}
+        result = execute_scan(
+            user_id, project_id, service, database_id, collection_id, progress, lease,
+            digest_key=None if force else request_key
+        )
+        if not result.get("cached"):
+            store_scan_result(request_key, result, digest=result.get("changeDigest"))
+        return result
+
+
+def compute_change_digest(service, entries):
+    """Cheap digest of listing metadata (IDs, sizes, $updatedAt) that changes whenever the scanned data does."""
+    digest = hashlib.sha256(f"{SCAN_DIGEST_VERSION}:{service}".encode())
+    for entry in sorted(entries):
+        digest.update(("|".join(str(part) for part in entry) + "\n").encode())
+    return digest.hexdigest()
+
+
+def _unchanged_result(digest_key, digest):
+    """Previous result for `digest_key` if it was computed from the same listing, marked as cached."""
+    if not digest_key:
+        return None
+    previous = load_scan_result(digest_key)
+    if not previous or not previous["digest"] or previous["digest"] != digest:
+        return None
+    print(f"♻️  Listing unchanged since last scan ({previous['age']:.0f}s ago), reusing its result")
+    return {**previous["result"], "cached": True, "cachedAgeSeconds": round(previous["age"], 1)}
+
+
+def execute_scan(user_id, project_id, service, database_id=None, collection_id=None, progress=None, lease=None, digest_key=None):
+    """
+    Run the scan pipeline (list, download, fingerprint, compare, persist) and return the result body.
+
+    When `digest_key` is given and the listing metadata matches the digest stored with
+    that key's last result, the previous result is returned without downloads,
+    fingerprinting or writes.
+    """
+    if service == "database" and not database_id:
+        raise ScanError("Missing databaseId for database scan", 400)
+
+    main_db = get_database_client()
+    project_doc = get_owned_project(user_id, project_id, main_db)
+    db, storage = get_project_clients(project_doc)
+
+    scope_queries = [
+        Query.equal("projectId", project_id),
+        Query.equal("service", service)
+    ]
+    if service == "database" and database_id:
+        scope_queries.append(Query.equal("databaseId", database_id))
+        if collection_id:
+            scope_queries.append(Query.equal("collectionId", collection_id))
+
+    # Stage timings are reported with every result, so track progress even when nobody listens
+    progress = progress or ScanProgress()
+    duplicates = []
+    failed_locations = []
+    blocking_reports = {}
+    progress.set_stage("listing")
+
+    # Scan database
+    if service == "database":
+        collections_to_scan = [collection_id] if collection_id else [
+            c["$id"] for c in db.list_collections(database_id=database_id).get("collections", [])
+        ]
+        listings = []
+        for col_id in collections_to_scan:
+            try:
+                docs = list_all_documents(db, database_id, col_id)
+                listings.append((col_id, docs))
+                progress.advance("listed", len(docs))
+            except Exception as e:
+                failed_locations.append(f"collection:{database_id}/{col_id}")
+                print(f"Error listing collection {col_id}: {e}")
+
+        digest = compute_change_digest(service, [
+            (col_id, d["$id"], d.get("$updatedAt", ""))
+            for col_id, docs in listings for d in docs
+        ])
+        unchanged = _unchanged_result(digest_key, digest)
+        if unchanged:
+            progress.set_stage("done")
+            return {**unchanged, "timings": progress.timings()}
+
+        for col_id, docs in listings:
+            try:
+                if not docs:
+                    continue
+                progress.set_stage("fingerprinting")
+                records = [
+                    {"id": d["$id"], "text": json.dumps(d), "canonical": canonical_record_text(d)} for d in docs
+                ]
+                # Documents whose text is unchanged since the last scan keep their stored embedding
+                tags = {r["id"]: text_tag(r["text"]) for r in records}
+                embeddings = stored_document_embeddings(project_id, database_id, col_id, tags)
+                progress.advance("reused", len(embeddings))
+                stats = {}
+                blocking = get_blocking_config(project_id, database_id, col_id)
+                if blocking:
+                    clusters, blocking_reports[col_id] = detect_blocked_duplicates(
+                        records, docs, blocking, embeddings=embeddings, stats=stats
+                    )
+                else:
+                    clusters = detect_textual_duplicates(records, embeddings=embeddings, stats=stats)
+                replace_collection_embeddings(project_id, database_id, col_id, embeddings, tags)
+                progress.advance("fingerprinted", len(records))
+                progress.advance("compared", stats.get("compared", 0))
+                progress.advance("clusters", len(clusters))
+                for cluster_items in clusters:
+                    duplicates.append({
+                        "userId": user_id,
+                        "projectId": project_id,
+                        "service": service,
+                        "type": "text",
+                        "databaseId": database_id,
+                        "collectionId": col_id,
+                        "clusters": json.dumps(cluster_items)
+                    })
+            except Exception as e:
+                failed_locations.append(f"collection:{database_id}/{col_id}")
+                print(f"Error scanning collection {col_id}: {e}")
+
+    # Scan storage
+    elif service == "storage":
+        buckets = storage.list_buckets().get("buckets", [])
+        listings = []
+        for b in buckets:
+            try:
+                # Every page, so the change digest, the index and the sync all see the whole bucket
+                files = list_all_files(storage, b["$id"])
+                listings.append((b, files))
+                progress.advance("listed", len(files))
+            except Exception as e:
+                failed_locations.append(f"bucket:{b['$id']}")
+                print(f"Error listing bucket {b['$id']}: {e}")
+
+        digest = compute_change_digest(service, [
+            (b["$id"], fi["$id"], fi.get("sizeOriginal", ""), fi.get("$updatedAt", ""))
+            for b, files in listings for fi in files
+        ])
+        unchanged = _unchanged_result(digest_key, digest)
+        if unchanged:
+            progress.set_stage("done")
+            return {**unchanged, "timings": progress.timings()}
+
+        for b, files in listings:
+            try:
+                progress.set_stage("downloading")
+                file_records = []
+                # A file left out makes the result partial, so the bucket must not be vouched for
+                incomplete = False
+                for fi in files:
+                    file_id = fi["$id"]
+                    filename = fi.get("name", "")
+                    try:
+                        endpoint = project_doc.get("endpoint") or os.getenv("APPWRITE_ENDPOINT")
+                        project_api_id = project_doc.get("projectId")
+                        url = f"{endpoint}/storage/buckets/{b['$id']}/files/{file_id}/view?project={project_api_id}"
+                        if not str(url).startswith("https"):
+                            print(f"Skipping invalid URL for file {file_id}")
+                            incomplete = True
+                            continue
+                        try:
+                            resp = requests.get(url, timeout=30)
+                            resp.raise_for_status()
+                            file_bytes = resp.content
+                            file_records.append({
+                                "id": file_id,
+                                "url": url,
+                                "filename": filename,
+                                "file_bytes": file_bytes,
+                                "md5": compute_exact_hash(file_bytes)
+                            })
+                            progress.advance("downloaded")
+                        except Exception as e:
+                            print(f"Failed to fetch file {file_id}: {e}")
+                            incomplete = True
+                            continue
+                    except Exception as e:
+                        print(f"Error constructing URL for file {file_id}: {e}")
+                        incomplete = True
+                        continue
+                if incomplete:
+                    failed_locations.append(f"bucket:{b['$id']}")
+                # Files whose content is unchanged since the last scan keep their stored fingerprint
+                stored = stored_fingerprints(project_id, b["$id"])
+                fingerprints = {
+                    record["id"]: stored[record["id"]]["fingerprint"]
+                    for record in file_records
+                    if record["id"] in stored and stored[record["id"]]["md5"] == record["md5"] and stored[record["id"]]["fingerprint"]
+                    and is_current_fingerprint(stored[record["id"]]["fingerprint"], record["filename"])
+                }
+                progress.advance("reused", len(fingerprints))
+                if file_records:
+                    progress.set_stage("fingerprinting")
+                    clusters = detect_file_duplicates(file_records, progress=progress, fingerprints=fingerprints)
+                    for cluster_items in clusters:
+                        clean_cluster = []
+                        for item in cluster_items:
+                            clean_item = {
+                                "id": item.get("id"),
+                                "url": item.get("url"),
+                                "filename": item.get("filename"),
+                                "similarity_score": item.get("similarity_score", 1.0)
+                            }
+                            clean_cluster.append(clean_item)
+                        duplicates.append({
+                            "userId": user_id,
+                            "projectId": project_id,
+                            "service": service,
+                            "type": "file",
+                            "bucketId": b["$id"],
+                            "clusters": json.dumps(clean_cluster)
+                        })
+
+                # Keep the fingerprints so single files can be checked against this bucket without a scan
+                replace_bucket_index(project_id, b["$id"], [
+                    {
+                        "id": record["id"],
+                        "filename": record["filename"],
+                        "md5": record["md5"],
+                        "fingerprint": fingerprints[record["id"]]
+                    }
+                    for record in file_records if record["id"] in fingerprints
+                ])
+            except Exception as e:
+                failed_locations.append(f"bucket:{b['$id']}")
+                print(f"Error scanning bucket {b['$id']}: {e}")
+    else:
+        digest = None
+
+    if lease:
+        lease.ensure_held()
+    progress.set_stage("persisting")
+    pair_records = build_pair_records(duplicates)
+    sync = sync_duplicate_records(main_db, scope_queries, pair_records, skip_locations=failed_locations, progress=progress)
+
+    try:
+        update_garden_stats(
+            user_id=user_id,
+            increment_scans=1,
+            increment_duplicates=sync["inserted"]
+        )
+    except Exception as e:
+        print(f"⚠️  Failed to update garden stats: {e}")
+
+    progress.set_stage("done")
+
+    return {
+        "status": "success",
+        "duplicates_found": len(sync["documents"]),
+        "total_attempted": len(pair_records),
+        "inserted": sync["inserted"],
+        "updated": sync["updated"],
+        "retired": sync["retired"],
+        "preserved": sync["preserved"],
+        "cached": False,
+        "timings": progress.timings(),
+        # Block-size distribution per collection scanned with a blocking configuration
+        "blocking": blocking_reports,
+        # A partial scan must not vouch for the listing, or the failed part would never be rescanned
+        "changeDigest": None if failed_locations else digest,
+        "data": sync["documents"]
+    }
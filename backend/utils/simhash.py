@@ -0,0 +1,145 @@
+# utils/simhash.py
+import os, re, json, math
+import numpy as np
+
+SIMHASH_SHINGLE_SIZE = int(os.getenv("SIMHASH_SHINGLE_SIZE", "5"))
+# Lookup tables, each keyed by fixed random bit positions of the hash; records sharing a
+# key in any table are candidates. Keys get enough bits that a bucket holds about
+# SIMHASH_BUCKET_TARGET distinct hashes however many there are (at least 8 bits), so
+# occupancy does not grow with the collection. More tables catch more distant pairs.
+SIMHASH_TABLES = int(os.getenv("SIMHASH_TABLES", "24"))
+SIMHASH_BUCKET_TARGET = int(os.getenv("SIMHASH_BUCKET_TARGET", "16"))
+# Candidates further apart than this many bits are dropped before confirmation
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "12"))
+# Buckets larger than this are split by further bits until they fit
+SIMHASH_MAX_BUCKET = int(os.getenv("SIMHASH_MAX_BUCKET", "200"))
+# Bits added per split of an oversized bucket
+_SPLIT_BITS = 4
+
+# Appwrite metadata differs between otherwise identical documents
+SYSTEM_FIELDS = {"$id", "$sequence", "$createdAt", "$updatedAt", "$permissions", "$databaseId", "$collectionId", "$tenant"}
+_WHITESPACE = re.compile(r"\s+")
+
+
+def canonical_record_text(doc):
+    """Record content without system fields, with keys sorted and case/whitespace folded."""
+    content = {key: value for key, value in doc.items() if key not in SYSTEM_FIELDS}
+    text = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return _WHITESPACE.sub(" ", text.lower())
+
+
+def _shingle_hashes(text, size=SIMHASH_SHINGLE_SIZE):
+    """Distinct 64-bit hashes of every `size`-byte window of the UTF-8 text (polynomial hash, splitmix64 finish)."""
+    data = np.frombuffer(text.encode(), dtype=np.uint8).astype(np.uint64)
+    if not len(data):
+        return data
+    size = min(size, len(data))
+    count = len(data) - size + 1
+    with np.errstate(over="ignore"):
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * np.uint64(1099511628211) + data[offset:offset + count]
+        hashes = np.unique(hashes)
+        hashes ^= hashes >> np.uint64(30)
+        hashes *= np.uint64(0xBF58476D1CE4E5B9)
+        hashes ^= hashes >> np.uint64(27)
+        hashes *= np.uint64(0x94D049BB133111EB)
+        hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+def simhash64(text):
+    """64-bit SimHash of the character shingles of `text`."""
+    hashes = _shingle_hashes(text)
+    if not len(hashes):
+        return 0
+    bits = np.unpackbits(hashes.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(hashes)
+    return int(np.packbits(majority, bitorder="little").view("<u8")[0])
+
+
+def hamming64(a, b):
+    return (a ^ b).bit_count()
+
+
+if hasattr(np, "bitwise_count"):
+    def _popcount64(values):
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount64(values):
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(*values.shape, 8).sum(axis=-1)
+
+
+def _table_orders(tables):
+    """A fixed pseudo-random order of the 64 bit positions per table (the same in every process)."""
+    rng = np.random.default_rng(0x5eed)
+    return [rng.permutation(64) for _ in range(tables)]
+
+
+def _keys(values, positions):
+    keys = np.zeros(len(values), dtype=np.uint64)
+    for shift, position in enumerate(positions):
+        keys |= ((values >> np.uint64(position)) & np.uint64(1)) << np.uint64(shift)
+    return keys
+
+
+def _bucket_pairs(values, members, order, used, max_distance, max_bucket, pairs):
+    """
+    Add the close pairs among `members` (indexes into `values`) to `pairs`. An oversized
+    bucket is split by the next _SPLIT_BITS positions of `order` instead of being dropped;
+    distinct hashes always separate before the positions run out.
+    """
+    if len(members) > max_bucket and used < len(order):
+        keys = _keys(values[members], order[used:used + _SPLIT_BITS])
+        for key in np.unique(keys):
+            part = members[keys == key]
+            if len(part) > 1:
+                _bucket_pairs(values, part, order, used + _SPLIT_BITS, max_distance, max_bucket, pairs)
+        return
+    distances = _popcount64(values[members][:, None] ^ values[members][None, :])
+    for a, b in zip(*np.nonzero(np.triu(distances <= max_distance, k=1))):
+        a, b = int(members[a]), int(members[b])
+        pairs.add((min(a, b), max(a, b)))
+
+
+def candidate_groups(hashes, tables=SIMHASH_TABLES, max_distance=SIMHASH_MAX_DISTANCE, max_bucket=SIMHASH_MAX_BUCKET):
+    """
+    Group records by identical SimHash and find candidate pairs between groups.
+
+    Returns (groups, pairs): `groups` lists record indexes per distinct hash (in order
+    of first appearance) and `pairs` holds group index pairs (a, b), a < b, whose hashes
+    share the key of at least one table and differ in at most `max_distance` bits. Work
+    grows with distinct hashes, so a collection of exact copies stays cheap however large
+    it is.
+    """
+    by_hash = {}
+    groups = []
+    for i, value in enumerate(hashes):
+        group = by_hash.get(value)
+        if group is None:
+            group = by_hash[value] = len(groups)
+            groups.append([])
+        groups[group].append(i)
+
+    values = np.fromiter(by_hash, dtype=np.uint64, count=len(by_hash))
+    bits = min(32, max(8, math.ceil(math.log2(max(len(values) / SIMHASH_BUCKET_TARGET, 1)))))
+    pairs = set()
+    for order in _table_orders(tables):
+        keys = _keys(values, order[:bits])
+        ranked = np.argsort(keys, kind="stable")
+        ranked_keys = keys[ranked]
+        starts = np.flatnonzero(np.r_[True, ranked_keys[1:] != ranked_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(ranked)])
+        for start, size in zip(starts[sizes > max_bucket], sizes[sizes > max_bucket]):
+            _bucket_pairs(values, ranked[start:start + size], order, bits, max_distance, max_bucket, pairs)
+
+        # Buckets that fit are compared together: offset k pairs every member with the one k places later
+        fits = np.repeat(sizes <= max_bucket, sizes)
+        for offset in range(1, int(sizes[sizes <= max_bucket].max(initial=1))):
+            same = fits[:-offset] & (ranked_keys[:-offset] == ranked_keys[offset:])
+            a, b = ranked[:-offset][same], ranked[offset:][same]
+            close = _popcount64(values[a] ^ values[b]) <= max_distance
+            pairs.update(zip(np.minimum(a, b)[close].tolist(), np.maximum(a, b)[close].tolist()))
+    return groups, pairs
@@ -0,0 +1,432 @@
+# utils/vector_store.py
+import os, shutil, hashlib, threading, fcntl
+from contextlib import contextmanager
+import numpy as np
+from utils.local_store import STATE_DIR, ensure_schema, get_connection, transaction
+
+VECTOR_DIR = os.path.join(STATE_DIR, "vectors")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")
+# Bumped when the on-disk layout changes; stores in an older format are discarded
+VECTOR_STORE_FORMAT = 2
+# A store is compacted once tombstoned rows make up this share of it
+VECTOR_COMPACT_RATIO = float(os.getenv("VECTOR_COMPACT_RATIO", "0.3"))
+VECTOR_COMPACT_MIN_ROWS = 256
+# Stores at least this large are searched by Hamming distance on sign-bit codes first
+HAMMING_MIN_ROWS = int(os.getenv("VECTOR_HAMMING_MIN_ROWS", "1024"))
+# Candidates kept for exact re-ranking: k times this, and never fewer than HAMMING_MIN_CANDIDATES
+HAMMING_OVERSAMPLE = 10
+HAMMING_MIN_CANDIDATES = 256
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values]
+
+# (projectId, namespace) -> (generation, rows, (vectors, codes)) last mapped by this process
+_maps = {}
+_maps_lock = threading.Lock()
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def _ensure_schema():
+    ensure_schema("vector_store", [
+        """
+        CREATE TABLE IF NOT EXISTS vector_stores (
+            project_id TEXT NOT NULL,
+            namespace TEXT NOT NULL,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            dtype TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            rows_written INTEGER NOT NULL,
+            dead INTEGER NOT NULL,
+            format INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (project_id, namespace)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS vector_rows (
+            project_id TEXT NOT NULL,
+            namespace TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            tag TEXT,
+            PRIMARY KEY (project_id, namespace, object_id)
+        )
+        """
+    ], columns=[("vector_stores", "format", "INTEGER NOT NULL DEFAULT 1")])
+
+
+def _slug(value):
+    return hashlib.sha1(value.encode()).hexdigest()[:16]
+
+
+def _project_dir(project_id):
+    return os.path.join(VECTOR_DIR, _slug(project_id))
+
+
+def normalize_rows(vectors):
+    """L2-normalize each row, so cosine similarity is a plain dot product."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def sign_codes(vectors):
+    """One bit per dimension (set where the component is positive), packed into bytes."""
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+
+def _dot(matrix, query, chunk_rows=8192):
+    """matrix @ query in float32, converting float16 rows a chunk at a time (numpy has no fast float16 matmul)."""
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    return np.concatenate([
+        matrix[i:i + chunk_rows].astype(np.float32) @ query for i in range(0, len(matrix), chunk_rows)
+    ]) if len(matrix) else np.zeros(0, dtype=np.float32)
+
+
+class VectorSnapshot:
+    """
+    A consistent view of a store: live IDs, their rows and the mapped matrices.
+
+    Vectors are unit length, so scores are dot products. The matrices are the
+    memory-mapped files themselves, so reads do not copy them; rows left behind by
+    updates and deletes are skipped until the store is compacted.
+    """
+
+    def __init__(self, ids, rows, vectors, tags=None, codes=None):
+        self.ids = ids
+        self.rows = rows
+        self.vectors = vectors
+        self.codes = codes
+        self.tags = tags or {}
+        self._positions = {object_id: i for i, object_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, object_id):
+        position = self._positions.get(object_id)
+        return None if position is None else np.asarray(self.vectors[self.rows[position]], dtype=np.float32)
+
+    def matrix(self):
+        """Live vectors in `ids` order; a view of the mapping when the store has no tombstones."""
+        if len(self.rows) == len(self.vectors) and np.array_equal(self.rows, np.arange(len(self.rows))):
+            return self.vectors
+        return self.vectors[self.rows]
+
+    def similarities(self, query):
+        """Exact cosine similarity of every live vector to `query`, clipped to [0, 1], in `ids` order."""
+        if not self.ids:
+            return np.zeros(0, dtype=np.float32)
+        return np.clip(_dot(self.matrix(), normalize_rows(query)), 0.0, 1.0)
+
+    def _candidates(self, query, k):
+        """Positions worth scoring exactly: the closest by Hamming distance on large stores, else all."""
+        count = max((k or 0) * HAMMING_OVERSAMPLE, HAMMING_MIN_CANDIDATES)
+        if self.codes is None or len(self.ids) < HAMMING_MIN_ROWS or count >= len(self.ids):
+            return np.arange(len(self.ids))
+        distances = _popcount(self.codes[self.rows] ^ sign_codes(query)).sum(axis=1, dtype=np.int32)
+        return np.argpartition(distances, count)[:count]
+
+    def search(self, query, k=None, threshold=None, exclude=()):
+        """
+        Return [(id, score)] of the most similar live vectors, best first: at most `k`,
+        and only those scoring at least `threshold` (cosine, 0-1).
+
+        Large stores are narrowed by Hamming distance between sign-bit codes, then the
+        survivors are re-ranked by exact cosine.
+        """
+        if not self.ids:
+            return []
+        query = normalize_rows(query)
+        positions = self._candidates(query, k + len(exclude) if k else None)
+        scores = np.clip(_dot(self.vectors[self.rows[positions]], query), 0.0, 1.0)
+        results = []
+        for i in np.argsort(-scores):
+            if threshold is not None and scores[i] < threshold:
+                break
+            object_id = self.ids[positions[i]]
+            if object_id in exclude:
+                continue
+            results.append((object_id, float(scores[i])))
+            if k and len(results) == k:
+                break
+        return results
+
+
+EMPTY_SNAPSHOT = VectorSnapshot([], np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32))
+
+
+class VectorStore:
+    """
+    Append-only file of unit vectors (float16 by default) for one namespace of a
+    project (e.g. the PDFs of a bucket), a parallel file of their sign-bit codes,
+    and the ID map and tombstones in the state database.
+
+    A store is tied to the model and dimension that produced it: opening it for a
+    different one discards the old vectors instead of mixing incompatible spaces.
+    """
+
+    def __init__(self, project_id, namespace, model, dtype=VECTOR_STORE_DTYPE, binary=True):
+        self.project_id = project_id
+        self.namespace = namespace
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        self.binary = binary
+
+    # Files and locking
+
+    def _path(self, generation, suffix="bin"):
+        return os.path.join(_project_dir(self.project_id), f"{_slug(self.namespace)}.{generation}.{suffix}")
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers of this store across threads and worker processes."""
+        key = (self.project_id, self.namespace)
+        with _write_locks_guard:
+            lock = _write_locks.setdefault(key, threading.Lock())
+        os.makedirs(_project_dir(self.project_id), exist_ok=True)
+        with lock, open(os.path.join(_project_dir(self.project_id), f"{_slug(self.namespace)}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta(self, conn):
+        row = conn.execute(
+            "SELECT * FROM vector_stores WHERE project_id = ? AND namespace = ?", (self.project_id, self.namespace)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _compatible(self, meta, dim=None):
+        return meta is not None and meta["model"] == self.model and meta["dtype"] == self.dtype.name and \
+            meta["format"] == VECTOR_STORE_FORMAT and (dim is None or meta["dim"] == dim)
+
+    def _reset(self, conn, meta, dim):
+        """Start an empty generation for `dim`, dropping whatever the store held."""
+        generation = meta["generation"] + 1 if meta else 0
+        conn.execute("DELETE FROM vector_rows WHERE project_id = ? AND namespace = ?", (self.project_id, self.namespace))
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO vector_stores (project_id, namespace, model, dim, dtype, generation, rows_written, dead, format)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?)
+            """,
+            (self.project_id, self.namespace, self.model, dim, self.dtype.name, generation, VECTOR_STORE_FORMAT)
+        )
+        return {"generation": generation, "rows_written": 0, "dead": 0, "dim": dim}
+
+    @staticmethod
+    def _write_at(path, offset, data):
+        with open(path, "r+b" if os.path.exists(path) else "wb") as fh:
+            fh.seek(offset)
+            fh.write(data)
+
+    def _write_rows(self, generation, start, vectors):
+        """Write unit vectors (and their sign codes) from row `start` on."""
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        self._write_at(self._path(generation), start * vectors.shape[1] * self.dtype.itemsize, vectors.tobytes())
+        if self.binary:
+            codes = sign_codes(vectors)
+            self._write_at(self._path(generation, "codes"), start * codes.shape[1], codes.tobytes())
+
+    def _remove_generation(self, generation):
+        for suffix in ("bin", "codes"):
+            try:
+                os.remove(self._path(generation, suffix))
+            except FileNotFoundError:
+                pass
+
+    # Writes
+
+    def put_many(self, items):
+        """Append (object_id, vector, tag) items; earlier rows of the same IDs become tombstones."""
+        items = list(items)
+        if not items:
+            return
+        vectors = normalize_rows(np.stack([np.asarray(vector, dtype=np.float32).ravel() for _, vector, _ in items]))
+        dim = vectors.shape[1]
+        _ensure_schema()
+        with self._write_lock():
+            with transaction() as conn:
+                meta = self._meta(conn)
+                stale_generation = None
+                if not self._compatible(meta, dim):
+                    stale_generation = meta["generation"] if meta else None
+                    meta = self._reset(conn, meta, dim)
+                start = meta["rows_written"]
+                self._write_rows(meta["generation"], start, vectors)
+                ids = [object_id for object_id, _, _ in items]
+                replaced = conn.execute(
+                    f"SELECT COUNT(*) AS n FROM vector_rows WHERE project_id = ? AND namespace = ? AND object_id IN ({','.join('?' * len(ids))})",
+                    (self.project_id, self.namespace, *ids)
+                ).fetchone()["n"]
+                conn.executemany(
+                    "INSERT OR REPLACE INTO vector_rows (project_id, namespace, object_id, row, tag) VALUES (?, ?, ?, ?, ?)",
+                    [(self.project_id, self.namespace, object_id, start + i, tag) for i, (object_id, _, tag) in enumerate(items)]
+                )
+                # Repeated IDs within one batch also leave tombstones behind
+                dead = replaced + len(items) - len(set(ids))
+                conn.execute(
+                    "UPDATE vector_stores SET rows_written = ?, dead = dead + ? WHERE project_id = ? AND namespace = ?",
+                    (start + len(items), dead, self.project_id, self.namespace)
+                )
+            if stale_generation is not None:
+                self._remove_generation(stale_generation)
+            self._compact_locked()
+
+    def put(self, object_id, vector, tag=None):
+        self.put_many([(object_id, vector, tag)])
+
+    def delete_many(self, object_ids):
+        """Tombstone the rows of `object_ids`."""
+        object_ids = list(object_ids)
+        if not object_ids:
+            return
+        _ensure_schema()
+        with self._write_lock():
+            with transaction() as conn:
+                removed = conn.execute(
+                    f"DELETE FROM vector_rows WHERE project_id = ? AND namespace = ? AND object_id IN ({','.join('?' * len(object_ids))})",
+                    (self.project_id, self.namespace, *object_ids)
+                ).rowcount
+                conn.execute(
+                    "UPDATE vector_stores SET dead = dead + ? WHERE project_id = ? AND namespace = ?",
+                    (removed, self.project_id, self.namespace)
+                )
+            self._compact_locked()
+
+    def delete(self, object_id):
+        self.delete_many([object_id])
+
+    def replace(self, items):
+        """Replace the whole store with (object_id, vector, tag) items, written as a fresh generation."""
+        items = list(items)
+        _ensure_schema()
+        if not items and self._meta(get_connection()) is None:
+            return
+        with self._write_lock():
+            with transaction() as conn:
+                meta = self._meta(conn)
+                if not items:
+                    conn.execute("DELETE FROM vector_rows WHERE project_id = ? AND namespace = ?", (self.project_id, self.namespace))
+                    conn.execute("DELETE FROM vector_stores WHERE project_id = ? AND namespace = ?", (self.project_id, self.namespace))
+                else:
+                    vectors = normalize_rows(np.stack([np.asarray(vector, dtype=np.float32).ravel() for _, vector, _ in items]))
+                    fresh = self._reset(conn, meta, vectors.shape[1])
+                    unique = dict(zip((object_id for object_id, _, _ in items), range(len(items))))
+                    self._write_rows(fresh["generation"], 0, vectors)
+                    conn.executemany(
+                        "INSERT INTO vector_rows (project_id, namespace, object_id, row, tag) VALUES (?, ?, ?, ?, ?)",
+                        [(self.project_id, self.namespace, object_id, row, items[row][2]) for object_id, row in unique.items()]
+                    )
+                    conn.execute(
+                        "UPDATE vector_stores SET rows_written = ?, dead = ? WHERE project_id = ? AND namespace = ?",
+                        (len(items), len(items) - len(unique), self.project_id, self.namespace)
+                    )
+            if meta:
+                self._remove_generation(meta["generation"])
+
+    def _compact_locked(self, force=False):
+        """Rewrite the live rows into a new generation once tombstones pile up. Caller holds the write lock."""
+        conn = get_connection()
+        meta = self._meta(conn)
+        if meta is None or meta["dead"] == 0:
+            return False
+        if not force and (meta["dead"] < VECTOR_COMPACT_MIN_ROWS or meta["dead"] < meta["rows_written"] * VECTOR_COMPACT_RATIO):
+            return False
+
+        live = conn.execute(
+            "SELECT object_id, row FROM vector_rows WHERE project_id = ? AND namespace = ? ORDER BY row",
+            (self.project_id, self.namespace)
+        ).fetchall()
+        generation = meta["generation"] + 1
+        if live:
+            old = np.memmap(self._path(meta["generation"]), dtype=self.dtype, mode="r", shape=(meta["rows_written"], meta["dim"]))
+            self._write_rows(generation, 0, old[[row["row"] for row in live]])
+            del old
+        with transaction() as conn:
+            conn.executemany(
+                "UPDATE vector_rows SET row = ? WHERE project_id = ? AND namespace = ? AND object_id = ?",
+                [(i, self.project_id, self.namespace, row["object_id"]) for i, row in enumerate(live)]
+            )
+            conn.execute(
+                "UPDATE vector_stores SET generation = ?, rows_written = ?, dead = 0 WHERE project_id = ? AND namespace = ?",
+                (generation, len(live), self.project_id, self.namespace)
+            )
+        # Readers that mapped the old file keep it open; only the name goes away
+        self._remove_generation(meta["generation"])
+        print(f"🧹 Compacted vectors {self.namespace}: {meta['rows_written']} -> {len(live)} rows")
+        return True
+
+    def compact(self, force=True):
+        _ensure_schema()
+        with self._write_lock():
+            return self._compact_locked(force=force)
+
+    # Reads
+
+    def _map(self, meta):
+        """Return (vectors, codes or None) mapped for the store's current generation."""
+        key = (self.project_id, self.namespace)
+        with _maps_lock:
+            cached = _maps.get(key)
+        if cached and cached[0] == meta["generation"] and cached[1] == meta["rows_written"]:
+            return cached[2]
+        shape = (meta["rows_written"], meta["dim"])
+        vectors = np.memmap(self._path(meta["generation"]), dtype=self.dtype, mode="r", shape=shape)
+        codes = None
+        if self.binary:
+            codes = np.memmap(
+                self._path(meta["generation"], "codes"), dtype=np.uint8, mode="r", shape=(shape[0], (shape[1] + 7) // 8)
+            )
+        with _maps_lock:
+            _maps[key] = (meta["generation"], meta["rows_written"], (vectors, codes))
+        return vectors, codes
+
+    def snapshot(self, dim=None):
+        """Return a VectorSnapshot; empty when nothing is stored or it was written by another model."""
+        _ensure_schema()
+        conn = get_connection()
+        for _ in range(2):
+            conn.execute("BEGIN")
+            try:
+                meta = self._meta(conn)
+                rows = conn.execute(
+                    "SELECT object_id, row, tag FROM vector_rows WHERE project_id = ? AND namespace = ? ORDER BY row",
+                    (self.project_id, self.namespace)
+                ).fetchall()
+            finally:
+                conn.execute("COMMIT")
+            if not self._compatible(meta, dim) or not rows:
+                return EMPTY_SNAPSHOT
+            try:
+                vectors, codes = self._map(meta)
+            except FileNotFoundError:
+                continue  # Compacted between reading the rows and mapping the file
+            return VectorSnapshot(
+                [row["object_id"] for row in rows],
+                np.array([row["row"] for row in rows], dtype=np.int64),
+                vectors,
+                {row["object_id"]: row["tag"] for row in rows},
+                codes
+            )
+        return EMPTY_SNAPSHOT
+
+
+def drop_project_vectors(project_id):
+    """Remove every vector store of a project."""
+    _ensure_schema()
+    with transaction() as conn:
+        conn.execute("DELETE FROM vector_rows WHERE project_id = ?", (project_id,))
+        conn.execute("DELETE FROM vector_stores WHERE project_id = ?", (project_id,))
+    with _maps_lock:
+        for key in [key for key in _maps if key[0] == project_id]:
+            del _maps[key]
+    shutil.rmtree(_project_dir(project_id), ignore_errors=True)
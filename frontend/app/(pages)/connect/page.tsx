@@ -54,6 +54,7 @@ export default function ConnectProjectPage() {
   const [projectId, setProjectId] = useState("");
   const [endpoint, setEndpoint] = useState("");
   const [apiKey, setApiKey] = useState("");
+  const [webhookKey, setWebhookKey] = useState("");
   const [loading, setLoading] = useState(false);
   const [showLoader, setShowLoader] = useState(true);
   const [success, setSuccess] = useState(false);
@@ -122,6 +123,7 @@ export default function ConnectProjectPage() {
           projectId,
           endpoint,
           apiKey,
+          ...(webhookKey ? { webhookKey } : {}),
         }
       );
 
@@ -283,6 +285,26 @@ export default function ConnectProjectPage() {
                 />
               </div>
 
+              {/* Webhook Signature Key */}
+              <div className="space-y-2">
+                <Label
+                  htmlFor="webhookKey"
+                  className="text-gray-300 flex items-center gap-2"
+                >
+                  <Key className="w-4 h-4 text-primary" />
+                  Webhook Signature Key (optional)
+                </Label>
+                <Input
+                  id="webhookKey"
+                  type="password"
+                  placeholder="Signature key of your Appwrite webhook"
+                  value={webhookKey}
+                  onChange={(e) => setWebhookKey(e.target.value)}
+                  className="bg-white/5 border-white/10 focus:border-primary/50 text-white placeholder:text-gray-500"
+                  disabled={loading || success}
+                />
+              </div>
+
               {/* Info Box */}
               <div className="flex items-start gap-3 p-4 rounded-lg bg-primary/10 border border-primary/20">
                 <Info className="w-5 h-5 text-primary shrink-0 mt-0.5" />
@@ -23,6 +23,8 @@ const BUCKET_ID =
   process.env.NEXT_PUBLIC_APPWRITE_BUCKET_ID || "profile_pictures";
 const BACKEND_URL =
   process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:5000";
+const DELETE_POLL_INTERVAL = 3000;
+const DELETE_POLL_ATTEMPTS = 200;
 
 export default function ProfilePage() {
   const { user, refreshUser } = useAuth();
@@ -131,6 +133,22 @@ export default function ProfilePage() {
     }
   };
 
+  // Poll the account deletion job until it completes, fails, or polling gives up
+  const waitForAccountDeletion = async (userId: string) => {
+    for (let attempt = 0; attempt < DELETE_POLL_ATTEMPTS; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, DELETE_POLL_INTERVAL));
+      const res = await fetch(
+        `${BACKEND_URL}/api/delete-account/status?userId=${encodeURIComponent(userId)}`
+      );
+      if (!res.ok) continue;
+      const job = await res.json();
+      if (job?.state === "completed" || job?.state === "failed") {
+        return job.state as string;
+      }
+    }
+    return "running";
+  };
+
   // Account Deletion Handler
   const handleDeleteConfirm = async () => {
     setDeleting(true);
@@ -146,6 +164,18 @@ export default function ProfilePage() {
         throw new Error(errorData?.error || "Failed to delete account");
       }
 
+      // Large accounts keep deleting in the background: wait for the job to finish
+      if (res.status === 202) {
+        const state = await waitForAccountDeletion(user.$id);
+        if (state === "failed") {
+          throw new Error("Account deletion failed, it will be retried automatically.");
+        }
+        if (state !== "completed") {
+          toast.info("Account deletion is still running, you will be signed out once it finishes.");
+          return;
+        }
+      }
+
       toast.success("Account deleted successfully!");
       localStorage.removeItem("cookieFallback");
       window.location.href = "/";